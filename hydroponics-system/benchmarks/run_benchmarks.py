@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+Benchmark Suite
+Runs the controller (single and multi-tank), sensors and web interface against the simulated
+hardware and compares the results with stored baselines.
+
+    python benchmarks/run_benchmarks.py            # run and compare
+    python benchmarks/run_benchmarks.py --save     # store new baselines
+"""
+
+import os
+import sys
+import json
+import time
+import types
+import logging
+import argparse
+import tempfile
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+
+
+def setup_paths():
+    """Make the project importable from a source checkout or an install"""
+    # Installed layout keeps the packages next to main.py, a checkout under modules/
+    for path in (os.path.join(ROOT, 'modules'), ROOT):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    if not os.path.isdir(os.path.join(ROOT, 'config')):
+        # Checkout: settings.py sits at the top level instead of config/
+        import settings
+        config = types.ModuleType('config')
+        config.settings = settings
+        sys.modules['config'] = config
+        sys.modules['config.settings'] = settings
+
+
+def configure(workdir):
+    """Point every file the system writes at a scratch directory"""
+    from config.settings import Settings
+    Settings.data_file = os.path.join(workdir, 'current_data.json')
+    Settings.history_db = os.path.join(workdir, 'history.db')
+    Settings.snapshot_shm_path = os.path.join(workdir, 'snapshot')
+    Settings.metrics_shm_path = os.path.join(workdir, 'metrics')
+    Settings.command_socket_path = os.path.join(workdir, 'commands')
+    Settings.calibration_file = os.path.join(workdir, 'calibration.json')
+    Settings.alert_file = os.path.join(workdir, 'alerts.jsonl')
+    return Settings
+
+
+def timed(fn, repeat, setup=None):
+    """Run fn `repeat` times, returning per-call latencies in ms (setup() runs untimed before each)"""
+    latencies = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def bench_cycle_latency(settings, concurrent, cycles):
+    """One full control cycle: read_sensors (with alerts), control
+
+    As in the scheduler, the temperature conversion is started one
+    conversion time before the cycle.
+    """
+    import main
+    settings.concurrent_acquisition = concurrent
+    controller = main.HydroponicController()
+    try:
+        def start_temperature():
+            controller.temp_sensor.start()
+            time.sleep(controller.temp_sensor.conversion_time())
+
+        def cycle():
+            controller.read_sensors()
+            controller.control()
+        cycle()  # warm up
+        latencies = timed(cycle, cycles, start_temperature)
+    finally:
+        controller.stop()
+    return {'median_ms': statistics.median(latencies), 'max_ms': max(latencies)}
+
+
+def bench_multi_tank(settings, tanks, cycles):
+    """One control cycle over several tanks sharing the SPI bus and worker pool"""
+    import sim
+    import main
+    configs = []
+    for i in range(tanks):
+        name = f"tank{i}"
+        ports = {f"/dev/sim{i}-nutrient": 'nutrient', f"/dev/sim{i}-ph": 'ph'}
+        sim.attach_tank(sim.TankModel(seed=i), tds_channel=2 * i, ph_channel=2 * i + 1,
+                        trig_pin=100 + i, echo_pin=200 + i, probe_id=f"probe{i}",
+                        pump_ports=ports)
+        configs.append({
+            'name': name, 'tds_channel': 2 * i, 'ph_channel': 2 * i + 1,
+            'ultrasonic_trig': 100 + i, 'ultrasonic_echo': 200 + i,
+            'temp_sensor_id': f"probe{i}",
+            'nutrient_pump_port': f"/dev/sim{i}-nutrient", 'ph_pump_port': f"/dev/sim{i}-ph",
+        })
+
+    controller = main.MultiTankController(configs)
+    try:
+        def start_temperature():
+            controller.start_temperature()
+            time.sleep(max(tank.temp_sensor.conversion_time() for tank in controller.tanks))
+
+        def cycle():
+            controller.read_sensors()
+            for tank in controller.tanks:
+                tank.control()
+        cycle()  # warm up
+        latencies = timed(cycle, cycles, start_temperature)
+    finally:
+        controller.stop()
+    median = statistics.median(latencies)
+    return {'median_ms': median, 'per_tank_ms': median / tanks}
+
+
+def bench_adc(settings, seconds):
+    """Burst scan throughput of all 8 channels, conversion and health check rates"""
+    from sensors.tds_sensor import TDSSensor
+    from sensors.ph_sensor import PHSensor
+    from sensors.health import SignalCheck
+
+    tds = TDSSensor(channel=0)
+    ph = PHSensor(channel=1)
+    try:
+        frames = 0
+        deadline = time.perf_counter() + seconds
+        start = time.perf_counter()
+        while time.perf_counter() < deadline:
+            tds.bus.scan(range(8), 16)
+            frames += 8 * 16
+        scan_rate = frames / (time.perf_counter() - start)
+
+        block = tds.bus.scan([0, 1], settings.adc_samples)
+        conversions = 0
+        deadline = time.perf_counter() + seconds
+        start = time.perf_counter()
+        while time.perf_counter() < deadline:
+            for _ in range(100):
+                tds.convert(block[0], 21.0)
+                ph.convert(block[1])
+            conversions += 200
+        convert_rate = conversions / (time.perf_counter() - start)
+
+        raw = tds.bus.scan([0], 4096)[0]
+        codes = 0
+        deadline = time.perf_counter() + seconds
+        start = time.perf_counter()
+        while time.perf_counter() < deadline:
+            tds.convert_block(raw, 21.0)
+            codes += len(raw)
+        block_rate = codes / (time.perf_counter() - start)
+
+        # Raw-signal health checks on each cycle's block
+        check = SignalCheck()
+        checked = 0
+        deadline = time.perf_counter() + seconds
+        start = time.perf_counter()
+        while time.perf_counter() < deadline:
+            for _ in range(100):
+                check.update(block[0])
+            checked += 100 * len(block[0])
+        health_rate = checked / (time.perf_counter() - start)
+    finally:
+        tds.cleanup()
+        ph.cleanup()
+    return {'frames_per_s': scan_rate, 'conversions_per_s': convert_rate,
+            'block_codes_per_s': block_rate, 'health_samples_per_s': health_rate}
+
+
+def bench_tracing(seconds):
+    """Spans per second with tracing off (the production path) and on"""
+    from monitoring.tracing import Tracer
+    tracer = Tracer(capacity=10000)
+    rates = {}
+    for state in ('disabled', 'enabled'):
+        tracer.enabled = state == 'enabled'
+        spans = 0
+        deadline = time.perf_counter() + seconds / 2
+        start = time.perf_counter()
+        while time.perf_counter() < deadline:
+            for _ in range(1000):
+                with tracer.span('stage'):
+                    pass
+            spans += 1000
+        rates[f"{state}_spans_per_s"] = spans / (time.perf_counter() - start)
+    return rates
+
+
+def bench_data_endpoint(settings, seconds):
+    """/data requests per second through the Flask app"""
+    from storage.snapshot_channel import SnapshotChannel
+    channel = SnapshotChannel(settings.snapshot_shm_path, writer=True)
+    channel.publish({'tds': 950.0, 'ph': 6.1, 'temperature': 21.0, 'water_level': 20.0,
+                     'timestamp': '2024-01-01T00:00:00'})
+
+    import web_interface
+    client = web_interface.app.test_client()
+    client.get('/data')
+    requests = 0
+    deadline = time.perf_counter() + seconds
+    start = time.perf_counter()
+    while time.perf_counter() < deadline:
+        client.get('/data')
+        requests += 1
+    channel.close()
+    return {'requests_per_s': requests / (time.perf_counter() - start)}
+
+
+def compare(results, baseline, tolerance):
+    """Flag results worse than baseline by more than `tolerance`"""
+    regressions = []
+    for name, metrics in results.items():
+        for metric, value in metrics.items():
+            base = baseline.get(name, {}).get(metric)
+            if base is None:
+                print(f"  {name}.{metric}: {value:.2f} (no baseline; run with --save)")
+                continue
+            # Latencies (ms) should not grow, rates should not shrink
+            if metric.endswith('_ms'):
+                worse = value > base * (1 + tolerance)
+            else:
+                worse = value < base * (1 - tolerance)
+            change = (value - base) / base * 100 if base else 0.0
+            flag = 'REGRESSION' if worse else ''
+            print(f"  {name}.{metric}: {value:.2f} (baseline {base:.2f}, {change:+.1f}%) {flag}")
+            if worse:
+                regressions.append(f"{name}.{metric}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hydroponic system benchmarks")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save', action='store_true', help="store results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.3,
+                        help="allowed fractional slowdown before flagging (default 0.3)")
+    parser.add_argument('--cycles', type=int, default=5)
+    parser.add_argument('--seconds', type=float, default=1.0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    setup_paths()
+    import sim
+    sim.install()
+
+    workdir = tempfile.mkdtemp(prefix='hydroponic-bench-')
+    settings = configure(workdir)
+
+    # Multi-tank runs last: it wires extra simulated channels that would
+    # change the cost of the ADC benchmark
+    results = {
+        'cycle_latency_sequential': bench_cycle_latency(settings, False, args.cycles),
+        'cycle_latency_concurrent': bench_cycle_latency(settings, True, args.cycles),
+        'adc': bench_adc(settings, args.seconds),
+        'data_endpoint': bench_data_endpoint(settings, args.seconds),
+        'tracing': bench_tracing(args.seconds),
+        'cycle_latency_4_tanks': bench_multi_tank(settings, 4, args.cycles),
+    }
+
+    for name, metrics in results.items():
+        print(f"{name}: " + ", ".join(f"{k}={v:.2f}" for k, v in metrics.items()))
+
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("No baseline found; run with --save to create one")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    print("Compared with baseline:")
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
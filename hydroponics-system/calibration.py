@@ -1,104 +1,215 @@
 """
 Sensor Calibration Utility
+Saves calibration to the calibration file, which the running controller
+picks up within a few seconds
 """
 
 import time
-import json
+import argparse
 import logging
+from collections import deque
 from config.settings import Settings
 from sensors.tds_sensor import TDSSensor
 from sensors.ph_sensor import PHSensor
+from sensors.temp_sensor import TempSensor
+from storage.calibration_store import CalibrationStore
 
 logger = logging.getLogger(__name__)
 
-def calibrate_tds():
+# Stateless filtering only: a carried-over Kalman estimate would lag
+# behind a probe moved between solutions
+CALIBRATION_FILTER = [('despike', 3.0), ('median',)]
+CALIBRATION_SAMPLES = 32          # ADC samples per reading
+
+# Stability thresholds: (max standard deviation, max slope per second)
+TDS_STABILITY = (10.0, 0.5)       # ppm
+PH_STABILITY = (0.02, 0.002)      # pH
+
+
+class StabilityDetector:
+    """Streaming check that a probe reading has settled
+
+    Keeps the last `window` seconds of readings and reports stable once
+    the window is full and both the standard deviation and the
+    least-squares slope of the window are under their thresholds.
+    """
+
+    def __init__(self, max_std, max_slope, window=3.0, min_samples=5):
+        self.max_std = max_std
+        self.max_slope = max_slope
+        self.window = window
+        self.min_samples = min_samples
+        self.samples = deque()
+
+    def add(self, ts, value):
+        self.samples.append((ts, value))
+        while self.samples[-1][0] - self.samples[0][0] > self.window:
+            self.samples.popleft()
+
+    def mean(self):
+        return sum(v for _, v in self.samples) / len(self.samples)
+
+    def std(self):
+        mean = self.mean()
+        return (sum((v - mean) ** 2 for _, v in self.samples) / len(self.samples)) ** 0.5
+
+    def slope(self):
+        mean_t = sum(t for t, _ in self.samples) / len(self.samples)
+        mean_v = self.mean()
+        spread = sum((t - mean_t) ** 2 for t, _ in self.samples)
+        if not spread:
+            return 0.0
+        return sum((t - mean_t) * (v - mean_v) for t, v in self.samples) / spread
+
+    def full(self):
+        return (len(self.samples) >= self.min_samples and
+                self.samples[-1][0] - self.samples[0][0] >= 0.9 * self.window)
+
+    def stable(self):
+        return self.full() and self.std() <= self.max_std and abs(self.slope()) <= self.max_slope
+
+
+def read_stable(read, stability, timeout=120, interval=0.2):
+    """Sample `read()` until the reading settles; returns (mean of the settled window, settled)"""
+    detector = StabilityDetector(*stability)
+    start = time.monotonic()
+    while True:
+        now = time.monotonic()
+        value = read()
+        if value is None:
+            if now - start > timeout:
+                raise RuntimeError(f"No reading from the probe in {timeout}s")
+            time.sleep(interval)
+            continue
+        detector.add(now, value)
+        print(f"\r  {detector.samples[-1][1]:8.2f}   std {detector.std():.3f}   "
+              f"slope {detector.slope():+.4f}/s   ", end='', flush=True)
+        if detector.stable():
+            print(f"\n  Stable after {now - start:.1f}s")
+            return detector.mean(), True
+        if now - start > timeout:
+            print(f"\n  Not stable after {timeout}s, using the last {detector.window:.0f}s")
+            return detector.mean(), False
+        time.sleep(interval)
+
+
+def calibrate_tds(store, channel, spi_bus=0, spi_device=0):
     """Calibrate TDS sensor with known solution"""
     print("=== TDS Sensor Calibration ===")
     print("1. Prepare a known TDS solution (e.g., 1000ppm)")
-    print("2. Place sensor in solution and wait for stabilization")
+    print("2. Place sensor in solution")
     input("Press Enter when ready...")
 
-    tds_sensor = TDSSensor()
-    settings = Settings()
+    tds_sensor = TDSSensor(channel, spi_bus, spi_device, samples=CALIBRATION_SAMPLES,
+                           filters=CALIBRATION_FILTER)
+    temp_sensor = TempSensor(sensor_id=Settings.temp_sensor_id)
+    try:
+        temperature = temp_sensor.read()
+        if temperature is None:
+            temperature = 25.0
+            print("Temperature sensor not responding, assuming 25.0°C")
+        print(f"Solution temperature: {temperature:.1f}°C")
+
+        # Read with a unit factor so the new factor is just known / measured
+        tds_sensor.calibration_factor = 1.0
+        avg_reading, stable = read_stable(lambda: tds_sensor.read(temperature), TDS_STABILITY)
+    finally:
+        tds_sensor.cleanup()
+        temp_sensor.cleanup()
 
-    # Take multiple readings
-    readings = []
-    for i in range(10):
-        reading = tds_sensor.read()
-        readings.append(reading)
-        print(f"Reading {i+1}: {reading:.0f} ppm")
-        time.sleep(1)
-
-    avg_reading = sum(readings) / len(readings)
     known_value = float(input("Enter known TDS value (ppm): "))
 
     # Calculate new calibration factor
-    new_factor = settings.tds_calibration_factor * (known_value / avg_reading)
+    new_factor = known_value / avg_reading
     print(f"New calibration factor: {new_factor:.4f}")
 
-    # Save to settings?
     if input("Apply this factor? (y/n): ").lower() == 'y':
-        settings.tds_calibration_factor = new_factor
-        # Note: In a real system, we'd save to a persistent config file
-        print("Calibration factor updated (restart system to apply)")
+        store.set(tds_sensor.calibration_id, {'factor': new_factor, 'stable': stable})
+        print(f"Saved {tds_sensor.calibration_id}; the controller applies it within "
+              f"{Settings.calibration_reload_interval}s")
     else:
         print("Calibration aborted")
 
-def calibrate_ph():
+
+def calibrate_ph(store, channel, spi_bus=0, spi_device=0):
     """Calibrate pH sensor using two-point calibration"""
     print("=== pH Sensor Calibration ===")
     print("We will perform two-point calibration using pH 4.0 and 7.0 solutions")
 
-    ph_sensor = PHSensor()
-    settings = Settings()
-
-    # Calibrate low point (pH 4.0)
-    print("\nStep 1: pH 4.0 Calibration")
-    input("Place sensor in pH 4.0 solution and press Enter...")
-    low_readings = []
-    for i in range(10):
-        reading = ph_sensor.read()
-        low_readings.append(reading)
-        print(f"Reading {i+1}: {reading:.2f} pH")
-        time.sleep(1)
-    low_avg = sum(low_readings) / len(low_readings)
-
-    # Calibrate high point (pH 7.0)
-    print("\nStep 2: pH 7.0 Calibration")
-    input("Rinse sensor and place in pH 7.0 solution. Press Enter...")
-    high_readings = []
-    for i in range(10):
-        reading = ph_sensor.read()
-        high_readings.append(reading)
-        print(f"Reading {i+1}: {reading:.2f} pH")
-        time.sleep(1)
-    high_avg = sum(high_readings) / len(high_readings)
+    ph_sensor = PHSensor(channel, spi_bus, spi_device, samples=CALIBRATION_SAMPLES,
+                         filters=CALIBRATION_FILTER)
+    # Measure uncalibrated pH so earlier calibration does not compound
+    ph_sensor.apply_calibration({'slope': 1.0, 'offset': 0.0})
+    points = []
+    try:
+        for step, (buffer_ph, prompt) in enumerate([
+                (4.0, "Place sensor in pH 4.0 solution and press Enter..."),
+                (7.0, "Rinse sensor and place in pH 7.0 solution. Press Enter...")], 1):
+            print(f"\nStep {step}: pH {buffer_ph} Calibration")
+            input(prompt)
+            raw, stable = read_stable(ph_sensor.read, PH_STABILITY)
+            points.append((raw, buffer_ph, stable))
+    finally:
+        ph_sensor.cleanup()
+
+    (low_raw, low_ph, low_stable), (high_raw, high_ph, high_stable) = points
+    if abs(high_raw - low_raw) < 0.5:
+        print("\nReadings in the two buffers are too close; check the probe and try again")
+        return
 
     # Calculate slope and offset
     # Formula: pH = (raw * slope) + offset
-    slope = (7.0 - 4.0) / (high_avg - low_avg)
-    offset = 4.0 - (slope * low_avg)
+    slope = (high_ph - low_ph) / (high_raw - low_raw)
+    offset = low_ph - (slope * low_raw)
 
     print(f"\nCalculated slope: {slope:.4f}")
     print(f"Calculated offset: {offset:.4f}")
 
     if input("Apply these values? (y/n): ").lower() == 'y':
-        settings.ph_calibration_slope = slope
-        settings.ph_calibration_offset = offset
-        # Note: In a real system, we'd save to a persistent config file
-        print("Calibration values updated (restart system to apply)")
+        store.set(ph_sensor.calibration_id, {'slope': slope, 'offset': offset,
+                                             'stable': low_stable and high_stable})
+        print(f"Saved {ph_sensor.calibration_id}; the controller applies it within "
+              f"{Settings.calibration_reload_interval}s")
     else:
         print("Calibration aborted")
 
+
+def show(store):
+    """Print every stored calibration"""
+    store.reload()
+    if not store.entries:
+        print(f"No stored calibration in {store.path} (settings.py defaults apply)")
+    for key, values in sorted(store.entries.items()):
+        updated = time.strftime('%Y-%m-%d %H:%M', time.localtime(values.get('updated', 0)))
+        shown = ', '.join(f"{k}={v:.4f}" if isinstance(v, float) else f"{k}={v}"
+                          for k, v in values.items() if k != 'updated')
+        print(f"{key}: {shown} (updated {updated})")
+
+
 if __name__ == "__main__":
-    print("Hydroponic Sensor Calibration\n")
-    print("1. Calibrate TDS Sensor")
-    print("2. Calibrate pH Sensor")
-    choice = input("Select option: ")
-
-    if choice == '1':
-        calibrate_tds()
-    elif choice == '2':
-        calibrate_ph()
+    parser = argparse.ArgumentParser(description="Hydroponic Sensor Calibration")
+    parser.add_argument('sensor', nargs='?', choices=['tds', 'ph', 'show'])
+    parser.add_argument('--channel', type=int, help="MCP3008 channel (default from settings.py)")
+    parser.add_argument('--bus', type=int, default=0, help="SPI bus")
+    parser.add_argument('--device', type=int, default=0, help="SPI chip select")
+    args = parser.parse_args()
+
+    store = CalibrationStore(Settings.calibration_file)
+    choice = args.sensor
+    if choice is None:
+        print("Hydroponic Sensor Calibration\n")
+        print("1. Calibrate TDS Sensor")
+        print("2. Calibrate pH Sensor")
+        print("3. Show stored calibration")
+        choice = {'1': 'tds', '2': 'ph', '3': 'show'}.get(input("Select option: "))
+
+    if choice == 'tds':
+        channel = Settings.tds_channel if args.channel is None else args.channel
+        calibrate_tds(store, channel, args.bus, args.device)
+    elif choice == 'ph':
+        channel = Settings.ph_channel if args.channel is None else args.channel
+        calibrate_ph(store, channel, args.bus, args.device)
+    elif choice == 'show':
+        show(store)
     else:
-        print("Invalid choice")
\ No newline at end of file
+        print("Invalid choice")
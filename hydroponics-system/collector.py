@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Fleet Collector
+Receives the telemetry batches units send through their uplink and answers
+queries across the whole fleet
+
+Runs on any machine the units can reach (it needs Flask, not the Pi
+hardware libraries):
+
+    python3 collector.py --db fleet.db --port 8090 --token SECRET
+
+Units post gzipped batches to /ingest; a batch already stored is
+acknowledged without storing it again, so a unit can safely resend after
+a lost reply. When ingests back up the collector answers 503 with
+Retry-After, and the units keep the batches spooled until then.
+"""
+
+import os
+import json
+import zlib
+import time
+import hmac
+import argparse
+import threading
+import logging
+from flask import Flask, jsonify, request, abort
+
+from storage.fleet_store import FleetStore
+
+logger = logging.getLogger(__name__)
+
+app = Flask(__name__)
+app.config['MAX_CONTENT_LENGTH'] = 4 * 1048576   # compressed batch
+
+MAX_BATCH_BYTES = 32 * 1048576                    # decompressed batch
+MAX_POINTS = 5000
+INGEST_SLOTS = 4                                  # ingests waiting for the store before 503
+RETRY_AFTER = 30
+
+store = None
+token = None
+ingest_slots = threading.BoundedSemaphore(INGEST_SLOTS)
+
+
+def read_batch():
+    """The request's batch, gunzipped (with a cap on its size) and parsed"""
+    body = request.get_data()
+    if request.headers.get('Content-Encoding') == 'gzip':
+        inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        body = inflater.decompress(body, MAX_BATCH_BYTES)
+        if inflater.unconsumed_tail:
+            abort(413)
+    return json.loads(body)
+
+
+def time_range():
+    """(start, end) from the start/end/range query parameters (default: the last day)"""
+    try:
+        end = request.args.get('end', type=float) or time.time()
+        start = request.args.get('start', type=float)
+        if start is None:
+            start = end - float(request.args.get('range', 86400))
+    except ValueError:
+        abort(400)
+    return start, end
+
+
+def unit_filter():
+    units = request.args.get('units')
+    return set(units.split(',')) if units else None
+
+
+@app.before_request
+def check_token():
+    if token is None:
+        return
+    supplied = request.headers.get('Authorization', '')
+    if not hmac.compare_digest(supplied, f"Bearer {token}"):
+        abort(401)
+
+
+@app.route('/ingest', methods=['POST'])
+def ingest():
+    """Store one batch from a unit's uplink"""
+    if not ingest_slots.acquire(timeout=5):
+        return jsonify({'error': 'busy'}), 503, {'Retry-After': str(RETRY_AFTER)}
+    try:
+        try:
+            batch = read_batch()
+        except (ValueError, zlib.error) as e:
+            return jsonify({'error': f"unreadable batch: {e}"}), 400
+        try:
+            stored = store.ingest(batch, request.remote_addr)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        except Exception as e:
+            logger.error(f"Error storing batch from {batch.get('unit')}: {e}")
+            return jsonify({'error': 'store unavailable'}), 503, {'Retry-After': str(RETRY_AFTER)}
+    finally:
+        ingest_slots.release()
+    return jsonify({'stored': stored})
+
+
+@app.route('/units')
+def units():
+    """Every unit seen, when it last reported and the metrics it sends"""
+    return jsonify({'units': store.units(), 'time': time.time()})
+
+
+@app.route('/latest')
+def latest():
+    """Newest reading of one metric on every unit
+
+    Query parameters:
+      metric  - e.g. tds, or basil.tds for a tank of a multi-tank unit
+      units   - comma-separated unit names (default: all)
+    """
+    metric = request.args.get('metric')
+    if not metric:
+        abort(400)
+    return jsonify({'metric': metric, 'units': store.latest(metric, unit_filter())})
+
+
+@app.route('/query')
+def query():
+    """One metric over time on every unit
+
+    Query parameters:
+      metric  - e.g. tds
+      units   - comma-separated unit names (default: all)
+      start   - epoch seconds (default: end - range)
+      end     - epoch seconds (default: now)
+      range   - seconds before end when start is omitted (default: 1 day)
+      points  - most points per unit (default 300); picks the rollup resolution
+    """
+    metric = request.args.get('metric')
+    if not metric:
+        abort(400)
+    start, end = time_range()
+    try:
+        points = min(int(request.args.get('points', 300)), MAX_POINTS)
+    except ValueError:
+        abort(400)
+    series = store.series(metric, start, end, points, unit_filter())
+    return jsonify({
+        'metric': metric,
+        'start': start,
+        'end': end,
+        'units': {unit: [[ts, round(mean, 3), round(low, 3), round(high, 3)]
+                         for ts, mean, low, high in rows]
+                  for unit, rows in series.items()},
+    })
+
+
+@app.route('/compare')
+def compare():
+    """Count, mean, min and max of one metric per unit over a range (hourly resolution)"""
+    metric = request.args.get('metric')
+    if not metric:
+        abort(400)
+    start, end = time_range()
+    return jsonify({'metric': metric, 'start': start, 'end': end,
+                    'units': store.compare(metric, start, end, unit_filter())})
+
+
+@app.route('/events')
+def events():
+    """Pump events from every unit, optionally one kind (e.g. dose)"""
+    start, end = time_range()
+    rows = store.events(start, end, request.args.get('kind'), unit_filter())
+    return jsonify({'start': start, 'end': end, 'events': [
+        {'ts': ts, 'unit': unit, 'kind': kind, 'source': source, 'value': value, 'ok': ok}
+        for ts, unit, kind, source, value, ok in rows]})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hydroponic fleet telemetry collector")
+    parser.add_argument('--db', default='fleet.db', help="database file (default: fleet.db)")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--token', default=os.environ.get('COLLECTOR_TOKEN'),
+                        help="shared secret units must send (default: $COLLECTOR_TOKEN, none if unset)")
+    parser.add_argument('--raw-days', type=int, default=30, help="days of raw readings kept")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    store = FleetStore(args.db, raw_days=args.raw_days)
+    token = args.token
+    app.run(host=args.host, port=args.port, threaded=True)
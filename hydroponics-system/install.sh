@@ -2,7 +2,7 @@
 # Hydroponic System Installation Script
 
 # Create directory structure
-mkdir -p /home/pi/hydroponic/{config,sensors,controllers,static,templates,logs}
+mkdir -p /home/pi/hydroponic/{config,sensors,controllers,storage,monitoring,static,templates,logs}
 
 # Install required packages
 sudo apt update
@@ -28,6 +28,8 @@ After=network.target
 [Service]
 User=pi
 WorkingDirectory=/home/pi/hydroponic
+# Let the controller start 1-Wire bulk conversions and set probe resolution
+ExecStartPre=+/bin/sh -c 'chmod 0666 /sys/bus/w1/devices/w1_bus_master1/therm_bulk_read /sys/bus/w1/devices/28-*/resolution || true'
 ExecStart=/home/pi/hydroponic/venv/bin/python /home/pi/hydroponic/main.py
 Restart=always
 RestartSec=10
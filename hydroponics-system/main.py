@@ -4,178 +4,1045 @@ Hydroponic System Main Controller
 Monitors sensors and controls pumps to maintain optimal growing conditions
 """
 
+import os
 import time
+import atexit
 import json
 import logging
 from datetime import datetime
 import sys
 import signal
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+# Simulated hardware for development and benchmarks off a Pi
+if os.environ.get('HYDROPONIC_SIM') == '1':
+    import sim
+    sim.install()
 
 from config.settings import Settings
 from sensors.tds_sensor import TDSSensor
 from sensors.ph_sensor import PHSensor
 from sensors.temp_sensor import TempSensor
 from sensors.level_sensor import LevelSensor
-from controllers.pump_controller import PumpController
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('/home/pi/hydroponic/logs/hydroponic.log'),
-        logging.StreamHandler()
-    ]
-)
+from sensors.health import HealthMonitor
+from controllers.pump_controller import PumpPool
+from controllers.dosing import DoseResponseModel, DosingController
+from controllers.scheduler import Scheduler
+from controllers.command_channel import CommandServer
+from storage.history_store import HistoryStore
+from storage.snapshot_channel import SnapshotPublisher
+from storage.log_writer import LogWriter, JSONFormatter
+from storage.calibration_store import CalibrationStore
+from storage.uplink import build_uplink
+from monitoring.metrics import Counter, Gauge, Histogram, MetricsPublisher
+from monitoring.alerts import AlertTracker, AlertDispatcher, build_sinks, describe
+from monitoring.tracing import TRACER, traced
+
 logger = logging.getLogger(__name__)
 
+# Independently scheduled sensor reads and the readings each produces
+SENSORS = ('adc', 'temperature', 'water_level')
+READINGS = {'adc': ('tds', 'ph'), 'temperature': ('temperature',), 'water_level': ('water_level',)}
+
+READ_SECONDS = Histogram('hydroponic_read_sensors_seconds', 'Duration of one sensor reading cycle', ['tank'])
+SENSOR_TIMEOUTS = Counter('hydroponic_sensor_timeouts_total',
+                          'Sensor reads that failed or missed their timeout', ['tank', 'sensor'])
+READING = Gauge('hydroponic_reading', 'Latest sensor reading', ['tank', 'sensor'])
+LAST_READING = Gauge('hydroponic_last_reading_timestamp_seconds',
+                     'Unix time of the latest recorded reading', ['tank'])
+SENSOR_TRUSTED = Gauge('hydroponic_sensor_trusted', '1 while a reading is trusted for dosing',
+                       ['tank', 'sensor'])
+SENSOR_UNTRUSTED = Counter('hydroponic_sensor_untrusted_total',
+                           'Times a reading became untrusted, by the faults seen', ['tank', 'sensor', 'fault'])
+
+# Pump dosed on each reading
+DOSES = {'tds': 'nutrient', 'ph': 'ph'}
+
+def new_data():
+    """Controller state as published to the web interface"""
+    return {
+        'tds': 0,
+        'ph': 0,
+        'temperature': 0,
+        'probe_temperatures': {},
+        'water_level': 0,
+        'timestamp': '',
+        'nutrient_pump_active': False,
+        'ph_pump_active': False,
+        'sensor_timeouts': [],
+        'sensor_health': {},
+        'alerts': []
+    }
+
+def configure_logging(settings):
+    """Log to file and console
+
+    With log_async the control loop only queues records; a background
+    writer formats them and writes batches to a rotating, compressed file.
+    """
+    if settings.log_format == 'json':
+        formatter = JSONFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    if not settings.log_async:
+        handlers = [logging.FileHandler(settings.log_file), logging.StreamHandler()]
+        for handler in handlers:
+            handler.setFormatter(formatter)
+        logging.basicConfig(level=logging.INFO, handlers=handlers)
+        return None
+
+    writer = LogWriter(settings.log_file, formatter,
+                       flush_interval=settings.log_flush_interval,
+                       flush_bytes=settings.log_flush_bytes,
+                       max_bytes=settings.log_max_bytes,
+                       backup_count=settings.log_backup_count,
+                       queue_size=settings.log_queue_size)
+    logging.basicConfig(level=logging.INFO, handlers=[writer.handler])
+    atexit.register(writer.stop)
+    return writer
+
+def build_dispatcher(settings):
+    """Alert dispatcher for the sinks configured in settings"""
+    return AlertDispatcher(build_sinks(settings), queue_size=settings.alert_queue_size,
+                           retries=settings.alert_retries, retry_delay=settings.alert_retry_delay)
+
 class HydroponicController:
-    def __init__(self):
-        self.settings = Settings()
-        self.running = False
-        self.data = {
-            'tds': 0,
-            'ph': 0,
-            'temperature': 0,
-            'water_level': 0,
-            'timestamp': '',
-            'nutrient_pump_active': False,
-            'ph_pump_active': False
-        }
+    def __init__(self, settings=None, name=None, executor=None, history=None, publish=True,
+                 dispatcher=None, uplink=None):
+        self.init_decisions(settings, name, history, dispatcher, uplink)
+        tank = name or ''
 
         # Initialize sensors
-        logger.info("Initializing sensors...")
-        self.tds_sensor = TDSSensor(channel=0)
-        self.ph_sensor = PHSensor(channel=1)
-        self.temp_sensor = TempSensor()
-        self.level_sensor = LevelSensor(trig_pin=15, echo_pin=18)
+        self.logger.info("Initializing sensors...")
+        self.tds_sensor = TDSSensor(channel=self.settings.tds_channel,
+                                    filters=self.settings.tds_filter,
+                                    temperature_grid=self.settings.tds_temperature_grid)
+        self.ph_sensor = PHSensor(channel=self.settings.ph_channel,
+                                  filters=self.settings.ph_filter)
+        self.adc_bus = self.tds_sensor.bus  # shared with the pH sensor
+
+        # Stored calibration, re-applied whenever calibration.py updates it
+        self.calibration = CalibrationStore(self.settings.calibration_file)
+        self.reload_calibration()
+        self.temp_sensor = TempSensor(sensor_id=self.settings.temp_sensor_id,
+                                      probes=self.settings.temp_probes,
+                                      resolution=self.settings.temp_resolution)
+        self.level_sensor = LevelSensor(trig_pin=self.settings.ultrasonic_trig,
+                                        echo_pin=self.settings.ultrasonic_echo,
+                                        mode=self.settings.level_mode,
+                                        burst=self.settings.level_burst)
 
         # Initialize pump controllers
-        logger.info("Initializing pump controllers...")
-        self.nutrient_pump = PumpController('/dev/ttyACM0', 'nutrient')
-        self.ph_pump = PumpController('/dev/ttyACM1', 'ph')
+        self.logger.info("Initializing pump controllers...")
+        self.pumps = PumpPool({'nutrient': self.settings.nutrient_pump_port,
+                               'ph': self.settings.ph_pump_port},
+                              protocol=self.settings.pump_protocol,
+                              retries=self.settings.pump_retries,
+                              dose_timeout=self.settings.pump_dose_timeout)
+        self.nutrient_pump = self.pumps['nutrient']
+        self.ph_pump = self.pumps['ph']
+
+        # Worker threads for concurrent acquisition (one per independent bus),
+        # shared between tanks when several run in one process
+        self.owns_executor = executor is None
+        self.executor = executor or ThreadPoolExecutor(max_workers=3, thread_name_prefix='sensor')
+        self.pending = {}
+
+        # Snapshot and metrics for the web interface; a multi-tank scheduler
+        # publishes all tanks together instead
+        self.publisher = None
+        self.metrics = None
+        if publish:
+            self.publisher = SnapshotPublisher(self.settings.snapshot_shm_path,
+                                               self.settings.data_file,
+                                               self.settings.snapshot_file_interval)
+            self.metrics = MetricsPublisher(self.settings.metrics_shm_path)
+        self.read_seconds = READ_SECONDS.labels(tank)
+        self.last_reading = LAST_READING.labels(tank)
+        self.reading_gauges = {sensor: READING.labels(tank, sensor)
+                               for names in READINGS.values() for sensor in names}
+        for probe in self.settings.temp_probes:
+            self.reading_gauges[f"{probe}_temperature"] = READING.labels(tank, f"{probe}_temperature")
+        self.timeout_counters = {sensor: SENSOR_TIMEOUTS.labels(tank, sensor) for sensor in SENSORS}
+
+        # Each sensor on its own deadline; the ADC (TDS/pH) is sampled fast
+        # while out of band or mixing a dose and backs off when stable. The
+        # temperature conversion is started one conversion time ahead of
+        # its read so the read does not wait for it.
+        self.adc_period = self.settings.fast_interval
+        self.level_period = self.settings.level_interval
+        self.scheduler.add('adc', interval=lambda: self.adc_period, batch='sensors')
+        self.scheduler.add('temperature_start', self.temp_sensor.start, interval=self.settings.temp_interval,
+                           delay=-self.temp_sensor.conversion_time())
+        self.scheduler.add('temperature', interval=self.settings.temp_interval, batch='sensors')
+        self.scheduler.add('water_level', interval=lambda: self.level_period, batch='sensors')
+        self.scheduler.add_batch('sensors', self.sample)
+        self.scheduler.add('calibration', self.reload_calibration,
+                           interval=self.settings.calibration_reload_interval)
+        if self.metrics is not None:
+            self.scheduler.add('metrics', self.metrics.publish, interval=self.settings.metrics_interval)
+
+    def init_decisions(self, settings=None, name=None, history=None, dispatcher=None, uplink=None):
+        """State the dosing and alert decisions run on, without sensors or pumps
+
+        Shared with replay, which supplies its own pumps and stand-ins for
+        the history, dispatcher and uplink.
+        """
+        self.settings = settings or Settings()
+        self.name = name  # set when running as one of several tanks
+        self.logger = logging.getLogger(__name__ if name is None else f"{__name__}.{name}")
+        self.running = False
+        self.data = new_data()
+        tank = name or ''
+
+        # Streaming health checks; dosing only acts on trusted readings
+        self.health = HealthMonitor(self.settings, on_change=self.trust_changed)
+        self.trust_gauges = {sensor: SENSOR_TRUSTED.labels(tank, sensor) for sensor in self.health.states}
+        for gauge in self.trust_gauges.values():
+            gauge.set(1)
+        self.failed_reads = set()
+        self.assessed = set()       # readings judged as soon as they arrived this cycle
+        self.last_trusted = {}      # reading -> last value the health checks trusted
+        self.ph_controlled = False  # pH acted on this cycle ahead of the slower sensors
+
+        # Alert conditions are tracked per tank and notified from background
+        # threads, shared between tanks when several run in one process
+        self.alerts = AlertTracker(name, clear_readings=self.settings.alert_clear_readings,
+                                   min_interval=self.settings.alert_min_interval,
+                                   repeat_interval=self.settings.alert_repeat_interval)
+        self.owns_dispatcher = dispatcher is None
+        self.dispatcher = dispatcher or build_dispatcher(self.settings)
+
+        # Time-series history of every reading and pump action
+        self.metric_prefix = f"{name}." if name else ''
+        self.owns_history = history is None
+        self.history = history or HistoryStore(self.settings.history_db,
+                                               flush_interval=self.settings.history_flush_interval,
+                                               raw_days=self.settings.history_raw_days,
+                                               minute_days=self.settings.history_minute_days,
+                                               hour_days=self.settings.history_hour_days)
+        # and forwarded to the fleet collector, when one is configured
+        self.owns_uplink = uplink is None
+        self.uplink = uplink or build_uplink(self.settings)
+
+        # Model-based dosing, one controller per pump keyed by the reading it moves
+        self.dosing = self.build_dosing_controllers()
+        if self.dosing:
+            self.learn_dose_response()
+
+        # Work from other threads (pump reports, commands) runs on the scheduler's
+        self.scheduler = Scheduler()
+        self.commands = None    # command channel, served while run() runs
+
+    def build_dosing_controllers(self):
+        """Dosing controllers by pump with the reading each moves, or None in threshold mode"""
+        if self.settings.dosing_mode != 'model':
+            return None
+        return {
+            'nutrient': ('tds', self.build_dosing(self.settings.nutrient_ppm_per_ml,
+                                                  self.settings.target_tds_min,
+                                                  self.settings.target_tds_max,
+                                                  self.settings.nutrient_max_dose_ml)),
+            'ph': ('ph', self.build_dosing(self.settings.ph_per_ml,
+                                           self.settings.target_ph_min,
+                                           self.settings.target_ph_max,
+                                           self.settings.ph_max_dose_ml)),
+        }
+
+    def build_dosing(self, gain, low, high, max_dose):
+        model = DoseResponseModel(gain, self.settings.mixing_time)
+        return DosingController(model, low, high,
+                                kp=self.settings.dose_gain,
+                                ki=self.settings.dose_integral_gain,
+                                min_dose=self.settings.min_dose_ml,
+                                max_dose=max_dose)
+
+    def learn_dose_response(self):
+        """Fit the dose-response models to the doses and readings in history"""
+        end = time.time()
+        start = end - self.settings.dose_learning_days * 86400
+        try:
+            events = self.history.query_events(start, end, 'dose')
+            for pump_type, (metric, dosing) in self.dosing.items():
+                source = self.metric_prefix + pump_type
+                doses = [(ts, ml) for ts, kind, src, ml, ok in events if src == source and ok]
+                if not doses:
+                    continue
+                readings = self.history.query_raw(self.metric_prefix + metric, start, end)
+                dosing.model.learn(readings, doses)
+                self.logger.info(f"{pump_type} dose response from {dosing.model.learned} doses: "
+                                 f"{dosing.model.gain:.3g} per ml, "
+                                 f"mixing time {dosing.model.mixing_time:.0f}s")
+        except Exception as e:
+            self.logger.error(f"Error learning dose response from history: {e}")
+
+    def clock(self):
+        """Wall-clock time for dosing decisions (replay substitutes the recorded time)"""
+        return time.time()
+
+    def reload_calibration(self):
+        """Apply stored calibration to the ADC sensors if the file changed"""
+        try:
+            if not self.calibration.reload():
+                return
+            for reading, sensor in (('tds', self.tds_sensor), ('ph', self.ph_sensor)):
+                values = self.calibration.get(sensor.calibration_id)
+                sensor.apply_calibration(values)
+                self.health.calibration_applied(reading, values.get('updated'))
+                shown = {k: v for k, v in values.items() if k != 'updated'}
+                self.logger.info(f"Calibration for {sensor.calibration_id}: {shown or 'settings defaults'}")
+        except Exception as e:
+            self.logger.error(f"Error loading calibration: {e}")
 
-        # Data file for web interface
-        self.data_file = '/home/pi/hydroponic/logs/current_data.json'
+    def scan_adc(self):
+        """Scan both ADC channels in one burst"""
+        return self.adc_bus.scan([self.tds_sensor.channel, self.ph_sensor.channel],
+                                 self.settings.adc_samples)
 
-    def read_sensors(self):
-        """Read all sensor values"""
+    def read_level(self):
+        """Read water level, correcting speed of sound with the latest air (else water) temperature"""
+        temperature = self.data['probe_temperatures'].get('air')
+        if temperature is None:
+            temperature = self.last_trusted.get('temperature')
+        return self.level_sensor.read(temperature)
+
+    def store_reading(self, name, value):
+        """Keep a new reading; a failed read (None) keeps the last value and is marked"""
+        if value is None:
+            self.failed_reads.add(name)
+        else:
+            self.failed_reads.discard(name)
+            self.data[name] = value
+
+    def store_temperatures(self, readings):
+        """Keep the reservoir probe's reading as 'temperature' and the other probes by name"""
+        self.store_reading('temperature', readings.get(self.temp_sensor.primary))
+        self.data['probe_temperatures'] = {name: value for name, value in readings.items()
+                                           if name != self.temp_sensor.primary}
+
+    @traced('convert_ph')
+    def convert_ph(self, blocks):
+        block = blocks[self.ph_sensor.channel]
+        self.health.check_block('ph', block)
+        self.store_reading('ph', self.ph_sensor.read(block))
+
+    @traced('convert_tds')
+    def convert_tds(self, blocks):
+        block = blocks[self.tds_sensor.channel]
+        self.health.check_block('tds', block)
+        self.store_reading('tds', self.tds_sensor.read(self.compensation_temperature(), block))
+
+    def compensation_temperature(self):
+        """Water temperature for TDS compensation: the last trusted reading, else 25°C (none)
+
+        The temperature read this cycle must already have been judged, so
+        a glitch (a DS18B20 power-on 85°C) never compensates TDS.
+        """
+        return self.last_trusted.get('temperature', 25.0)
+
+    def assess_early(self, name):
+        """Judge a reading as soon as it is converted, ahead of the rest of the cycle"""
+        self.assess_readings([name], time.time())
+        self.assessed.add(name)
+
+    def act_on_ph(self, blocks):
+        """Convert, judge and dose on pH as soon as its block arrives, not waiting for slower sensors"""
+        self.convert_ph(blocks)
+        self.assess_early('ph')
         try:
-            # Read temperature first (needed for TDS compensation)
-            self.data['temperature'] = self.temp_sensor.read()
+            self.control_ph()
+        except Exception as e:
+            self.logger.error(f"Error controlling pH: {e}")
+        self.ph_controlled = True
 
-            # Read other sensors
-            self.data['tds'] = self.tds_sensor.read(self.data['temperature'])
-            self.data['ph'] = self.ph_sensor.read()
-            self.data['water_level'] = self.level_sensor.read()
-            self.data['timestamp'] = datetime.now().isoformat()
+    def start_cycle(self):
+        self.failed_reads.clear()
+        self.assessed.clear()
+        self.ph_controlled = False
 
-            # Log readings
-            logger.info(f"Sensor readings - TDS: {self.data['tds']:.0f} ppm, "
-                       f"pH: {self.data['ph']:.2f}, "
-                       f"Temp: {self.data['temperature']:.1f}°C, "
-                       f"Level: {self.data['water_level']:.1f}cm")
+    def acquire_sequential(self, sensors=SENSORS):
+        """Read each sensor in turn"""
+        self.start_cycle()
+        # Read temperature first (needed for TDS compensation)
+        if 'temperature' in sensors:
+            with TRACER.span('temperature'):
+                self.store_temperatures(self.temp_sensor.collect())
+            self.assess_early('temperature')
+
+        # Scan both ADC channels in one burst, then convert each block
+        if 'adc' in sensors:
+            with TRACER.span('adc'):
+                blocks = self.scan_adc()
+            self.convert_tds(blocks)
+            self.convert_ph(blocks)
+
+        # Read other sensors
+        if 'water_level' in sensors:
+            with TRACER.span('water_level'):
+                self.store_reading('water_level', self.read_level())
+        self.data['sensor_timeouts'] = []
+
+    def submit_reads(self, blocks=None, sensors=SENSORS):
+        """Start the temperature, ADC and level reads in `sensors` on the worker pool
+
+        `blocks` are ADC sample blocks already scanned by a multi-tank
+        scheduler; the ADC read is skipped when they are given. Returns the
+        state collect_reads() needs.
+        """
+        jobs = [
+            ('adc', self.scan_adc, self.settings.adc_read_timeout),
+            ('temperature', self.temp_sensor.collect, self.settings.temp_read_timeout),
+            ('water_level', self.read_level, self.settings.level_read_timeout),
+        ]
+        jobs = [job for job in jobs if job[0] in sensors]
+        if blocks is not None:
+            jobs = [job for job in jobs if job[0] != 'adc']
+        self.start_cycle()
+        start = time.monotonic()
+        futures = {}
+        timed_out = []
+        for name, read, timeout in jobs:
+            previous = self.pending.get(name)
+            if previous is not None and not previous.done():
+                self.logger.warning(f"{name} read still running from last cycle, skipping")
+                timed_out.append(name)
+                continue
+            futures[name] = self.pending[name] = self.executor.submit(TRACER.wrap(name, read))
+        self.data['sensor_timeouts'] = timed_out  # so far; pH control looks at it
+        return start, jobs, futures, timed_out, blocks
+
+    @traced('collect_reads')
+    def collect_reads(self, start, jobs, futures, timed_out, blocks=None):
+        """Wait for submitted reads (each up to its own timeout) and convert
+
+        pH is judged and acted on as soon as the ADC block is in, so a
+        stuck 1-Wire bus delays only TDS, which needs the temperature.
+        """
+        results = {}
+        if blocks is not None:
+            results['adc'] = blocks
+            if not self.ph_controlled:
+                self.act_on_ph(blocks)
+
+        for name, read, timeout in jobs:
+            if name not in futures:
+                continue
+            try:
+                remaining = start + timeout - time.monotonic()
+                results[name] = futures[name].result(timeout=max(0, remaining))
+            except FutureTimeout:
+                self.logger.warning(f"{name} read timed out after {timeout}s")
+                timed_out.append(name)
+            except Exception as e:
+                self.logger.error(f"Error reading {name}: {e}")
+                timed_out.append(name)
+            else:
+                if name == 'adc':
+                    self.act_on_ph(results['adc'])
 
-            # Save data for web interface
-            with open(self.data_file, 'w') as f:
-                json.dump(self.data, f)
+        if 'temperature' in results:
+            self.store_temperatures(results['temperature'])
+            self.assess_early('temperature')
+        if 'water_level' in results:
+            self.store_reading('water_level', results['water_level'])
+        if 'adc' in results:
+            # Falls back to the last known temperature if this read timed out
+            self.convert_tds(results['adc'])
+        self.data['sensor_timeouts'] = timed_out
+        for name in timed_out:
+            self.timeout_counters[name].inc()
+
+    def acquire_concurrent(self, blocks=None, sensors=SENSORS):
+        """Read temperature, ADC and level in parallel
+
+        The ADC channels share one chip so they stay a single scan, and the
+        TDS conversion waits for temperature. A sensor that misses its
+        timeout keeps its previous value and is listed in 'sensor_timeouts';
+        a read still stuck from the last cycle is not resubmitted.
+        """
+        self.collect_reads(*self.submit_reads(blocks, sensors))
+
+    @traced('read_sensors')
+    def read_sensors(self, sensors=SENSORS):
+        """Read sensor values (by default all of them)"""
+        try:
+            with self.read_seconds.time():
+                if self.settings.concurrent_acquisition:
+                    self.acquire_concurrent(sensors=sensors)
+                else:
+                    self.acquire_sequential(sensors)
+            self.record_readings(sensors)
 
         except Exception as e:
-            logger.error(f"Error reading sensors: {e}")
+            self.logger.error(f"Error reading sensors: {e}")
+
+    @traced('record_readings')
+    def record_readings(self, sensors=SENSORS):
+        """Timestamp, log, store and publish the latest readings"""
+        self.data['timestamp'] = datetime.now().isoformat()
+
+        # Log readings; formatting is left to the log writer thread, and the
+        # values are attached as fields for JSON logs
+        readings = {name: self.data[name] for name in ('tds', 'ph', 'temperature', 'water_level')}
+        with TRACER.span('log'):
+            self.logger.info("Sensor readings - TDS: %.0f ppm, pH: %.2f, Temp: %.1f°C, Level: %.1fcm",
+                             readings['tds'], readings['ph'], readings['temperature'],
+                             readings['water_level'], extra={'fields': readings})
+
+        # Append to history the sensors read this cycle, skipping any that timed out or failed
+        read = [name for sensor in sensors if sensor not in self.data['sensor_timeouts']
+                for name in READINGS[sensor]]
+        fresh = [name for name in read if name not in self.failed_reads]
+        values = {name: self.data[name] for name in fresh}
+        if 'temperature' in read:
+            values.update({f"{probe}_temperature": value
+                           for probe, value in self.data['probe_temperatures'].items() if value is not None})
+        now = time.time()
+        stored = {self.metric_prefix + name: value for name, value in values.items()}
+        with TRACER.span('history'):
+            self.history.record(now, stored)
+            if self.uplink is not None:
+                self.uplink.record(now, stored)
+        for name, value in values.items():
+            self.reading_gauges[name].set(value)
+        self.last_reading.set(now)
+        self.assess_readings([name for name in read if name not in self.assessed], now)
+        self.check_alerts()
+
+        # Publish for web interface
+        if self.publisher is not None:
+            with TRACER.span('publish'):
+                self.publisher.publish(self.data)
+
+    @traced('assess_readings')
+    def assess_readings(self, names, now):
+        """Run the health checks on readings taken this cycle (failed reads count as faults)"""
+        for name in names:
+            value = None if name in self.failed_reads else self.data[name]
+            pump = DOSES.get(name)
+            mixing = pump is not None and self.data[f"{pump}_pump_active"]
+            if self.health.check_reading(name, value, now, mixing) and value is not None:
+                self.last_trusted[name] = value
+        self.data['sensor_health'] = self.health.status()
+
+    def trust_changed(self, name, state):
+        """Log and count a reading becoming untrusted or trusted again"""
+        self.trust_gauges[name].set(1 if state.trusted else 0)
+        if state.trusted:
+            self.logger.info(f"{name} reading trusted again")
+            return
+        faults = ', '.join(sorted(state.faults))
+        for fault in state.faults:
+            SENSOR_UNTRUSTED.labels(self.name or '', name, fault).inc()
+        self.logger.warning(f"{name} reading untrusted ({faults}); dosing on it is paused")
+
+    @traced('start_dose')
+    def start_dose(self, pump, ml_amount):
+        """Queue a dose without blocking the loop; the outcome is logged when the pump reports it"""
+        def done(future):
+            delivery = future.result()
+            if not delivery:
+                self.logger.error(f"{pump.pump_type} dose of {ml_amount}ml failed "
+                                  f"({delivery.fault}, {delivery.delivered:.1f}ml delivered)")
+            self.history.record_event('dose', self.metric_prefix + pump.pump_type,
+                                      delivery.delivered, bool(delivery))
+            if self.uplink is not None:
+                self.uplink.record_event('dose', self.metric_prefix + pump.pump_type,
+                                         delivery.delivered, bool(delivery))
+
+        future = pump.dose_async(ml_amount)
+        future.add_done_callback(done)
+        return future
+
+    def dose_modelled(self, pump_type, ml_amount, now):
+        """Start a dose the dose-response model knows about, corrected to what was delivered"""
+        dosing = self.dosing[pump_type][1]
+        dosing.record(now, ml_amount)
+
+        def correct(delivered):
+            dosing.forget(now)
+            if delivered > 0:
+                dosing.record(now, delivered)
+
+        def delivered(future):
+            # Runs on the pump link's thread; the model belongs to the scheduler's
+            delivery = future.result()
+            if delivery.delivered != ml_amount:
+                self.scheduler.call_soon(lambda: correct(delivery.delivered))
+
+        future = self.start_dose(self.pumps[pump_type], ml_amount)
+        future.add_done_callback(delivered)
+        return future
+
+    def control_model(self, pump_type):
+        """Dose `pump_type` as sized by its dose-response model"""
+        metric, dosing = self.dosing[pump_type]
+        if not self.data['timestamp'] or 'adc' in self.data['sensor_timeouts']:
+            return  # no fresh reading to act on
+        if not self.health.trusted(metric):
+            return  # never dose on a reading that may be a fault
 
+        now = self.clock()
+        ml = dosing.update(self.data[metric], now)
+        if ml:
+            self.logger.info(f"{metric} {self.data[metric]:.2f} (predicted {dosing.predicted:.2f}, "
+                             f"target {dosing.target():.2f}), dosing {ml}ml of {pump_type}")
+            self.dose_modelled(pump_type, ml, now)
+        self.data[f"{pump_type}_pump_active"] = dosing.mixing(now)
+
+    def manual_dose(self, pump_type, ml_amount):
+        """Dose on request from outside the loop (any thread), without waiting for the next reading
+
+        Raises ValueError, dosing nothing, for an unknown pump, an amount
+        outside 0..`*_max_dose_ml` or while the reading the pump moves is
+        untrusted.
+        """
+        if pump_type not in ('nutrient', 'ph'):
+            raise ValueError(f"no {pump_type} pump")
+        max_dose = getattr(self.settings, f"{pump_type}_max_dose_ml")
+        if isinstance(ml_amount, bool) or not isinstance(ml_amount, (int, float)) or not 0 < ml_amount <= max_dose:
+            raise ValueError(f"{pump_type} dose must be over 0 and at most {max_dose}ml")
+        reading = next(name for name, pump in DOSES.items() if pump == pump_type)
+        if not self.health.trusted(reading):
+            raise ValueError(f"{reading} reading untrusted; dosing on it is paused")
+
+        def dose():
+            self.logger.info(f"Manual dose of {ml_amount}ml of {pump_type}")
+            if self.dosing:
+                self.dose_modelled(pump_type, ml_amount, self.clock())
+            else:
+                self.start_dose(self.pumps[pump_type], ml_amount)
+            self.adc_period = self.settings.fast_interval
+        self.scheduler.call_soon(dose)
+
+    def request_reading(self):
+        """Read every sensor now (any thread)"""
+        self.scheduler.trigger()
+
+    def handle_command(self, request):
+        """Reply to a request from the command channel (its server thread)"""
+        command = request.get('command')
+        try:
+            if command == 'dose':
+                self.manual_dose(request.get('pump'), request.get('ml'))
+            elif command == 'reading':
+                self.request_reading()
+            else:
+                return {'ok': False, 'error': f"unknown command {command}"}
+        except ValueError as e:
+            self.logger.warning(f"Refused {command} command: {e}")
+            return {'ok': False, 'error': str(e)}
+        return {'ok': True}
+
+    @traced('control_nutrients')
     def control_nutrients(self):
         """Control nutrient dosing based on TDS levels"""
+        if self.dosing:
+            return self.control_model('nutrient')
+        if not self.health.trusted('tds'):
+            return
         tds = self.data['tds']
 
         if tds < self.settings.target_tds_min and not self.data['nutrient_pump_active']:
-            logger.info(f"TDS low ({tds} ppm), starting nutrient pump")
-            self.nutrient_pump.dose(self.settings.nutrient_dose_ml)
+            self.logger.info(f"TDS low ({tds} ppm), starting nutrient pump")
+            self.start_dose(self.nutrient_pump, self.settings.nutrient_dose_ml)
             self.data['nutrient_pump_active'] = True
 
         elif tds >= self.settings.target_tds_min and self.data['nutrient_pump_active']:
-            logger.info(f"TDS recovered ({tds} ppm), stopping nutrient pump")
+            self.logger.info(f"TDS recovered ({tds} ppm), stopping nutrient pump")
             self.data['nutrient_pump_active'] = False
 
+    @traced('control_ph')
     def control_ph(self):
         """Control pH adjustment based on pH levels"""
+        if self.dosing:
+            return self.control_model('ph')
+        if not self.health.trusted('ph'):
+            return
         ph = self.data['ph']
 
         if ph > self.settings.target_ph_max and not self.data['ph_pump_active']:
-            logger.info(f"pH high ({ph}), dosing pH down")
-            self.ph_pump.dose(self.settings.ph_dose_ml)
+            self.logger.info(f"pH high ({ph}), dosing pH down")
+            self.start_dose(self.ph_pump, self.settings.ph_dose_ml)
             self.data['ph_pump_active'] = True
 
         elif ph >= self.settings.target_ph_min and ph <= self.settings.target_ph_max:
             if self.data['ph_pump_active']:
-                logger.info(f"pH normalized ({ph})")
+                self.logger.info(f"pH normalized ({ph})")
                 self.data['ph_pump_active'] = False
 
+    @traced('check_alerts')
     def check_alerts(self):
-        """Check for conditions requiring alerts"""
-        # Low water level alert
-        if self.data['water_level'] < self.settings.min_water_level:
-            logger.warning(f"LOW WATER LEVEL: {self.data['water_level']}cm")
+        """Check for conditions requiring alerts and notify changes; returns the (kind, message) pairs present
+
+        Runs on every new reading. A raised limit alert holds until the
+        reading is back past the limit by its hysteresis margin.
+        """
+        s = self.settings
+        alerts = []
+        # Low water level alert (a faulty probe raises a sensor alert instead)
+        level = self.data['water_level']
+        min_level = s.min_water_level
+        if self.alerts.active('low_water_level'):
+            min_level += s.water_level_hysteresis
+        if self.health.trusted('water_level') and level < min_level:
+            alerts.append(('low_water_level', None, f"LOW WATER LEVEL: {level:.1f}cm"))
 
         # Temperature alerts
-        if self.data['temperature'] > self.settings.max_temp:
-            logger.warning(f"HIGH TEMPERATURE: {self.data['temperature']}°C")
-        elif self.data['temperature'] < self.settings.min_temp:
-            logger.warning(f"LOW TEMPERATURE: {self.data['temperature']}°C")
+        temperature = self.data['temperature']
+        max_temp = s.max_temp - (s.temp_hysteresis if self.alerts.active('high_temperature') else 0)
+        min_temp = s.min_temp + (s.temp_hysteresis if self.alerts.active('low_temperature') else 0)
+        if self.health.trusted('temperature'):
+            if temperature > max_temp:
+                alerts.append(('high_temperature', None, f"HIGH TEMPERATURE: {temperature:.1f}°C"))
+            elif temperature < min_temp:
+                alerts.append(('low_temperature', None, f"LOW TEMPERATURE: {temperature:.1f}°C"))
 
-    def run(self):
-        """Main control loop"""
-        logger.info("Starting hydroponic control system")
-        self.running = True
+        # Sensor health
+        for name, state in self.health.states.items():
+            if not state.trusted:
+                faults = ', '.join(sorted(state.faults)) or 'recovering'
+                alerts.append(('sensor_fault', name, f"SENSOR FAULT: {name} untrusted ({faults})"))
+            if 'drift' in state.warnings:
+                drift = self.health.readings[name].drift_per_day()
+                alerts.append(('sensor_drift', name, f"SENSOR DRIFT: {name} moving {drift:+.2f}/day between doses"))
+            if 'calibration_due' in state.warnings:
+                alerts.append(('calibration_due', name, f"CALIBRATION DUE: {name}"))
 
-        while self.running:
-            try:
-                # Read sensors
-                self.read_sensors()
+        self.notify(alerts)
+        return [(kind, message) for kind, subject, message in alerts]
 
-                # Control systems
-                self.control_nutrients()
-                self.control_ph()
+    def notify(self, alerts):
+        """Update alert state and hand new notifications to the dispatcher"""
+        try:
+            for event in self.alerts.update(alerts, self.clock()):
+                if event['state'] == 'cleared':
+                    self.logger.info(describe(event))
+                elif event['severity'] == 'critical':
+                    self.logger.error(describe(event))
+                else:
+                    self.logger.warning(describe(event))
+                if self.dispatcher is not None:
+                    self.dispatcher.submit(event)
+            self.data['alerts'] = self.alerts.status()
+        except Exception as e:
+            self.logger.error(f"Error dispatching alerts: {e}")
 
-                # Check alerts
-                self.check_alerts()
+    def adapt_rate(self):
+        """Sample the ADC fast while out of band or mixing a dose, backing off when stable"""
+        s = self.settings
+        unsettled = (not s.target_tds_min <= self.data['tds'] <= s.target_tds_max
+                     or not s.target_ph_min <= self.data['ph'] <= s.target_ph_max
+                     or self.data['nutrient_pump_active'] or self.data['ph_pump_active'])
+        if unsettled:
+            self.adc_period = s.fast_interval
+        else:
+            self.adc_period = min(self.adc_period * 2, s.update_interval)
 
-                # Wait before next cycle
-                time.sleep(self.settings.update_interval)
+    def adapt_level_rate(self):
+        """Read the water level every fast_interval while it is near or below the minimum"""
+        s = self.settings
+        if self.data['water_level'] < s.min_water_level + s.level_watch_margin:
+            self.level_period = s.fast_interval
+        else:
+            self.level_period = s.level_interval
 
-            except KeyboardInterrupt:
-                logger.info("Received shutdown signal")
-                self.stop()
-            except Exception as e:
-                logger.error(f"Error in main loop: {e}")
-                time.sleep(10)  # Wait before retrying
+    def sample(self, sensors):
+        """Scheduled work: read the sensors that are due (alerts are checked on each reading), then control"""
+        with TRACER.cycle('cycle', {'sensors': sensors}):
+            self.read_sensors(sensors)
+            self.control(sensors)
+
+    def control(self, sensors=SENSORS):
+        """Control systems on fresh TDS/pH (pH may have been acted on while the reads finished)"""
+        if 'adc' in sensors:
+            self.control_nutrients()
+            if not self.ph_controlled:
+                self.control_ph()
+            self.adapt_rate()
+        if 'water_level' in sensors:
+            self.adapt_level_rate()
+
+    def run(self):
+        """Main control loop"""
+        self.logger.info("Starting hydroponic control system")
+        self.running = True
+        if self.settings.trace_enabled:
+            start_tracing(self.settings)
+        self.commands = start_commands(self.settings, self.handle_command)
+
+        try:
+            self.scheduler.run()
+        except KeyboardInterrupt:
+            self.logger.info("Received shutdown signal")
+            self.stop()
 
     def stop(self):
         """Gracefully stop the system"""
-        logger.info("Stopping hydroponic controller")
+        self.logger.info("Stopping hydroponic controller")
         self.running = False
+        self.scheduler.stop()
+        if self.commands is not None:
+            self.commands.stop()
+        if self.owns_executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
 
         # Ensure pumps are stopped
-        self.nutrient_pump.stop()
-        self.ph_pump.stop()
+        self.pumps.close()
 
         # Cleanup
         self.tds_sensor.cleanup()
         self.ph_sensor.cleanup()
         self.temp_sensor.cleanup()
         self.level_sensor.cleanup()
+        if self.owns_history:
+            self.history.close()
+        if self.owns_dispatcher:
+            self.dispatcher.stop()
+        if self.owns_uplink and self.uplink is not None:
+            self.uplink.stop()
+
+
+class MultiTankController:
+    """Several reservoirs in one process
+
+    Tanks share the worker pool, the history database, the alert sinks
+    and the snapshot slot. Each cycle does one ADC burst per SPI bus
+    covering every tank's channels, starts all temperature and level reads
+    together, then runs each tank's control logic.
+    """
+
+    def __init__(self, tank_configs, settings=None):
+        self.settings = settings or Settings()
+        self.running = False
+
+        self.executor = ThreadPoolExecutor(max_workers=2 * len(tank_configs) + 1,
+                                           thread_name_prefix='sensor')
+        self.history = HistoryStore(self.settings.history_db,
+                                    flush_interval=self.settings.history_flush_interval,
+                                    raw_days=self.settings.history_raw_days,
+                                    minute_days=self.settings.history_minute_days,
+                                    hour_days=self.settings.history_hour_days)
+        self.publisher = SnapshotPublisher(self.settings.snapshot_shm_path,
+                                           self.settings.data_file,
+                                           self.settings.snapshot_file_interval)
+        self.metrics = MetricsPublisher(self.settings.metrics_shm_path)
+        self.dispatcher = build_dispatcher(self.settings)
+        self.uplink = build_uplink(self.settings)
+        self.read_seconds = READ_SECONDS.labels('all')
+        self.commands = None
+
+        self.tanks = []
+        for config in tank_configs:
+            # Per-tank values override the defaults from settings.py
+            tank_settings = Settings()
+            for key, value in config.items():
+                if key != 'name':
+                    setattr(tank_settings, key, value)
+            logger.info(f"Initializing tank {config['name']}")
+            self.tanks.append(HydroponicController(tank_settings, name=config['name'],
+                                                   executor=self.executor, history=self.history,
+                                                   publish=False, dispatcher=self.dispatcher,
+                                                   uplink=self.uplink))
+
+        # One schedule for all tanks, each sensor at the fastest rate any tank needs
+        self.scheduler = Scheduler()
+        self.scheduler.add('adc', interval=lambda: min(tank.adc_period for tank in self.tanks),
+                           batch='sensors')
+        temp_interval = min(tank.settings.temp_interval for tank in self.tanks)
+        self.scheduler.add('temperature_start', self.start_temperature, interval=temp_interval,
+                           delay=-max(tank.temp_sensor.conversion_time() for tank in self.tanks))
+        self.scheduler.add('temperature', batch='sensors', interval=temp_interval)
+        self.scheduler.add('water_level', batch='sensors',
+                           interval=lambda: min(tank.level_period for tank in self.tanks))
+        self.scheduler.add_batch('sensors', self.sample)
+        self.scheduler.add('calibration', self.reload_calibration,
+                           interval=self.settings.calibration_reload_interval)
+        self.scheduler.add('metrics', self.metrics.publish, interval=self.settings.metrics_interval)
+
+    def reload_calibration(self):
+        for tank in self.tanks:
+            tank.reload_calibration()
+
+    def start_temperature(self):
+        """Start every tank's temperature conversion (once per shared 1-Wire bus)"""
+        for tank in self.tanks:
+            tank.temp_sensor.start()
+
+    def scan_buses(self):
+        """One burst per SPI bus covering every tank's channels"""
+        buses = {}
+        for tank in self.tanks:
+            buses.setdefault(id(tank.adc_bus), (tank.adc_bus, []))[1].append(tank)
+
+        blocks = {}
+        for bus, tanks in buses.values():
+            channels = sorted({ch for tank in tanks
+                               for ch in (tank.tds_sensor.channel, tank.ph_sensor.channel)})
+            try:
+                scan = bus.scan(channels, self.settings.adc_samples)
+            except Exception as e:
+                logger.error(f"Error scanning ADC: {e}")
+                continue
+            for tank in tanks:
+                blocks[tank.name] = scan
+        return blocks
+
+    @traced('read_sensors')
+    def read_sensors(self, sensors=SENSORS):
+        """Read every tank's sensors, overlapping slow reads across tanks"""
+        start = time.perf_counter()
+        with TRACER.span('adc_scan'):
+            blocks = self.scan_buses() if 'adc' in sensors else {}
+        started = []
+        for tank in self.tanks:
+            try:
+                started.append((tank, tank.submit_reads(blocks.get(tank.name), sensors)))
+            except Exception as e:
+                tank.logger.error(f"Error reading sensors: {e}")
+
+        # Every tank's pH is acted on before any waits for its slower sensors
+        for tank, state in started:
+            if tank.name in blocks:
+                try:
+                    tank.act_on_ph(blocks[tank.name])
+                except Exception as e:
+                    tank.logger.error(f"Error reading sensors: {e}")
+
+        for tank, state in started:
+            try:
+                tank.collect_reads(*state)
+                tank.record_readings(sensors)
+            except Exception as e:
+                tank.logger.error(f"Error reading sensors: {e}")
+
+        self.read_seconds.observe(time.perf_counter() - start)
+
+        with TRACER.span('publish'):
+            self.publisher.publish({
+                'tanks': {tank.name: tank.data for tank in self.tanks},
+                'timestamp': datetime.now().isoformat(),
+            })
+
+    def sample(self, sensors):
+        """Scheduled work: read the sensors that are due (alerts are checked on each reading), then each tank's control"""
+        with TRACER.cycle('cycle', {'sensors': sensors}):
+            self.read_sensors(sensors)
+
+            for tank in self.tanks:
+                try:
+                    tank.control(sensors)
+                except Exception as e:
+                    tank.logger.error(f"Error in control loop: {e}")
+
+    def request_reading(self):
+        """Read every tank's sensors now (any thread)"""
+        self.scheduler.trigger()
+
+    def handle_command(self, request):
+        """Reply to a request from the command channel, routing tank commands by `tank`"""
+        if request.get('command') == 'reading' and not request.get('tank'):
+            self.request_reading()
+            return {'ok': True}
+        tank = next((tank for tank in self.tanks if tank.name == request.get('tank')), None)
+        if tank is None:
+            return {'ok': False, 'error': f"no tank {request.get('tank')}"}
+        return tank.handle_command(request)
+
+    def run(self):
+        """Main control loop for all tanks"""
+        logger.info(f"Starting hydroponic control system with {len(self.tanks)} tanks")
+        self.running = True
+        if self.settings.trace_enabled:
+            start_tracing(self.settings)
+        self.commands = start_commands(self.settings, self.handle_command)
+
+        try:
+            self.scheduler.run()
+        except KeyboardInterrupt:
+            logger.info("Received shutdown signal")
+            self.stop()
+
+    def stop(self):
+        """Gracefully stop every tank"""
+        self.running = False
+        self.scheduler.stop()
+        if self.commands is not None:
+            self.commands.stop()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        for tank in self.tanks:
+            tank.stop()
+        self.history.close()
+        self.dispatcher.stop()
+        if self.uplink is not None:
+            self.uplink.stop()
+
+
+def start_tracing(settings):
+    """Record spans of every cycle (and stack samples, if configured)"""
+    TRACER.start(capacity=settings.trace_buffer_spans,
+                 profile_interval=settings.profile_interval,
+                 slow_cycle=settings.trace_slow_cycle,
+                 dump_dir=settings.trace_dir,
+                 dump_interval=settings.trace_dump_interval)
+
+def start_commands(settings, handler):
+    """Serve the command channel for the web interface, or None if the socket cannot be made"""
+    try:
+        return CommandServer(settings.command_socket_path, handler)
+    except OSError as e:
+        logger.error(f"Command channel unavailable, manual commands disabled: {e}")
+        return None
+
+def load_tanks(path):
+    """Tank definitions from the multi-tank config file, or None if absent"""
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)['tanks']
+
+controller = None
 
 def signal_handler(sig, frame):
-    """Handle shutdown signals"""
+    """Handle shutdown signals: finish the current task, then stop"""
     logger.info("Received signal to terminate")
-    sys.exit(0)
+    if controller is None:
+        sys.exit(0)
+    controller.scheduler.stop()
+
+def reading_handler(sig, frame):
+    """Take a reading of every sensor now
+
+    Runs on the scheduler's thread, between any two of its instructions,
+    so it must not take a lock: the loop is only asked to trigger.
+    """
+    if controller is not None:
+        controller.scheduler.request_trigger()
+
+def trace_handler(sig, frame):
+    """Dump the trace buffer, or start tracing if it is off"""
+    if TRACER.enabled:
+        TRACER.dump_async()
+    else:
+        start_tracing(Settings)
 
 if __name__ == "__main__":
+    # Configure logging
+    configure_logging(Settings)
+
     # Set up signal handlers
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
+    signal.signal(signal.SIGUSR1, reading_handler)
+    signal.signal(signal.SIGUSR2, trace_handler)
 
-    # Create and run controller
-    controller = HydroponicController()
+    # Create and run controller (one per process, however many tanks)
+    tanks = load_tanks(Settings.tanks_file)
+    if tanks:
+        controller = MultiTankController(tanks)
+    else:
+        controller = HydroponicController()
 
     try:
         controller.run()
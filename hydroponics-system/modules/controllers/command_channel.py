@@ -0,0 +1,89 @@
+"""
+Command Channel
+Requests from the web interface to the running controller over a Unix socket
+
+One JSON object per line each way, one request per connection. The
+controller serves the socket from a background thread; its handler only
+checks a request and queues the work on the scheduler, so a client never
+waits on the control loop and only the controller touches the pumps.
+"""
+
+import os
+import json
+import socket
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+MAX_REQUEST = 4096
+
+
+class CommandServer:
+    """Answers requests on `path` with `handler(request) -> reply dict`"""
+
+    def __init__(self, path, handler, timeout=2):
+        self.path = path
+        self.handler = handler
+        self.timeout = timeout
+        if os.path.exists(path):
+            os.remove(path)  # left behind by a controller that did not stop cleanly
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(path)
+        os.chmod(path, 0o600)  # the web interface runs as the same user
+        self.sock.listen(8)
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='commands', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while self.running:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return  # closed by stop()
+            with conn:
+                try:
+                    conn.settimeout(self.timeout)
+                    reply = self.handle(read_line(conn))
+                    conn.sendall(json.dumps(reply).encode() + b'\n')
+                except Exception as e:
+                    logger.error(f"Error serving command: {e}")
+
+    def handle(self, line):
+        try:
+            request = json.loads(line)
+        except ValueError:
+            return {'ok': False, 'error': 'malformed request'}
+        if not isinstance(request, dict):
+            return {'ok': False, 'error': 'malformed request'}
+        return self.handler(request)
+
+    def stop(self):
+        self.running = False
+        self.sock.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def read_line(conn):
+    data = b''
+    while b'\n' not in data:
+        chunk = conn.recv(MAX_REQUEST)
+        if not chunk:
+            break
+        data += chunk
+        if len(data) > MAX_REQUEST:
+            raise ValueError("request too long")
+    return data.split(b'\n', 1)[0]
+
+
+def send_command(path, request, timeout=5):
+    """Send one request to the controller and return its reply; OSError if it is not running"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        sock.sendall(json.dumps(request).encode() + b'\n')
+        return json.loads(read_line(sock))
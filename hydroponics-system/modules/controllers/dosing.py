@@ -0,0 +1,204 @@
+"""
+Model-Based Dosing
+Learns how each reservoir responds to its pumps and sizes doses to reach
+the middle of the target band, instead of firing fixed doses at a threshold
+"""
+
+import math
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Fraction of a dose's effect reached after one mixing time constant
+MIXED = 1 - math.exp(-1)
+
+
+def slope(points):
+    """Least-squares slope of [(ts, value)] per second"""
+    n = len(points)
+    mean_t = sum(t for t, _ in points) / n
+    mean_v = sum(v for _, v in points) / n
+    spread = sum((t - mean_t) ** 2 for t, _ in points)
+    if not spread:
+        return 0.0
+    return sum((t - mean_t) * (v - mean_v) for t, v in points) / spread
+
+
+class DoseResponseModel:
+    """First-order response of one reading to one pump
+
+    A dose of `ml` eventually moves the reading by `gain * ml`, approaching
+    it exponentially with time constant `mixing_time`. Both start from the
+    configured guesses and are refined from the readings around each dose.
+    """
+
+    def __init__(self, gain, mixing_time, learning_rate=0.3, window=600,
+                 settle_factor=4.0, min_mixing_time=10, max_mixing_time=3600):
+        self.gain = gain                  # units per ml (negative for pH down)
+        self.mixing_time = mixing_time    # seconds
+        self.learning_rate = learning_rate
+        self.window = window              # seconds of readings averaged before/after a dose
+        self.settle_factor = settle_factor
+        self.min_mixing_time = min_mixing_time
+        self.max_mixing_time = max_mixing_time
+        self.learned = 0                  # doses learned from so far
+
+    def settle_time(self):
+        """Seconds after a dose until it is considered fully mixed"""
+        return self.settle_factor * self.mixing_time
+
+    def remaining(self, ml, elapsed):
+        """Part of a dose's effect still to show up `elapsed` seconds after it"""
+        return self.gain * ml * math.exp(-max(elapsed, 0) / self.mixing_time)
+
+    def estimate(self, readings, dose_ts, ml):
+        """(gain, mixing_time or None) from the readings around one dose, or None"""
+        settle = self.settle_time()
+        before = [(t, v) for t, v in readings if dose_ts - self.window <= t < dose_ts]
+        after = [(t, v) for t, v in readings
+                 if dose_ts + settle <= t < dose_ts + settle + self.window]
+        if len(before) < 2 or not after or not ml:
+            return None
+
+        # Extrapolate the pre-dose trend (uptake, evaporation) across the dose
+        drift = slope(before)
+        t0 = sum(t for t, _ in before) / len(before)
+        v0 = sum(v for _, v in before) / len(before)
+
+        def change(t, v):
+            return v - (v0 + drift * (t - t0))
+
+        response = sum(change(t, v) for t, v in after) / len(after)
+        gain = response / ml
+        if gain * self.gain <= 0:
+            return None  # moved the wrong way: noise or another disturbance
+
+        mixing_time = None
+        for t, v in readings:
+            if dose_ts < t < dose_ts + settle and change(t, v) / response >= MIXED:
+                mixing_time = t - dose_ts
+                break
+        return gain, mixing_time
+
+    def learn(self, readings, doses, neighbours=None):
+        """Learn from every dose [(ts, ml)] whose response is complete in `readings`
+
+        Doses whose windows overlap one of `neighbours` (default: the other
+        doses) are skipped. Returns the timestamps of the doses dealt with.
+        """
+        if not readings:
+            return []
+        neighbours = doses if neighbours is None else neighbours
+        last = readings[-1][0]
+        done = []
+        for ts, ml in doses:
+            span = self.settle_time() + self.window
+            if last < ts + span:
+                continue  # still settling
+            done.append(ts)
+            if any(ts - self.window < other < ts + span for other, _ in neighbours if other != ts):
+                continue
+
+            estimate = self.estimate(readings, ts, ml)
+            if estimate is None:
+                continue
+            gain, mixing_time = estimate
+            # Early doses weigh more so a poor initial guess is corrected quickly
+            rate = max(self.learning_rate, 1.0 / (self.learned + 2))
+            self.gain += rate * (gain - self.gain)
+            if mixing_time is not None:
+                self.mixing_time += rate * (mixing_time - self.mixing_time)
+                self.mixing_time = min(max(self.mixing_time, self.min_mixing_time),
+                                       self.max_mixing_time)
+            self.learned += 1
+        return done
+
+
+class DosingController:
+    """Predictive PI dosing of one pump toward the middle of a target band
+
+    Readings are first corrected for doses still mixing in, so nothing is
+    dosed twice for the same deviation. Once the predicted value leaves the
+    band on the side the pump can correct, the pump gets `kp` times the
+    dose the model says reaches the band centre, plus an integral term that
+    absorbs persistent model error. The integral only runs while the tank
+    is settled outside the band (or overshot) and the dose is not clipped
+    at `max_dose`, and is held between zero and `max_dose / ki`, so it
+    cannot wind up.
+    """
+
+    def __init__(self, model, low, high, kp=0.8, ki=0.1, min_dose=1.0,
+                 max_dose=30.0, resolution=0.1):
+        self.model = model
+        self.low = low
+        self.high = high
+        self.kp = kp
+        self.ki = ki                      # per minute
+        self.min_dose = min_dose
+        self.max_dose = max_dose
+        self.resolution = resolution      # ml the pump can meter
+        self.integral = 0.0               # ml-minutes
+        self.readings = deque()           # (ts, value) kept for learning
+        self.doses = []                   # (ts, ml) still mixing or not yet learned from
+        self.learned = set()              # timestamps of doses already learned from
+        self.last_update = None
+        self.predicted = None
+
+    def target(self):
+        return (self.low + self.high) / 2.0
+
+    def pending(self, now):
+        """Effect of recent doses that has not shown up in the reading yet"""
+        return sum(self.model.remaining(ml, now - ts) for ts, ml in self.doses)
+
+    def mixing(self, now):
+        """True while a dose is still mixing in"""
+        settle = self.model.settle_time()
+        return any(now - ts < settle for ts, _ in self.doses)
+
+    def learn(self, now):
+        """Refine the model from doses that have settled and drop old state"""
+        waiting = [(ts, ml) for ts, ml in self.doses if ts not in self.learned]
+        if waiting:
+            self.learned.update(self.model.learn(list(self.readings), waiting, self.doses))
+        horizon = now - 2 * self.model.window - self.model.settle_time()
+        self.doses = [(ts, ml) for ts, ml in self.doses
+                      if ts not in self.learned or ts >= horizon]
+        self.learned.intersection_update(ts for ts, _ in self.doses)
+        while self.readings and self.readings[0][0] < horizon - self.model.window:
+            self.readings.popleft()
+
+    def update(self, value, now):
+        """Take a new reading; returns the dose in ml to give now (0 for none)"""
+        self.readings.append((now, value))
+        self.learn(now)
+
+        self.predicted = value + self.pending(now)
+        need = (self.target() - self.predicted) / self.model.gain  # ml that close the gap
+        ml = self.kp * need + self.ki * self.integral
+        saturated = ml > self.max_dose
+        outside = not self.low <= self.predicted <= self.high
+
+        # Conditional integration (anti-windup): only integrate the shortfall
+        # left once a dose has settled with the tank still out of band (or
+        # an overshoot), never while clipped
+        if (self.last_update is not None and not self.mixing(now) and not saturated
+                and (outside or need < 0)):
+            minutes = (now - self.last_update) / 60.0
+            limit = self.max_dose / self.ki if self.ki else 0.0
+            self.integral = min(max(self.integral + need * minutes, 0.0), limit)
+        self.last_update = now
+
+        if need <= 0 or not outside:
+            return 0
+        ml = round(min(ml, self.max_dose) / self.resolution) * self.resolution
+        return round(ml, 3) if ml >= self.min_dose else 0
+
+    def record(self, ts, ml):
+        """Note a dose sent to the pump"""
+        self.doses.append((ts, ml))
+
+    def forget(self, ts):
+        """Drop a dose the pump failed to deliver"""
+        self.doses = [(t, ml) for t, ml in self.doses if t != ts]
@@ -0,0 +1,166 @@
+"""
+Pico Pump Protocol
+Framed binary messages between the controller and the Pico pump boards
+
+Frame layout (big-endian):
+
+    A5 5A | version u8 | type u8 | seq u16 | length u16 | payload | crc u16
+
+The CRC (CRC-16/CCITT-FALSE) covers version through payload. A receiver
+that sees a bad CRC drops one byte and hunts for the next sync, so line
+noise costs the damaged frame only; a frame of a version the receiver
+does not speak is answered with a NAK.
+
+The host numbers every command; the Pico answers each with an ACK (or NAK)
+carrying the same sequence number and remembers the last few numbers it
+has seen, so a retransmitted command is acknowledged again but never run
+twice. HELLO opens a session: the Pico forgets the numbers it has seen,
+and the host starts numbering at a random point, so neither a new
+connection (after a reconnect, or from another program) nor a DONE left
+over from the last one is mistaken for the old session's traffic.
+A DOSE frame may carry one entry per pump channel; each entry is ACKed on
+receipt and reported by its own DONE frame once the pump stops.
+The Pico repeats a DONE every second until the host ACKs it (same
+sequence number, payload the channel), so a lost report arrives late
+rather than never. While a pump runs the Pico streams TELEMETRY frames
+(sequence 0); there is no request for them, and the opcode once used for
+one (0x04) is reserved.
+"""
+
+import struct
+
+SYNC = b'\xa5\x5a'
+VERSION = 1
+HEADER = struct.Struct('>BBHH')         # version, type, seq, payload length
+CRC = struct.Struct('>H')
+MAX_PAYLOAD = 512
+FRAME_OVERHEAD = len(SYNC) + HEADER.size + CRC.size
+
+# Host to Pico
+HELLO = 0x01        # payload: highest version the host speaks (u8)
+DOSE = 0x02         # payload: one DOSE_ENTRY per pump channel
+STOP = 0x03         # payload: channel mask (u8), 0xFF for all
+# 0x04 is reserved: once a status request, no longer sent (telemetry streams while a pump runs)
+
+# Pico to host (ACK also host to Pico, for DONE reports)
+ACK = 0x80          # payload: one status byte per command entry (ACCEPTED or a REJECT_ code)
+HELLO_REPLY = 0x81  # payload: HELLO_INFO, then the firmware name (ASCII)
+DONE = 0x82         # payload: DONE_ENTRY for one finished dose; seq is the DOSE's
+TELEMETRY = 0x83    # payload: one TELEMETRY_ENTRY per channel
+NAK = 0x84          # payload: NAK_ code (u8); the command was not run
+
+DOSE_ENTRY = struct.Struct('>Bf')           # channel, ml
+HELLO_INFO = struct.Struct('>BB')           # version, channels
+DONE_ENTRY = struct.Struct('>BfIB')         # channel, delivered ml, run time ms, fault
+TELEMETRY_ENTRY = struct.Struct('>BBfIB')   # channel, running, delivered ml this dose, run time ms, fault
+
+ACCEPTED = 0
+REJECT_CHANNEL = 1          # no such pump channel
+REJECT_BUSY = 2             # channel already running a dose
+REJECT_AMOUNT = 3           # amount out of range
+
+NAK_CRC = 1
+NAK_VERSION = 2
+NAK_TYPE = 3
+NAK_PAYLOAD = 4
+
+# Fault codes in DONE and TELEMETRY entries
+FAULTS = {0: None, 1: 'stopped', 2: 'stall', 3: 'max run time', 4: 'rejected'}
+REJECTS = {REJECT_CHANNEL: 'no such channel', REJECT_BUSY: 'busy', REJECT_AMOUNT: 'bad amount'}
+NAKS = {NAK_CRC: 'bad crc', NAK_VERSION: 'bad version', NAK_TYPE: 'unknown type',
+        NAK_PAYLOAD: 'bad payload'}
+
+ALL_CHANNELS = 0xFF
+
+
+def make_crc_table():
+    table = []
+    for byte in range(256):
+        crc = byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021 if crc & 0x8000 else crc << 1) & 0xFFFF
+        table.append(crc)
+    return table
+
+
+CRC_TABLE = make_crc_table()
+
+
+def crc16(data, crc=0xFFFF):
+    """CRC-16/CCITT-FALSE (poly 0x1021, init 0xFFFF), as the Pico computes it"""
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFF) ^ CRC_TABLE[(crc >> 8) ^ byte]
+    return crc
+
+
+def encode(msg_type, seq, payload=b'', version=VERSION):
+    """One complete frame"""
+    if len(payload) > MAX_PAYLOAD:
+        raise ValueError(f"Payload of {len(payload)} bytes exceeds {MAX_PAYLOAD}")
+    body = HEADER.pack(version, msg_type, seq, len(payload)) + payload
+    return SYNC + body + CRC.pack(crc16(body))
+
+
+def encode_dose(seq, entries, version=VERSION):
+    """DOSE frame for [(channel, ml)]"""
+    return encode(DOSE, seq, b''.join(DOSE_ENTRY.pack(channel, ml) for channel, ml in entries), version)
+
+
+def decode_entries(entry, payload):
+    """Unpack a payload made of fixed-size entries"""
+    if len(payload) % entry.size:
+        raise ValueError(f"Payload of {len(payload)} bytes is not a multiple of {entry.size}")
+    return [entry.unpack_from(payload, offset) for offset in range(0, len(payload), entry.size)]
+
+
+class FrameDecoder:
+    """Incremental parser: feed() raw bytes, get back complete frames
+
+    Bytes outside frames (a newline after HELLO, a reply from ASCII
+    firmware) are skipped while hunting for the sync marker.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.crc_errors = 0
+        self.skipped = 0
+
+    def feed(self, data):
+        """[(version, type, seq, payload)] for every frame completed by `data`"""
+        self.buffer += data
+        frames = []
+        while True:
+            start = self.buffer.find(SYNC)
+            if start < 0:
+                # Keep a trailing first sync byte; it may be completed by the next read
+                keep = 1 if self.buffer[-1:] == SYNC[:1] else 0
+                self.skipped += len(self.buffer) - keep
+                del self.buffer[:len(self.buffer) - keep]
+                return frames
+            if start:
+                self.skipped += start
+                del self.buffer[:start]
+            if len(self.buffer) < len(SYNC) + HEADER.size:
+                return frames
+
+            version, msg_type, seq, length = HEADER.unpack_from(self.buffer, len(SYNC))
+            if length > MAX_PAYLOAD:
+                self.resync()
+                continue
+            end = FRAME_OVERHEAD + length
+            if len(self.buffer) < end:
+                return frames
+
+            body = bytes(self.buffer[len(SYNC):end - CRC.size])
+            (crc,) = CRC.unpack_from(self.buffer, end - CRC.size)
+            if crc != crc16(body):
+                self.crc_errors += 1
+                self.resync()
+                continue
+            del self.buffer[:end]
+            frames.append((version, msg_type, seq, body[HEADER.size:]))
+
+    def resync(self):
+        """Drop the sync marker of a bad frame and look for the next one"""
+        self.skipped += 1
+        del self.buffer[:1]
@@ -1,63 +1,653 @@
 """
 Controls peristaltic pumps via Raspberry Pi Pico
 Uses UART communication to send pump commands
+
+Each serial port is owned by a PicoLink on a background thread: commands
+are queued and replies awaited there, so callers never block on serial
+I/O, and the link reconnects with backoff if the Pico drops off the USB
+bus. Firmware that speaks the framed protocol (controllers.pico_protocol)
+gets pipelined, checksummed commands and reports each dose once the pump
+has actually stopped; older firmware is driven with ASCII DOSE/STOP/ACK
+lines.
 """
 
 import serial
 import time
+import random
+import struct
+import queue
+import itertools
+import threading
 import logging
+from concurrent.futures import Future
+import controllers.pico_protocol as pico
+from monitoring.metrics import Counter, Gauge, Histogram
+from monitoring.tracing import traced
 
 logger = logging.getLogger(__name__)
 
-class PumpController:
-    def __init__(self, port, pump_type, baudrate=9600, timeout=1):
+ACK_SECONDS = Histogram('hydroponic_pump_ack_seconds',
+                        'Time from sending a dose to receiving its ACK', ['port', 'pump'])
+ACK_FAILURES = Counter('hydroponic_pump_ack_failures_total',
+                       'Doses without a valid ACK (bad reply, timeout or serial error)', ['port', 'pump'])
+RECONNECTS = Counter('hydroponic_pump_reconnects_total',
+                     'Serial links dropped and reopened', ['port', 'pump'])
+DOSED_ML = Counter('hydroponic_pump_dosed_ml_total',
+                   'Millilitres delivered (as reported by framed firmware, as ACKed by ASCII firmware)',
+                   ['port', 'pump'])
+RETRANSMITS = Counter('hydroponic_pump_retransmits_total',
+                      'Framed commands resent after a missing ACK or a NAK', ['port'])
+FAULTS = Counter('hydroponic_pump_faults_total', 'Doses that ended early or unconfirmed',
+                 ['port', 'pump', 'fault'])
+RUNNING = Gauge('hydroponic_pump_running', '1 while the pump runs, from Pico telemetry', ['port', 'pump'])
+
+# Command priorities: STOP jumps ahead of queued doses
+PRIORITY_STOP = 0
+PRIORITY_DOSE = 1
+
+# Framed sequence numbers; 0 is reserved for HELLO and unsolicited telemetry
+MAX_SEQ = 0xFFFF
+
+
+class Delivery:
+    """Outcome of one dose, truthy when it completed without a fault
+
+    Framed firmware reports the volume it delivered and the run time;
+    ASCII firmware only acknowledges, so an ACKed ASCII dose is assumed to
+    be delivered in full (`confirmed` False). A dose whose completion report
+    never arrived is also assumed delivered, to err away from overdosing.
+    """
+
+    def __init__(self, requested, delivered=0.0, run_time=None, fault=None, confirmed=False):
+        self.requested = requested
+        self.delivered = delivered
+        self.run_time = run_time
+        self.fault = fault
+        self.confirmed = confirmed
+
+    def __bool__(self):
+        return self.fault is None
+
+    def __repr__(self):
+        return f"Delivery({self.delivered:.2f} of {self.requested}ml, fault={self.fault})"
+
+
+class Dose:
+    """One pump channel's part of a DOSE command"""
+
+    def __init__(self, channel, ml):
+        self.channel = channel
+        self.ml = ml
+        self.accepted = Future()      # True once the Pico has taken the dose
+        self.done = Future()          # Delivery once the pump has stopped
+        self.started = None           # monotonic time of the ACK
+
+    def finish(self, delivery):
+        if not self.accepted.done():
+            self.accepted.set_result(False)
+        if not self.done.done():
+            self.done.set_result(delivery)
+
+
+class Command:
+    def __init__(self, kind, priority=PRIORITY_DOSE, doses=(), channels=pico.ALL_CHANNELS):
+        self.kind = kind              # 'dose' or 'stop'
+        self.priority = priority
+        self.doses = list(doses)
+        self.channels = channels      # STOP channel mask
+        self.queued_at = time.monotonic()
+        self.result = Future()        # True once acknowledged
+        self.seq = None
+        self.sent_at = None
+        self.first_sent = None
+        self.attempts = 0
+
+    def fail(self, fault, assume_delivered=False):
+        for dose in self.doses:
+            dose.finish(Delivery(dose.ml, dose.ml if assume_delivered else 0.0, fault=fault))
+        if not self.result.done():
+            self.result.set_result(False)
+
+
+class PicoLink:
+    """One serial link to a Pico driving one or more pump channels
+
+    On every connect the link offers the framed protocol (HELLO) and falls
+    back to ASCII lines if the firmware does not answer, unless `protocol`
+    pins one. In framed mode up to `window` commands are in flight at once
+    and commands queued together go out in one write; an unacknowledged
+    command is resent under its original sequence number, which the Pico
+    acknowledges again without running it twice, and each dose resolves
+    when the Pico reports it finished.
+    """
+
+    def __init__(self, port, baudrate=9600, timeout=1, settle_time=2, max_backoff=30,
+                 command_ttl=30, protocol='auto', retries=3, window=8, dose_timeout=300,
+                 poll_interval=0.05):
         self.port = port
-        self.pump_type = pump_type  # 'nutrient' or 'ph'
         self.baudrate = baudrate
-        self.timeout = timeout
+        self.timeout = timeout          # serial timeout, and the wait for each ACK
+        self.settle_time = settle_time  # wait after opening before first command
+        self.max_backoff = max_backoff
+        self.command_ttl = command_ttl  # queued doses older than this are dropped
+        self.protocol = protocol        # 'auto', 'framed' or 'ascii'
+        self.retries = retries
+        self.window = window
+        self.dose_timeout = dose_timeout
+        self.poll_interval = poll_interval
         self.ser = None
+        self.mode = None                # protocol in use on the current connection
+        self.version = pico.VERSION
+        self.firmware = None
+        self.reconnects = 0
 
-        try:
-            self.ser = serial.Serial(port, baudrate, timeout=timeout)
-            time.sleep(2)  # Wait for serial connection to establish
-            logger.info(f"Connected to {pump_type} pump controller at {port}")
-        except Exception as e:
-            logger.error(f"Failed to connect to pump controller at {port}: {e}")
+        self.channels = {}              # channel -> pump type
+        self.metrics = {}               # channel -> metric children
+        self.telemetry = {}             # channel -> latest telemetry
+        self.retransmits = RETRANSMITS.labels(port)
+        self.decoder = pico.FrameDecoder()
+        self.seq = 0
+        self.inflight = {}              # seq -> Command awaiting its ACK
+        self.running_doses = {}         # (seq, channel) -> Dose awaiting DONE
+        self.deferred = []              # doses held back until their channel is free
+        self.early_reports = {}         # (seq, channel) -> Delivery reported before its ACK arrived
 
-    def dose(self, ml_amount):
-        """Dose a specific amount in milliliters"""
-        if self.ser is None:
-            logger.error(f"Pump controller not connected for {self.pump_type} pump")
-            return False
+        self.commands = queue.PriorityQueue()
+        self.order = itertools.count()
+        self.running = True
+        self.connected = threading.Event()
+
+        # Connect and serve commands in the background so startup never waits
+        self.thread = threading.Thread(target=self.run, name=f"pump-{port.rsplit('/', 1)[-1]}",
+                                       daemon=True)
+        self.thread.start()
+
+    def attach(self, channel, pump_type):
+        """Register the pump on a channel"""
+        self.channels[channel] = pump_type
+        self.metrics[channel] = {
+            'ack_seconds': ACK_SECONDS.labels(self.port, pump_type),
+            'ack_failures': ACK_FAILURES.labels(self.port, pump_type),
+            'reconnects': RECONNECTS.labels(self.port, pump_type),
+            'dosed_ml': DOSED_ML.labels(self.port, pump_type),
+            'running': RUNNING.labels(self.port, pump_type),
+        }
+
+    def pump_names(self):
+        return '/'.join(self.channels.values()) or 'unassigned'
+
+    def connect(self):
+        """Open the serial port and agree on a protocol, retrying with exponential backoff"""
+        backoff = 1
+        while self.running:
+            try:
+                self.ser = serial.Serial(self.port, self.baudrate, timeout=self.timeout)
+                time.sleep(self.settle_time)  # Wait for serial connection to establish
+                self.ser.reset_input_buffer()
+                self.mode = self.negotiate()
+                if self.mode == 'framed':
+                    self.ser.timeout = self.poll_interval
+                self.connected.set()
+                described = f"framed v{self.version}, {self.firmware}" if self.mode == 'framed' else 'ASCII'
+                logger.info(f"Connected to {self.pump_names()} pump controller at {self.port} ({described})")
+                return True
+            except Exception as e:
+                logger.error(f"Failed to connect to pump controller at {self.port}: {e} "
+                             f"(retrying in {backoff}s)")
+                if self.ser is not None:
+                    try:
+                        self.ser.close()
+                    except Exception:
+                        pass
+                self.ser = None
+                time.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+        return False
+
+    def negotiate(self):
+        """'framed' if the firmware answers HELLO, else 'ascii'"""
+        if self.protocol == 'ascii':
+            return 'ascii'
+        self.decoder = pico.FrameDecoder()
+        for attempt in range(self.retries + 1):
+            # The newline makes ASCII firmware reject the frame as one bad line
+            self.ser.write(pico.encode(pico.HELLO, 0, bytes([pico.VERSION])) + b'\n')
+            deadline = time.monotonic() + self.timeout
+            received = b''
+            while time.monotonic() < deadline:
+                data = self.ser.read(max(self.ser.in_waiting, 1))
+                received += data
+                for version, msg_type, seq, payload in self.decoder.feed(data):
+                    if msg_type == pico.HELLO_REPLY and len(payload) >= pico.HELLO_INFO.size:
+                        version, channels = pico.HELLO_INFO.unpack_from(payload)
+                        self.version = min(version, pico.VERSION)
+                        self.firmware = payload[pico.HELLO_INFO.size:].decode(errors='replace') or 'unnamed'
+                        # Number this session's commands apart from any earlier one's
+                        self.seq = random.randrange(MAX_SEQ)
+                        return 'framed'
+                if b'ERR' in received:
+                    break
+            if b'ERR' in received:
+                break
+        if self.protocol == 'framed':
+            raise IOError("no reply to HELLO")
+        self.ser.reset_input_buffer()  # the ASCII firmware's ERR
+        return 'ascii'
+
+    def disconnect(self):
+        """Drop a broken link so the worker reconnects"""
+        self.connected.clear()
+        # Sent but unacknowledged doses may have run: assume they did
+        for command in self.inflight.values():
+            command.fail('unconfirmed', assume_delivered=True)
+        for command in self.deferred:
+            command.fail('link lost')
+        self.inflight.clear()
+        self.deferred = []
+        self.early_reports.clear()
+        if self.running_doses:
+            logger.error(f"Link to {self.port} lost with {len(self.running_doses)} doses running; "
+                         f"assuming they completed")
+            for dose in self.running_doses.values():
+                self.finish(dose, Delivery(dose.ml, dose.ml, fault='unconfirmed'))
+            self.running_doses.clear()
+        if self.ser is not None:
+            try:
+                self.ser.close()
+            except Exception:
+                pass
+            self.ser = None
+        self.reconnects += 1
+        for metrics in self.metrics.values():
+            metrics['reconnects'].inc()
+
+    def run(self):
+        """Worker loop: keep the link up and serve queued commands"""
+        while self.running:
+            if self.ser is None and not self.connect():
+                break
+            try:
+                if self.mode == 'framed':
+                    self.serve_framed()
+                else:
+                    self.serve_ascii()
+            except Exception as e:
+                logger.error(f"Error on pump link {self.port}: {e}")
+                self.disconnect()
 
+        # Fail anything left so callers are not left waiting
+        for command in self.inflight.values():
+            command.fail('unconfirmed', assume_delivered=True)
+        for command in self.deferred:
+            command.fail('closed')
+        for dose in self.running_doses.values():
+            dose.finish(Delivery(dose.ml, dose.ml, fault='unconfirmed'))
+        while not self.commands.empty():
+            _, _, command = self.commands.get_nowait()
+            if command is not None:
+                command.fail('closed')
+
+    def next_command(self, timeout=None):
+        """Next live command from the queue, waiting up to `timeout` (None: don't wait)"""
+        while True:
+            try:
+                if timeout:
+                    _, _, command = self.commands.get(timeout=timeout)
+                else:
+                    _, _, command = self.commands.get_nowait()
+            except queue.Empty:
+                return None
+            if command is None:
+                self.running = False
+                return None
+            if command.kind == 'dose' and time.monotonic() - command.queued_at > self.command_ttl:
+                # Never deliver a dose decided on long-stale readings
+                logger.warning(f"Dropping expired dose for {self.pump_names()} pump")
+                command.fail('expired')
+                continue
+            return command
+
+    def finish(self, dose, delivery):
+        """Resolve a dose with the pump's outcome, logging and counting it"""
+        pump_type = self.channels.get(dose.channel, dose.channel)
+        metrics = self.metrics.get(dose.channel)
+        if metrics is not None and delivery.delivered:
+            metrics['dosed_ml'].inc(delivery.delivered)
+        if delivery:
+            logger.info(f"Dosed {round(delivery.delivered, 2):g}ml of {pump_type}")
+        else:
+            FAULTS.labels(self.port, pump_type, delivery.fault).inc()
+            logger.warning(f"{pump_type} dose ended after {delivery.delivered:.2f} of {dose.ml}ml: "
+                           f"{delivery.fault}")
+        dose.finish(delivery)
+
+    # ASCII firmware: one line per command, doses wait for a bare ACK
+
+    def serve_ascii(self):
+        command = self.next_command(timeout=1)
+        if command is None:
+            return
         try:
+            self.execute_ascii(command)
+        except Exception:
+            for dose in command.doses:
+                if not dose.done.done():
+                    self.metrics[dose.channel]['ack_failures'].inc()
+            command.fail('link error')
+            raise
+
+    def execute_ascii(self, command):
+        if command.kind == 'stop':
+            self.ser.write(b"STOP\n")
+
+        for dose in command.doses:
+            pump_type = self.channels[dose.channel]
+            metrics = self.metrics[dose.channel]
+            start = time.perf_counter()
             # Format: "DOSE <type> <amount>\n"
-            command = f"DOSE {self.pump_type} {ml_amount}\n".encode()
-            self.ser.write(command)
+            self.ser.write(f"DOSE {pump_type} {dose.ml}\n".encode())
 
-            # Wait for acknowledgment
-            response = self.ser.readline().decode().strip()
-            if response == "ACK":
-                logger.info(f"Dosed {ml_amount}ml of {self.pump_type}")
-                return True
+            # Wait for acknowledgment. Once the line is out the pump may have
+            # run: a lost reply counts the dose as delivered, as framed links do
+            try:
+                response = self.ser.readline().decode(errors='replace').strip()
+            except Exception:
+                metrics['ack_failures'].inc()
+                self.finish(dose, Delivery(dose.ml, dose.ml, fault='unconfirmed'))
+                raise
+            if not response:
+                metrics['ack_failures'].inc()
+                logger.warning(f"No reply from pump to a dose of {dose.ml}ml")
+                self.finish(dose, Delivery(dose.ml, dose.ml, fault='unconfirmed'))
+            elif response == "ACK":
+                metrics['ack_seconds'].observe(time.perf_counter() - start)
+                dose.started = time.monotonic()
+                dose.accepted.set_result(True)
+                self.finish(dose, Delivery(dose.ml, dose.ml))
             else:
+                metrics['ack_failures'].inc()
                 logger.warning(f"Unexpected response from pump: {response}")
-                return False
-        except Exception as e:
-            logger.error(f"Error sending dose command: {e}")
-            return False
+                dose.finish(Delivery(dose.ml, fault='no ack'))
+        command.result.set_result(True)
 
-    def stop(self):
-        """Emergency stop the pump"""
-        if self.ser is None:
-            return
+    # Framed firmware: pipelined commands, replies matched by sequence number
+
+    def serve_framed(self):
+        busy = self.inflight or self.running_doses or self.deferred
+        # A channel runs one dose at a time; later doses for it wait their turn here
+        pumping = {channel for seq, channel in self.running_doses}
+        pumping.update(dose.channel for command in self.inflight.values() for dose in command.doses)
+        waiting, self.deferred = self.deferred, []
+        batch = []
+        while len(self.inflight) + len(batch) < self.window:
+            if waiting:
+                command = waiting.pop(0)
+            else:
+                command = self.next_command(timeout=None if busy or batch else 1)
+            if command is None:
+                break
+            channels = {dose.channel for dose in command.doses}
+            if channels & pumping:
+                self.deferred.append(command)
+                continue
+            pumping.update(channels)
+            batch.append(command)
+        self.deferred.extend(waiting)
+        if batch:
+            self.send(batch)
+        self.receive()
+        self.check_timeouts()
 
+    def next_seq(self):
+        self.seq = self.seq % MAX_SEQ + 1
+        return self.seq
+
+    def frame(self, command):
+        if command.kind == 'dose':
+            return pico.encode_dose(command.seq, [(dose.channel, dose.ml) for dose in command.doses],
+                                    self.version)
+        return pico.encode(pico.STOP, command.seq, bytes([command.channels]), self.version)
+
+    @traced('pump_send')
+    def send(self, commands):
+        """Write several commands in one go"""
+        now = time.monotonic()
+        data = b''
+        for command in commands:
+            command.seq = self.next_seq()
+            data += self.frame(command)
         try:
-            self.ser.write(b"STOP\n")
-        except Exception as e:
-            logger.error(f"Error sending stop command: {e}")
+            self.ser.write(data)
+        except Exception:
+            # Nothing went out: queue the commands again for the next connection
+            for command in commands:
+                self.commands.put((command.priority, next(self.order), command))
+            raise
+        for command in commands:
+            command.sent_at = command.first_sent = now
+            command.attempts = 1
+            self.inflight[command.seq] = command
+
+    def retransmit(self, command):
+        command.attempts += 1
+        command.sent_at = time.monotonic()
+        self.retransmits.inc()
+        self.ser.write(self.frame(command))
+
+    def receive(self):
+        """Read whatever the Pico has sent (waiting briefly while replies are due)"""
+        waiting = self.ser.in_waiting
+        if not waiting and not (self.inflight or self.running_doses):
+            return
+        data = self.ser.read(max(waiting, 1))
+        if data:
+            for version, msg_type, seq, payload in self.decoder.feed(data):
+                try:
+                    self.handle(msg_type, seq, payload)
+                except (struct.error, ValueError) as e:
+                    logger.warning(f"Malformed frame type {msg_type:#x} from {self.port}: {e}")
+
+    def handle(self, msg_type, seq, payload):
+        if msg_type == pico.ACK:
+            command = self.inflight.pop(seq, None)
+            if command is not None:  # else a repeat ACK for a resent command
+                self.acknowledged(command, payload)
+        elif msg_type == pico.DONE:
+            channel, delivered, run_ms, fault = pico.DONE_ENTRY.unpack(payload)
+            self.ser.write(pico.encode(pico.ACK, seq, bytes([channel]), self.version))
+            dose = self.running_doses.pop((seq, channel), None)
+            delivery = Delivery(dose.ml if dose else None, delivered, run_ms / 1000,
+                                pico.FAULTS.get(fault, f"fault {fault}"), confirmed=True)
+            if dose is not None:
+                self.finish(dose, delivery)
+            elif seq in self.inflight:
+                # A short dose can finish before its (lost) ACK is resent
+                self.early_reports[(seq, channel)] = delivery
+        elif msg_type == pico.TELEMETRY:
+            for channel, running, delivered, run_ms, fault in pico.decode_entries(pico.TELEMETRY_ENTRY,
+                                                                                   payload):
+                self.telemetry[channel] = {
+                    'running': bool(running),
+                    'delivered': delivered,
+                    'run_time': run_ms / 1000,
+                    'fault': pico.FAULTS.get(fault, f"fault {fault}"),
+                    'ts': time.time(),
+                }
+                if channel in self.metrics:
+                    self.metrics[channel]['running'].set(1 if running else 0)
+        elif msg_type == pico.NAK:
+            command = self.inflight.get(seq)
+            if command is not None:
+                reason = pico.NAKS.get(payload[0], payload[0]) if payload else 'unknown'
+                logger.warning(f"Pico at {self.port} refused command {seq} ({reason}), resending")
+                self.retransmit(command)
+
+    def acknowledged(self, command, statuses):
+        now = time.monotonic()
+        for i, dose in enumerate(command.doses):
+            metrics = self.metrics[dose.channel]
+            metrics['ack_seconds'].observe(now - command.first_sent)
+            status = statuses[i] if i < len(statuses) else pico.REJECT_CHANNEL
+            if status == pico.ACCEPTED:
+                dose.started = now
+                dose.accepted.set_result(True)
+                delivery = self.early_reports.pop((command.seq, dose.channel), None)
+                if delivery is not None:
+                    delivery.requested = dose.ml
+                    self.finish(dose, delivery)
+                else:
+                    self.running_doses[(command.seq, dose.channel)] = dose
+            else:
+                metrics['ack_failures'].inc()
+                logger.warning(f"{self.channels[dose.channel]} pump rejected a dose of {dose.ml}ml: "
+                               f"{pico.REJECTS.get(status, status)}")
+                dose.finish(Delivery(dose.ml, fault='rejected'))
+        command.result.set_result(True)
+
+    def check_timeouts(self):
+        """Resend unacknowledged commands; give up on silent links and lost reports"""
+        now = time.monotonic()
+        for seq, command in list(self.inflight.items()):
+            if now - command.sent_at < self.timeout:
+                continue
+            if command.attempts > self.retries:
+                del self.inflight[seq]
+                for dose in command.doses:
+                    self.metrics[dose.channel]['ack_failures'].inc()
+                # The Pico may have run it and only the ACKs were lost
+                command.fail('unconfirmed', assume_delivered=True)
+                raise IOError(f"no ACK for command {seq} after {command.attempts} attempts")
+            self.retransmit(command)
+
+        for key, dose in list(self.running_doses.items()):
+            if now - dose.started > self.dose_timeout:
+                del self.running_doses[key]
+                self.finish(dose, Delivery(dose.ml, dose.ml, fault='unconfirmed'))
+
+    # Caller side (any thread)
+
+    def submit(self, command):
+        """Queue a command for the worker"""
+        if not self.running:
+            command.fail('closed')
+            return command
+        self.commands.put((command.priority, next(self.order), command))
+        return command
+
+    def dose(self, amounts):
+        """Queue doses [(channel, ml)] as one command; returns their Dose objects"""
+        command = self.submit(Command('dose', doses=[Dose(channel, ml) for channel, ml in amounts]))
+        return command.doses
+
+    def stop(self, channels=None):
+        """Emergency stop (default: every channel), discarding doses still queued for it"""
+        stopped = set(self.channels) if channels is None else set(channels)
+        kept = []
+        while True:
+            try:
+                kept.append(self.commands.get_nowait())
+            except queue.Empty:
+                break
+        for priority, order, command in kept:
+            if command is not None and command.kind == 'dose':
+                for dose in command.doses:
+                    if dose.channel in stopped:
+                        dose.finish(Delivery(dose.ml, fault='stopped'))
+                command.doses = [dose for dose in command.doses if dose.channel not in stopped]
+                if not command.doses:
+                    command.result.set_result(False)
+                    continue
+            self.commands.put((priority, order, command))
+
+        mask = pico.ALL_CHANNELS if channels is None else sum(1 << channel for channel in stopped)
+        return self.submit(Command('stop', PRIORITY_STOP, channels=mask)).result
 
     def close(self):
-        """Close serial connection"""
+        """Stop the worker and close serial connection"""
+        self.running = False
+        self.commands.put((PRIORITY_STOP, next(self.order), None))
+        self.thread.join(timeout=self.timeout + 1)
         if self.ser is not None:
-            self.ser.close()
\ No newline at end of file
+            self.ser.close()
+
+
+class PumpController:
+    """One pump: a channel of a PicoLink, its own link unless one is shared"""
+
+    def __init__(self, port, pump_type, channel=0, link=None, **link_options):
+        self.port = port
+        self.pump_type = pump_type  # 'nutrient' or 'ph'
+        self.channel = channel
+        self.owns_link = link is None
+        self.link = link or PicoLink(port, **link_options)
+        self.link.attach(channel, pump_type)
+        self.connected = self.link.connected
+
+    @property
+    def telemetry(self):
+        """Latest telemetry for this pump from framed firmware, or None"""
+        return self.link.telemetry.get(self.channel)
+
+    def dose_async(self, ml_amount):
+        """Queue a dose without blocking; the Future resolves to a Delivery once the pump stops"""
+        if not self.connected.is_set():
+            logger.warning(f"{self.pump_type} pump not connected yet, dose queued")
+        return self.link.dose([(self.channel, ml_amount)])[0].done
+
+    @traced('pump_dose')
+    def dose(self, ml_amount):
+        """Dose a specific amount in milliliters, waiting until the Pico has accepted it"""
+        dose = self.link.dose([(self.channel, ml_amount)])[0]
+        try:
+            return dose.accepted.result(timeout=self.link.timeout * (self.link.retries + 1)
+                                        + self.link.settle_time + 1)
+        except Exception:
+            logger.error(f"Pump controller not responding for {self.pump_type} pump")
+            return False
+
+    def stop(self):
+        """Emergency stop the pump, discarding doses still queued"""
+        return self.link.stop([self.channel])
+
+    def close(self):
+        """Close the link if this pump owns it"""
+        if self.owns_link:
+            self.link.close()
+
+
+class PumpPool:
+    """All pump links of a system, brought up in parallel
+
+    Pumps configured on the same port share one link, as channels 0, 1, ...
+    of that Pico, so doses for several pumps go out in one write.
+    """
+
+    def __init__(self, ports, **kwargs):
+        # ports: {pump_type: serial port}
+        self.links = {}
+        self.pumps = {}
+        for pump_type, port in ports.items():
+            link = self.links.get(port)
+            if link is None:
+                link = self.links[port] = PicoLink(port, **kwargs)
+            self.pumps[pump_type] = PumpController(port, pump_type, channel=len(link.channels), link=link)
+
+    def __getitem__(self, pump_type):
+        return self.pumps[pump_type]
+
+    def __iter__(self):
+        return iter(self.pumps.values())
+
+    def stop_all(self):
+        """Emergency stop every pump"""
+        return [link.stop() for link in self.links.values()]
+
+    def close(self):
+        """Stop every pump and close all links"""
+        for future in self.stop_all():
+            try:
+                future.result(timeout=1)
+            except Exception:
+                pass
+        for link in self.links.values():
+            link.close()
@@ -0,0 +1,206 @@
+"""
+Deadline Scheduler
+Runs periodic tasks on the monotonic clock, each at its own (possibly
+changing) rate, with a wait that other threads and signal handlers can
+interrupt
+"""
+
+import os
+import time
+import queue
+import select
+import weakref
+import logging
+from monitoring.metrics import Counter, Histogram
+from monitoring.tracing import TRACER
+
+logger = logging.getLogger(__name__)
+
+LATENESS = Histogram('hydroponic_schedule_lateness_seconds',
+                     'Delay from a task deadline to its start (loop jitter)', ['task'])
+MISSED = Counter('hydroponic_schedule_missed_total',
+                 'Task periods skipped because the loop fell behind', ['task'])
+
+
+class Task:
+    def __init__(self, name, action, interval, batch=None):
+        self.name = name
+        self.action = action
+        self.interval = interval          # seconds, or a callable returning seconds
+        self.batch = batch                # tasks of one batch due together run in one call
+        self.deadline = None              # monotonic time of the next run
+        self.lead = 0.0                   # seconds it runs ahead of the tasks it prepares for
+        self.last_deadline = None
+        self.runs = 0
+        self.missed = 0                   # periods skipped because a run came too late
+        self.lateness = 0.0               # seconds the last run started after its deadline
+        self.lateness_seconds = LATENESS.labels(name)
+        self.missed_count = MISSED.labels(name)
+
+    def period(self):
+        return self.interval() if callable(self.interval) else self.interval
+
+
+class Scheduler:
+    """Deadline-driven loop
+
+    Each run is scheduled from the previous deadline, not from when the
+    work finished, so the period does not drift with cycle time; if the
+    loop falls more than a period behind, the missed runs are skipped
+    rather than bunched up. Tasks whose interval is a callable are
+    rescheduled whenever it shortens. wake(), trigger() and call_soon()
+    end the wait immediately, e.g. for shutdown or manual commands;
+    request_trigger() is trigger() for signal handlers.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.tasks = {}
+        self.batches = {}
+        self.commands = queue.Queue()
+        # The wait is on a pipe rather than an Event so that a signal handler
+        # can end it too: writing a byte takes no lock the loop may hold
+        self.wake_r, self.wake_w = os.pipe()
+        os.set_blocking(self.wake_r, False)
+        os.set_blocking(self.wake_w, False)
+        weakref.finalize(self, close_pipe, self.wake_r, self.wake_w)
+        self.trigger_requested = False
+        self.running = False
+
+    def add(self, name, action=None, interval=60, batch=None, delay=0):
+        """Add a task; tasks sharing `batch` are run by add_batch()'s handler
+
+        A negative `delay` makes the task run that much ahead of tasks on
+        the same interval, e.g. to start a conversion they will read.
+        """
+        task = Task(name, action, interval, batch)
+        task.deadline = task.last_deadline = self.clock() + delay
+        task.lead = max(-delay, 0.0)
+        self.tasks[name] = task
+        return task
+
+    def add_batch(self, batch, handler):
+        """`handler(names)` runs every task of `batch` that is due, in one call"""
+        self.batches[batch] = handler
+
+    def wake(self):
+        """Interrupt the current wait (safe from a signal handler)"""
+        try:
+            os.write(self.wake_w, b'\0')
+        except BlockingIOError:
+            pass  # the pipe is full, so the loop is already awake
+
+    def trigger(self, *names):
+        """Make tasks (default: all) due now; safe to call from any thread
+
+        Tasks with a lead still run that far ahead of the rest, which are
+        then due once the longest lead has passed.
+        """
+        def make_due():
+            tasks = [self.tasks[name] for name in names or list(self.tasks)]
+            start = self.clock() + max(task.lead for task in tasks)
+            for task in tasks:
+                task.deadline = start - task.lead
+        self.call_soon(make_due)
+
+    def request_trigger(self):
+        """trigger() for a signal handler: only sets a flag and wakes the loop, which triggers"""
+        self.trigger_requested = True
+        self.wake()
+
+    def call_soon(self, command):
+        """Run `command()` on the scheduler thread as soon as possible"""
+        self.commands.put(command)
+        self.wake()
+
+    def run_commands(self):
+        while True:
+            try:
+                command = self.commands.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                command()
+            except Exception as e:
+                logger.error(f"Error running command: {e}")
+
+    def reschedule(self, task, now):
+        """Next deadline from the one just served, skipping periods already past"""
+        period = max(task.period(), 1e-3)
+        deadline = task.deadline + period
+        if deadline <= now:
+            skipped = int((now - deadline) // period) + 1
+            task.missed += skipped
+            task.missed_count.inc(skipped)
+            deadline += skipped * period
+        task.last_deadline = task.deadline
+        task.deadline = deadline
+
+    def run_pending(self):
+        """Run commands and every task that is due; returns seconds until the next deadline"""
+        if self.trigger_requested:
+            self.trigger_requested = False
+            self.trigger()
+        self.run_commands()
+
+        now = self.clock()
+        due = sorted((task for task in self.tasks.values() if task.deadline <= now),
+                     key=lambda task: task.deadline)
+        batches = {}
+        for task in due:
+            task.lateness = now - task.deadline
+            task.lateness_seconds.observe(task.lateness)
+            task.runs += 1
+            if task.batch is not None:
+                batches.setdefault(task.batch, []).append(task.name)
+                continue
+            try:
+                with TRACER.span(task.name):
+                    task.action()
+            except Exception as e:
+                logger.error(f"Error in task {task.name}: {e}")
+        for batch, names in batches.items():
+            try:
+                self.batches[batch](names)
+            except Exception as e:
+                logger.error(f"Error in {batch} tasks {', '.join(names)}: {e}")
+
+        now = self.clock()
+        for task in due:
+            self.reschedule(task, now)
+        for task in self.tasks.values():
+            # Adaptive rates take effect now, not after the old, longer wait
+            if callable(task.interval) and task not in due:
+                task.deadline = min(task.deadline, task.last_deadline + task.period())
+
+        if not self.tasks:
+            return None
+        return max(0.0, min(task.deadline for task in self.tasks.values()) - self.clock())
+
+    def run(self):
+        """Serve tasks until stop()"""
+        self.running = True
+        while self.running:
+            # Drained before the work so a wake() during it is not lost
+            self.drain_wakeups()
+            timeout = self.run_pending()
+            if not self.running:
+                break
+            select.select([self.wake_r], [], [], timeout)
+
+    def drain_wakeups(self):
+        try:
+            while os.read(self.wake_r, 512):
+                pass
+        except BlockingIOError:
+            pass
+
+    def stop(self):
+        """End run() without waiting for the next deadline"""
+        self.running = False
+        self.wake()
+
+
+def close_pipe(*fds):
+    for fd in fds:
+        os.close(fd)
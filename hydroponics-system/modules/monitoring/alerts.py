@@ -0,0 +1,321 @@
+"""
+Alert Pipeline
+Turns the alert conditions found on each reading into notifications
+
+AlertTracker (one per tank) follows each condition: a notification goes
+out when it is raised, when it clears after `clear_readings` readings
+without it, and again every `repeat_interval` while it stays active;
+changes coming faster than `min_interval` apart are coalesced into the
+next notification. AlertDispatcher delivers notifications to the sinks
+(file, webhook, SMTP), each from its own thread with a bounded queue,
+so a slow or unreachable sink never holds up the control loop or the
+other sinks.
+"""
+
+import json
+import time
+import queue
+import smtplib
+import logging
+import threading
+import urllib.request
+from email.message import EmailMessage
+from monitoring.metrics import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+STOP = object()
+
+# Severity by alert kind; critical alerts ignore min_interval
+SEVERITY = {
+    'low_water_level': 'critical',
+    'high_temperature': 'warning',
+    'low_temperature': 'warning',
+    'sensor_fault': 'warning',
+    'sensor_drift': 'info',
+    'calibration_due': 'info',
+}
+
+ALERTS_ACTIVE = Gauge('hydroponic_alerts_active', 'Alerts currently active', ['tank', 'severity'])
+ALERTS_SENT = Counter('hydroponic_alert_notifications_total', 'Alert notifications delivered', ['sink'])
+ALERT_FAILURES = Counter('hydroponic_alert_failures_total',
+                         'Alert notifications a sink failed to deliver after retries', ['sink'])
+ALERTS_DROPPED = Counter('hydroponic_alerts_dropped_total',
+                         'Alert notifications dropped because a sink queue was full', ['sink'])
+
+
+class Alert:
+    """State of one alert condition"""
+
+    def __init__(self, kind, subject=None):
+        self.kind = kind
+        self.subject = subject             # the sensor for sensor alerts, else None
+        self.severity = SEVERITY.get(kind, 'warning')
+        self.message = ''
+        self.active = False
+        self.since = None                  # time the current state began
+        self.absent = 0                    # readings in a row without the condition
+        self.sent_active = False           # state the last notification reported
+        self.sent_at = None
+        self.coalesced = 0                 # changes folded into the next notification
+
+    @property
+    def key(self):
+        return self.kind if self.subject is None else f"{self.kind}:{self.subject}"
+
+    def status(self):
+        return {'kind': self.kind, 'subject': self.subject, 'severity': self.severity,
+                'message': self.message, 'since': self.since}
+
+
+class AlertTracker:
+    """Deduplication, hysteresis and rate limiting of one tank's alerts
+
+    update() takes the conditions present in a reading and returns the
+    notifications to send.
+    """
+
+    def __init__(self, tank=None, clear_readings=2, min_interval=300, repeat_interval=3600):
+        self.tank = tank
+        self.clear_readings = clear_readings
+        self.min_interval = min_interval
+        self.repeat_interval = repeat_interval
+        self.alerts = {}                   # key -> Alert
+        self.gauges = {severity: ALERTS_ACTIVE.labels(tank or '', severity)
+                       for severity in sorted(set(SEVERITY.values()))}
+
+    def active(self, kind, subject=None):
+        alert = self.alerts.get(kind if subject is None else f"{kind}:{subject}")
+        return alert is not None and alert.active
+
+    def update(self, conditions, now=None):
+        """Notifications for [(kind, subject, message)] present now"""
+        now = time.time() if now is None else now
+        present = set()
+        for kind, subject, message in conditions:
+            alert = Alert(kind, subject)
+            alert = self.alerts.setdefault(alert.key, alert)
+            present.add(alert.key)
+            alert.message = message
+            alert.absent = 0
+            if not alert.active:
+                alert.active = True
+                alert.since = now
+                alert.coalesced += 1
+
+        for key, alert in self.alerts.items():
+            if alert.active and key not in present:
+                alert.absent += 1
+                if alert.absent >= self.clear_readings:
+                    alert.active = False
+                    alert.since = now
+                    alert.coalesced += 1
+
+        notifications = []
+        for alert in self.alerts.values():
+            event = self.notification(alert, now)
+            if event is not None:
+                notifications.append(event)
+        # Cleared alerts that have been reported are forgotten
+        self.alerts = {key: alert for key, alert in self.alerts.items()
+                       if alert.active or alert.sent_active}
+
+        for severity, gauge in self.gauges.items():
+            gauge.set(sum(1 for alert in self.alerts.values() if alert.active and alert.severity == severity))
+        return notifications
+
+    def notification(self, alert, now):
+        """The event to send for an alert now, or None"""
+        if alert.active != alert.sent_active:
+            if (alert.sent_at is not None and now - alert.sent_at < self.min_interval
+                    and alert.severity != 'critical'):
+                return None  # coalesced into a later notification
+            state = 'raised' if alert.active else 'cleared'
+        elif alert.active and self.repeat_interval and now - alert.sent_at >= self.repeat_interval:
+            state = 'repeated'
+        else:
+            alert.coalesced = 0  # flapped back to the state last reported
+            return None
+
+        event = {
+            'tank': self.tank,
+            'kind': alert.kind,
+            'subject': alert.subject,
+            'severity': alert.severity,
+            'state': state,
+            'message': alert.message,
+            'since': alert.since,
+            'time': now,
+            'changes': alert.coalesced,
+        }
+        alert.sent_active = alert.active
+        alert.sent_at = now
+        alert.coalesced = 0
+        return event
+
+    def status(self):
+        """Active alerts, most severe first, for publishing"""
+        order = {'critical': 0, 'warning': 1, 'info': 2}
+        active = [alert for alert in self.alerts.values() if alert.active]
+        active.sort(key=lambda alert: (order.get(alert.severity, 1), alert.since))
+        return [alert.status() for alert in active]
+
+
+def describe(event):
+    """One-line text of a notification"""
+    tank = f"[{event['tank']}] " if event['tank'] else ''
+    if event['state'] == 'cleared':
+        subject = f" {event['subject']}" if event['subject'] else ''
+        return f"{tank}RESOLVED: {event['kind']}{subject}"
+    return f"{tank}{event['message']}"
+
+
+class FileSink:
+    """Appends each notification as a JSON line"""
+
+    name = 'file'
+
+    def __init__(self, path):
+        self.path = path
+
+    def send(self, event):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(event, separators=(',', ':')) + '\n')
+
+
+class WebhookSink:
+    """POSTs each notification as JSON (with a `text` line for chat webhooks)"""
+
+    name = 'webhook'
+
+    def __init__(self, url, timeout=5, headers=None):
+        self.url = url
+        self.timeout = timeout
+        self.headers = {'Content-Type': 'application/json', **(headers or {})}
+
+    def send(self, event):
+        body = json.dumps({**event, 'text': describe(event)}).encode()
+        request = urllib.request.Request(self.url, data=body, headers=self.headers, method='POST')
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+class SmtpSink:
+    """Emails each notification"""
+
+    name = 'smtp'
+
+    def __init__(self, host, port, sender, recipients, username=None, password=None,
+                 starttls=True, timeout=10):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.recipients = recipients
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+
+    def send(self, event):
+        message = EmailMessage()
+        message['Subject'] = f"Hydroponic {event['severity']}: {describe(event)}"
+        message['From'] = self.sender
+        message['To'] = ', '.join(self.recipients)
+        when = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(event['since'] or event['time']))
+        message.set_content(f"{describe(event)}\n\n{event['state']} since {when}\n")
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+            if self.starttls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+            smtp.send_message(message)
+
+
+def build_sinks(settings):
+    """Sinks configured in settings"""
+    s = settings
+    sinks = []
+    if s.alert_file:
+        sinks.append(FileSink(s.alert_file))
+    if s.alert_webhook_url:
+        sinks.append(WebhookSink(s.alert_webhook_url, timeout=s.alert_sink_timeout))
+    if s.alert_smtp_host and s.alert_email_to:
+        sinks.append(SmtpSink(s.alert_smtp_host, s.alert_smtp_port, s.alert_email_from, s.alert_email_to,
+                              username=s.alert_smtp_user, password=s.alert_smtp_password,
+                              starttls=s.alert_smtp_starttls, timeout=s.alert_sink_timeout))
+    return sinks
+
+
+class SinkWorker:
+    """Background thread delivering notifications to one sink
+
+    A full queue drops the oldest notification rather than block the
+    caller; a failed delivery is retried `retries` times, `retry_delay`
+    seconds apart.
+    """
+
+    def __init__(self, sink, queue_size=100, retries=2, retry_delay=5):
+        self.sink = sink
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.queue = queue.Queue(queue_size)
+        self.stopping = threading.Event()
+        self.sent = ALERTS_SENT.labels(sink.name)
+        self.failures = ALERT_FAILURES.labels(sink.name)
+        self.dropped = ALERTS_DROPPED.labels(sink.name)
+        self.thread = threading.Thread(target=self.run, name=f"alert-{sink.name}", daemon=True)
+        self.thread.start()
+
+    def put(self, event):
+        while True:
+            try:
+                self.queue.put_nowait(event)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped.inc()
+                except queue.Empty:
+                    pass
+
+    def run(self):
+        while True:
+            event = self.queue.get()
+            if event is STOP:
+                return
+            self.deliver(event)
+
+    def deliver(self, event):
+        for attempt in range(self.retries + 1):
+            try:
+                self.sink.send(event)
+                self.sent.inc()
+                return
+            except Exception as e:
+                if attempt == self.retries or self.stopping.is_set():
+                    logger.error(f"Alert {self.sink.name} delivery failed: {e}")
+                    self.failures.inc()
+                    return
+                logger.warning(f"Alert {self.sink.name} delivery failed, retrying: {e}")
+                self.stopping.wait(self.retry_delay)
+
+    def stop(self, timeout=None):
+        self.stopping.set()
+        self.put(STOP)
+        self.thread.join(timeout)
+
+
+class AlertDispatcher:
+    """Hands notifications to every sink without waiting for delivery"""
+
+    def __init__(self, sinks, queue_size=100, retries=2, retry_delay=5):
+        self.workers = [SinkWorker(sink, queue_size, retries, retry_delay) for sink in sinks]
+
+    def submit(self, event):
+        for worker in self.workers:
+            worker.put(event)
+
+    def stop(self, timeout=2):
+        """Deliver what is queued (up to `timeout` per sink), then end the threads"""
+        for worker in self.workers:
+            worker.stop(timeout)
@@ -0,0 +1,218 @@
+"""
+Runtime Metrics
+Counters, gauges and latency histograms for the hot paths, rendered in the
+Prometheus text exposition format
+
+The controller renders its registry periodically into a shared-memory slot
+and the web interface serves the latest copy on /metrics, so scraping never
+touches the control loop.
+"""
+
+import abc
+import math
+import time
+import bisect
+import logging
+import threading
+from storage.snapshot_channel import SnapshotChannel
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from sub-millisecond SPI bursts to multi-second serial stalls
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Shared-memory slot size for the rendered text (histograms are verbose)
+METRICS_CAPACITY = 262144
+
+
+class Registry:
+    def __init__(self):
+        self.families = {}
+        self.lock = threading.Lock()
+
+    def register(self, family):
+        with self.lock:
+            if family.name in self.families:
+                raise ValueError(f"Metric {family.name} already registered")
+            self.families[family.name] = family
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        with self.lock:
+            families = list(self.families.values())
+        for family in families:
+            lines.append(f"# HELP {family.name} {family.help}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            lines.extend(family.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def format_value(value):
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    pairs = []
+    for name, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+class Family(abc.ABC):
+    """A metric name with one child per label combination
+
+    Metrics are defined once at module level. Unlabelled ones are used
+    directly (`counter.inc()`), labelled ones through `labels(...)`, whose
+    result is worth keeping on hot paths.
+    """
+    kind = None
+
+    def __init__(self, name, help, labelnames=(), registry=REGISTRY, **options):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.options = options
+        self.children = {}
+        self.lock = threading.Lock()
+        registry.register(self)
+
+    def labels(self, *values):
+        values = tuple(str(v) for v in values)
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self.child())
+        return child
+
+    @abc.abstractmethod
+    def child(self):
+        """New value holder for one label combination"""
+
+    def samples(self):
+        for values, child in list(self.children.items()):
+            labels = list(zip(self.labelnames, values))
+            for suffix, extra, value in child.samples():
+                yield f"{self.name}{suffix}{format_labels(labels + extra)} {format_value(value)}"
+
+
+class CounterValue:
+    def __init__(self):
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self):
+        yield '', [], self.value
+
+
+class GaugeValue(CounterValue):
+    def set(self, value):
+        self.value = value
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+
+class HistogramValue:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def time(self):
+        """Context manager observing the duration of its block"""
+        return Timer(self)
+
+    def samples(self):
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            yield '_bucket', [('le', format_value(bound))], cumulative
+        yield '_sum', [], total
+        yield '_count', [], cumulative
+
+
+class Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Counter(Family):
+    kind = 'counter'
+
+    def child(self):
+        return CounterValue()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Gauge(Family):
+    kind = 'gauge'
+
+    def child(self):
+        return GaugeValue()
+
+    def set(self, value):
+        self.labels().set(value)
+
+
+class Histogram(Family):
+    kind = 'histogram'
+
+    def child(self):
+        return HistogramValue(tuple(self.options.get('buckets', LATENCY_BUCKETS)))
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+
+class MetricsPublisher:
+    """Controller side: share the rendered registry with the web interface"""
+
+    def __init__(self, shm_path, registry=REGISTRY):
+        self.registry = registry
+        self.channel = None
+        try:
+            self.channel = SnapshotChannel(shm_path, METRICS_CAPACITY, writer=True)
+        except OSError as e:
+            logger.error(f"Shared memory metrics unavailable: {e}")
+
+    def publish(self):
+        if self.channel is not None:
+            self.channel.publish(self.registry.render())
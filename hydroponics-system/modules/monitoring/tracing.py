@@ -0,0 +1,240 @@
+"""
+Cycle Tracing
+Nested timing spans for every stage of the control loop, kept in a ring
+buffer and dumped on demand in the Chrome trace format (chrome://tracing,
+Perfetto, speedscope)
+
+Instrumented code wraps a stage in `with TRACER.span('name'):` or a whole
+function in `@traced('name')`. While tracing is off these reduce to one
+attribute check (the span is a shared do-nothing context), so the
+instrumentation stays in production code.
+While on, each finished span appends one tuple to a bounded deque; spans
+on one thread nest by time, as the trace viewers expect.
+
+An optional sampling profiler snapshots every thread's stack at a fixed
+interval (wall clock, so waiting threads show too) and is dumped as
+folded stacks for flamegraph.pl / speedscope, covering time that no span
+names.
+"""
+
+import os
+import sys
+import json
+import time
+import functools
+import threading
+import logging
+from collections import deque, Counter
+
+logger = logging.getLogger(__name__)
+
+
+class NullSpan:
+    """The span handed out while tracing is off"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+    __slots__ = ('tracer', 'name', 'args', 'start')
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        self.tracer.events.append((self.name, self.start, end, threading.get_ident(), self.args))
+        return False
+
+
+class CycleSpan(Span):
+    """A span for a whole cycle; a slow one can dump the trace by itself"""
+
+    __slots__ = ()
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        tracer = self.tracer
+        tracer.events.append((self.name, self.start, end, threading.get_ident(), self.args))
+        if tracer.slow_cycle and end - self.start > tracer.slow_cycle * 1e9:
+            tracer.slow_cycle_seen(self.name, (end - self.start) / 1e9)
+        return False
+
+
+class SamplingProfiler:
+    """Samples every thread's Python stack each `interval` seconds
+
+    Counts are kept per folded stack ("thread;module:function;..."), so
+    memory grows with distinct stacks, not with run time.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.counts = Counter()
+        self.samples = 0
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='profiler', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        own = threading.get_ident()
+        while not self.stopping.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.counts[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def folded(self):
+        """Folded stacks, one "stack count" line each"""
+        return ''.join(f"{stack} {count}\n" for stack, count in self.counts.most_common())
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+
+
+class Tracer:
+    """Ring buffer of finished spans, off until start()"""
+
+    def __init__(self, capacity=100000):
+        self.enabled = False
+        self.events = deque(maxlen=capacity)
+        self.profiler = None
+        self.slow_cycle = 0              # seconds; a longer cycle dumps the trace (0 = never)
+        self.dump_dir = '.'
+        self.dump_interval = 300         # seconds between automatic dumps
+        self.last_dump = None
+        self.origin = time.perf_counter_ns()
+
+    def start(self, capacity=None, profile_interval=0, slow_cycle=0, dump_dir=None, dump_interval=None):
+        """Record spans from now on; a `profile_interval` also starts the sampling profiler"""
+        if capacity and capacity != self.events.maxlen:
+            self.events = deque(self.events, maxlen=capacity)
+        self.slow_cycle = slow_cycle
+        if dump_dir is not None:
+            self.dump_dir = dump_dir
+        if dump_interval is not None:
+            self.dump_interval = dump_interval
+        if profile_interval and (self.profiler is None or self.profiler.stopping.is_set()):
+            self.profiler = SamplingProfiler(profile_interval)
+        self.enabled = True
+        logger.info(f"Tracing on ({self.events.maxlen} spans kept"
+                    f"{f', profiling every {profile_interval * 1000:g} ms' if profile_interval else ''})")
+
+    def stop(self):
+        self.enabled = False
+        if self.profiler is not None:
+            self.profiler.stop()
+
+    def span(self, name, args=None):
+        """Context manager timing one stage (NULL_SPAN while tracing is off)"""
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, args)
+
+    def cycle(self, name, args=None):
+        """Like span(), for a whole cycle: slower than `slow_cycle` dumps the trace"""
+        if not self.enabled:
+            return NULL_SPAN
+        return CycleSpan(self, name, args)
+
+    def wrap(self, name, fn):
+        """`fn` timed as a span, e.g. for a job run on another thread"""
+        if not self.enabled:
+            return fn
+
+        def traced(*args, **kwargs):
+            with Span(self, name, None):
+                return fn(*args, **kwargs)
+        return traced
+
+    def slow_cycle_seen(self, name, seconds):
+        now = time.monotonic()
+        if self.last_dump is not None and now - self.last_dump < self.dump_interval:
+            return
+        self.last_dump = now
+        logger.warning(f"Slow {name} took {seconds * 1000:.0f} ms, dumping trace")
+        self.dump_async()
+
+    def chrome_trace(self, events=None):
+        """Spans as a Chrome trace (JSON object format, times in µs)"""
+        events = self.events.copy() if events is None else events
+        pid = os.getpid()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        trace = []
+        for tid in sorted({event[3] for event in events}):
+            trace.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                          'args': {'name': names.get(tid, str(tid))}})
+        for name, start, end, tid, args in events:
+            event = {'name': name, 'ph': 'X', 'pid': pid, 'tid': tid,
+                     'ts': (start - self.origin) / 1000, 'dur': (end - start) / 1000}
+            if args:
+                event['args'] = args
+            trace.append(event)
+        return {'traceEvents': trace, 'displayTimeUnit': 'ms'}
+
+    def dump(self, directory=None):
+        """Write the buffered spans (and profile, if sampling) to files; returns their paths"""
+        directory = directory or self.dump_dir
+        stamp = time.strftime('%Y%m%d-%H%M%S') + f"-{int(time.time() * 1000) % 1000:03d}"
+        paths = []
+        try:
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"trace-{stamp}.json")
+            with open(path, 'w') as f:
+                json.dump(self.chrome_trace(), f, separators=(',', ':'), default=str)
+            paths.append(path)
+            if self.profiler is not None:
+                path = os.path.join(directory, f"profile-{stamp}.folded")
+                with open(path, 'w') as f:
+                    f.write(self.profiler.folded())
+                paths.append(path)
+            logger.info(f"Trace written to {', '.join(paths)}")
+        except Exception as e:
+            logger.error(f"Error writing trace: {e}")
+        return paths
+
+    def dump_async(self, directory=None):
+        """dump() on a background thread, so the control loop does not wait for the write"""
+        thread = threading.Thread(target=self.dump, args=(directory,), name='trace-dump', daemon=True)
+        thread.start()
+        return thread
+
+
+TRACER = Tracer()
+
+
+def traced(name):
+    """Decorator timing every call of a function as a span of `name`"""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not TRACER.enabled:
+                return fn(*args, **kwargs)
+            with Span(TRACER, name, None):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
@@ -0,0 +1,163 @@
+"""
+Shared MCP3008 ADC Bus
+Owns the single SPI handle for the MCP3008 and scans channels in bursts
+"""
+
+import time
+import ctypes
+import fcntl
+import threading
+import logging
+import spidev
+from monitoring.metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+SCAN_SECONDS = Histogram('hydroponic_adc_scan_seconds', 'Duration of one MCP3008 burst scan', ['bus'])
+FRAMES = Counter('hydroponic_adc_frames_total', 'MCP3008 conversions read', ['bus'])
+
+# Linux spidev ioctl layout (linux/spi/spidev.h)
+SPI_IOC_MAGIC = ord('k')
+SPI_TRANSFER_SIZE = 32
+MAX_FRAMES_PER_MESSAGE = 256  # keeps each message well under spidev bufsiz (4096)
+
+
+class SpiIocTransfer(ctypes.Structure):
+    _fields_ = [
+        ('tx_buf', ctypes.c_uint64),
+        ('rx_buf', ctypes.c_uint64),
+        ('len', ctypes.c_uint32),
+        ('speed_hz', ctypes.c_uint32),
+        ('delay_usecs', ctypes.c_uint16),
+        ('bits_per_word', ctypes.c_uint8),
+        ('cs_change', ctypes.c_uint8),
+        ('tx_nbits', ctypes.c_uint8),
+        ('rx_nbits', ctypes.c_uint8),
+        ('word_delay_usecs', ctypes.c_uint8),
+        ('pad', ctypes.c_uint8),
+    ]
+
+
+def spi_ioc_message(count):
+    """Build the SPI_IOC_MESSAGE(count) ioctl request number"""
+    return (1 << 30) | ((count * SPI_TRANSFER_SIZE) << 16) | (SPI_IOC_MAGIC << 8)
+
+
+class MCP3008Bus:
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, spi_bus=0, spi_device=0, max_speed_hz=1350000):
+        self.spi_bus = spi_bus
+        self.spi_device = spi_device
+        self.max_speed_hz = max_speed_hz
+        self.lock = threading.Lock()
+        self.users = 0
+        self.use_ioctl = True
+        self.scan_seconds = SCAN_SECONDS.labels(f"{spi_bus}.{spi_device}")
+        self.frames = FRAMES.labels(f"{spi_bus}.{spi_device}")
+
+        self.spi = spidev.SpiDev()
+        self.spi.open(spi_bus, spi_device)
+        self.spi.max_speed_hz = max_speed_hz
+
+    @classmethod
+    def shared(cls, spi_bus=0, spi_device=0, max_speed_hz=1350000):
+        """Return the process-wide bus for (spi_bus, spi_device), opening it once"""
+        key = (spi_bus, spi_device)
+        with cls._shared_lock:
+            bus = cls._shared.get(key)
+            if bus is None:
+                bus = cls(spi_bus, spi_device, max_speed_hz)
+                cls._shared[key] = bus
+                logger.info(f"Opened MCP3008 on SPI {spi_bus}.{spi_device}")
+            bus.users += 1
+            return bus
+
+    @staticmethod
+    def frame(channel):
+        """Single-ended conversion request for one channel"""
+        return [1, (8 + channel) << 4, 0]
+
+    @staticmethod
+    def decode(rx, offset=0):
+        """Extract the 10-bit result from a 3-byte response frame"""
+        return ((rx[offset + 1] & 3) << 8) + rx[offset + 2]
+
+    def read_channel(self, channel):
+        """Read one raw value from a channel"""
+        with self.lock:
+            adc = self.spi.xfer2(self.frame(channel))
+        return self.decode(adc)
+
+    def scan(self, channels, samples=10):
+        """Read `samples` raw values from each channel in one burst
+
+        Returns {channel: [code, ...]}. Channels are interleaved so every
+        channel's block spans the same time window.
+        """
+        channels = list(channels)
+        order = [ch for _ in range(samples) for ch in channels]
+        with self.lock:
+            start = time.perf_counter()
+            codes = self._transfer(order)
+            self.scan_seconds.observe(time.perf_counter() - start)
+        self.frames.inc(len(order))
+
+        blocks = {ch: [] for ch in channels}
+        for ch, code in zip(order, codes):
+            blocks[ch].append(code)
+        return blocks
+
+    def _transfer(self, order):
+        """Run one conversion per entry in `order`, batching frames per ioctl"""
+        codes = []
+        for start in range(0, len(order), MAX_FRAMES_PER_MESSAGE):
+            chunk = order[start:start + MAX_FRAMES_PER_MESSAGE]
+            if self.use_ioctl:
+                try:
+                    codes.extend(self._transfer_ioctl(chunk))
+                    continue
+                except (OSError, AttributeError, TypeError) as e:
+                    # Not a real spidev node - fall back to one xfer2 per frame
+                    logger.warning(f"Burst SPI transfer unavailable, using per-frame reads: {e}")
+                    self.use_ioctl = False
+            for ch in chunk:
+                codes.append(self.decode(self.spi.xfer2(self.frame(ch))))
+        return codes
+
+    def _transfer_ioctl(self, chunk):
+        """Pack every frame into one SPI_IOC_MESSAGE, toggling CS between frames"""
+        count = len(chunk)
+        tx = (ctypes.c_uint8 * (3 * count))()
+        rx = (ctypes.c_uint8 * (3 * count))()
+        transfers = (SpiIocTransfer * count)()
+
+        base_tx = ctypes.addressof(tx)
+        base_rx = ctypes.addressof(rx)
+        for i, ch in enumerate(chunk):
+            tx[3 * i:3 * i + 3] = self.frame(ch)
+            t = transfers[i]
+            t.tx_buf = base_tx + 3 * i
+            t.rx_buf = base_rx + 3 * i
+            t.len = 3
+            t.speed_hz = self.max_speed_hz
+            t.bits_per_word = 8
+            # MCP3008 only starts a new conversion on a CS falling edge
+            t.cs_change = 1 if i < count - 1 else 0
+
+        fcntl.ioctl(self.spi.fileno(), spi_ioc_message(count), transfers)
+        return [self.decode(rx, 3 * i) for i in range(count)]
+
+    def release(self):
+        """Drop one user; the SPI handle closes when the last user releases"""
+        with self._shared_lock:
+            self.users -= 1
+            if self.users > 0:
+                return
+            self._shared.pop((self.spi_bus, self.spi_device), None)
+        self.close()
+
+    def close(self):
+        """Close SPI connection"""
+        self.spi.close()
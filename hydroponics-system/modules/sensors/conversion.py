@@ -0,0 +1,93 @@
+"""
+ADC Conversion Tables
+Precomputed MCP3008 code -> engineering unit tables
+
+A 10-bit ADC has only 1024 codes, so each channel's conversion curve is
+evaluated once per calibration and then looked up. Filtered values are
+fractional codes and are interpolated between neighbouring entries.
+Temperature-dependent curves (TDS) are evaluated directly for one value;
+only whole blocks go through tables, built for the grid temperatures a
+block needs and interpolated between them.
+"""
+
+import numpy as np
+
+ADC_CODES = 1024
+CODES = np.arange(ADC_CODES, dtype=float)
+
+
+class CodeTable:
+    """Conversion table for one channel
+
+    `curve(codes)` maps an array of codes to units. `key` identifies the
+    calibration the table was built for; the owner rebuilds when it changes.
+    """
+
+    def __init__(self, curve, key=None):
+        self.key = key
+        self.values = np.asarray(curve(CODES), dtype=float)
+
+    def lookup(self, code):
+        """Units for one (possibly fractional) code"""
+        if code <= 0:
+            return float(self.values[0])
+        if code >= ADC_CODES - 1:
+            return float(self.values[-1])
+        i = int(code)
+        low, high = self.values[i:i + 2].tolist()
+        return low + (code - i) * (high - low)
+
+    def convert(self, codes):
+        """Units for a whole block of raw integer codes"""
+        codes = np.clip(np.asarray(codes, dtype=np.intp), 0, ADC_CODES - 1)
+        return self.values[codes]
+
+
+class TemperatureTable:
+    """Conversion over a grid of temperatures
+
+    `curve(codes, temperature)` maps codes (an array, or one float) to
+    units at one temperature. A row of the grid is tabulated the first time
+    a block needs it; temperatures outside the grid are evaluated directly
+    rather than extrapolated.
+    """
+
+    def __init__(self, curve, grid=(0.0, 40.0, 0.5), key=None):
+        self.curve = curve
+        self.key = key
+        low, high, step = grid
+        self.temperatures = np.arange(low, high + step / 2, step)
+        self.t_low = float(self.temperatures[0])
+        self.t_high = float(self.temperatures[-1])
+        self.t_step = float(step)
+        self.rows = [None] * len(self.temperatures)
+
+    def row(self, i):
+        """Code table for the i-th grid temperature"""
+        if self.rows[i] is None:
+            t = float(self.temperatures[i])
+            self.rows[i] = CodeTable(lambda codes: self.curve(codes, t))
+        return self.rows[i]
+
+    def _row(self, temperature):
+        """(row index, weight of the next row) for a temperature inside the grid"""
+        position = (temperature - self.t_low) / self.t_step
+        i = min(int(position), len(self.rows) - 2)
+        return i, position - i
+
+    def in_grid(self, temperature):
+        return self.t_low <= temperature <= self.t_high and len(self.rows) > 1
+
+    def lookup(self, code, temperature):
+        """Units for one (possibly fractional) code at a temperature"""
+        # One evaluation costs no more than interpolating four table entries
+        return float(self.curve(min(max(float(code), 0.0), ADC_CODES - 1.0), temperature))
+
+    def convert(self, codes, temperature):
+        """Units for a whole block of raw integer codes at a temperature"""
+        if not self.in_grid(temperature):
+            codes = np.clip(np.asarray(codes, dtype=float), 0, ADC_CODES - 1)
+            return np.asarray(self.curve(codes, temperature), dtype=float)
+        i, weight = self._row(temperature)
+        low = self.row(i).convert(codes)
+        return low + weight * (self.row(i + 1).convert(codes) - low)
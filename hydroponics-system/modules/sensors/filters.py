@@ -0,0 +1,170 @@
+"""
+Streaming Signal Filters
+NumPy filter stages between raw ADC sample blocks and conversion math
+
+A chain is built from a spec such as [('despike', 3.0), ('median',),
+('ema', 0.3)]: block stages work on each cycle's array of samples, and the
+stateful stages (EMA, Kalman) carry their state from one cycle to the next.
+"""
+
+import numpy as np
+
+
+class Despike:
+    """Drop samples more than `k` median absolute deviations from the median
+
+    The MAD is floored at `min_mad` (one ADC code) so a quiet, mostly
+    constant block does not reject its own one-code dither.
+    """
+
+    def __init__(self, k=3.0, min_mad=1.0):
+        self.k = k
+        self.min_mad = min_mad
+
+    def __call__(self, block):
+        if np.ndim(block) == 0 or block.size < 3:
+            return block
+        median = np.median(block)
+        deviation = np.abs(block - median)
+        mad = max(np.median(deviation), self.min_mad)
+        return block[deviation <= self.k * mad]
+
+    def reset(self):
+        pass
+
+
+class Median:
+    """Block median"""
+
+    def __call__(self, block):
+        return np.median(block)
+
+    def reset(self):
+        pass
+
+
+class Mean:
+    """Block mean"""
+
+    def __call__(self, block):
+        return np.mean(block)
+
+    def reset(self):
+        pass
+
+
+class TrimmedMean:
+    """Mean after discarding `proportion` of samples from each end"""
+
+    def __init__(self, proportion=0.2):
+        self.proportion = proportion
+
+    def __call__(self, block):
+        if np.ndim(block) == 0:
+            return block
+        cut = int(block.size * self.proportion)
+        ordered = np.sort(block)
+        if cut and block.size - 2 * cut > 0:
+            ordered = ordered[cut:block.size - cut]
+        return np.mean(ordered)
+
+    def reset(self):
+        pass
+
+
+class EMA:
+    """Exponential moving average carried across cycles
+
+    A block is folded in sample by sample, vectorized with decay weights.
+    """
+
+    def __init__(self, alpha=0.3):
+        self.alpha = alpha
+        self.value = None
+
+    def __call__(self, block):
+        samples = np.atleast_1d(np.asarray(block, dtype=float))
+        if self.value is None:
+            self.value = samples[0]
+            samples = samples[1:]
+        if samples.size:
+            decay = 1.0 - self.alpha
+            n = samples.size
+            weights = self.alpha * decay ** np.arange(n - 1, -1, -1)
+            self.value = decay ** n * self.value + np.dot(weights, samples)
+        return self.value
+
+    def reset(self):
+        self.value = None
+
+
+class Kalman:
+    """1-D random-walk Kalman filter carried across cycles
+
+    `process_var` is how much the true value may move per cycle and
+    `measurement_var` the noise of one sample (both in ADC codes squared);
+    a block of n samples counts as one measurement with variance / n.
+    """
+
+    def __init__(self, process_var=1.0, measurement_var=16.0):
+        self.process_var = process_var
+        self.measurement_var = measurement_var
+        self.value = None
+        self.variance = None
+
+    def __call__(self, block):
+        samples = np.atleast_1d(np.asarray(block, dtype=float))
+        measurement = samples.mean()
+        noise = self.measurement_var / samples.size
+        if self.value is None:
+            self.value = measurement
+            self.variance = noise
+            return self.value
+
+        variance = self.variance + self.process_var
+        gain = variance / (variance + noise)
+        self.value += gain * (measurement - self.value)
+        self.variance = (1.0 - gain) * variance
+        return self.value
+
+    def reset(self):
+        self.value = None
+        self.variance = None
+
+
+STAGES = {
+    'despike': Despike,
+    'median': Median,
+    'mean': Mean,
+    'trimmed_mean': TrimmedMean,
+    'ema': EMA,
+    'kalman': Kalman,
+}
+
+
+class FilterChain:
+    def __init__(self, stages):
+        self.stages = stages
+
+    @classmethod
+    def from_spec(cls, spec):
+        """Build from [(name, *args), ...] as written in settings.py or tanks.json"""
+        stages = []
+        for entry in spec or [('mean',)]:
+            name, args = entry[0], entry[1:]
+            if name not in STAGES:
+                raise ValueError(f"Unknown filter stage '{name}' (choose from {', '.join(STAGES)})")
+            stages.append(STAGES[name](*args))
+        return cls(stages)
+
+    def process(self, samples):
+        """Run a block of raw samples through every stage; returns one value"""
+        value = np.asarray(samples, dtype=float)
+        for stage in self.stages:
+            value = stage(value)
+        return float(np.mean(value))
+
+    def reset(self):
+        """Forget carried state (e.g. after recalibration or a probe swap)"""
+        for stage in self.stages:
+            stage.reset()
@@ -0,0 +1,332 @@
+"""
+Sensor Health
+Streaming checks that decide whether each reading can be trusted for dosing
+
+Raw ADC blocks are checked for railed, stuck and noisy signals; converted
+readings for failed reads, implausible values and steps, and slow drift
+since the last calibration. Every statistic is updated in O(1) per sample
+(a block costs one vectorized pass) and decays exponentially, so nothing
+keeps a window of past samples.
+"""
+
+import math
+import time
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ADC_FULL_SCALE = 1023
+
+
+class RunningStats:
+    """Exponentially weighted mean and variance (Welford's update)
+
+    `half_life` is in samples. A block is merged in one step with Chan's
+    parallel formula, as if its samples had arrived together.
+    """
+
+    def __init__(self, half_life=256):
+        self.decay = 0.5 ** (1.0 / half_life)
+        self.weight = 0.0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, x):
+        self.weight = self.weight * self.decay + 1.0
+        delta = x - self.mean
+        self.mean += delta / self.weight
+        self.m2 = self.m2 * self.decay + delta * (x - self.mean)
+
+    def add_block(self, block):
+        """Merge a block; returns its own sum of squared deviations"""
+        n = block.size
+        mean = block.mean()
+        deviations = block - mean
+        m2 = float(np.dot(deviations, deviations))
+        decay = self.decay ** n
+        old = self.weight * decay
+        total = old + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.m2 = self.m2 * decay + m2 + delta * delta * old * n / total
+        self.weight = total
+        return m2
+
+    @property
+    def variance(self):
+        return self.m2 / self.weight if self.weight else 0.0
+
+    @property
+    def std(self):
+        return math.sqrt(max(self.variance, 0.0))
+
+
+class Trend:
+    """Exponentially weighted least-squares slope of a value over time
+
+    `time_constant` (seconds) sets how fast old points fade; the slope is
+    in units per second.
+    """
+
+    def __init__(self, time_constant):
+        self.time_constant = time_constant
+        self.reset()
+
+    def reset(self):
+        self.weight = 0.0
+        self.mean_t = 0.0
+        self.mean_v = 0.0
+        self.c_tv = 0.0
+        self.c_tt = 0.0
+        self.first = self.last = None
+
+    def add(self, t, value):
+        if self.last is None:
+            self.first = t
+            decay = 0.0
+        else:
+            decay = math.exp(-max(t - self.last, 0.0) / self.time_constant)
+        self.last = t
+        t -= self.first  # keep the sums small
+        self.weight = self.weight * decay + 1.0
+        dt = t - self.mean_t
+        dv = value - self.mean_v
+        self.mean_t += dt / self.weight
+        self.mean_v += dv / self.weight
+        self.c_tv = self.c_tv * decay + dt * (value - self.mean_v)
+        self.c_tt = self.c_tt * decay + dt * (t - self.mean_t)
+
+    def span(self):
+        return 0.0 if self.last is None else self.last - self.first
+
+    @property
+    def slope(self):
+        return self.c_tv / self.c_tt if self.c_tt > 0 else 0.0
+
+
+class SignalCheck:
+    """Raw-code checks for one ADC channel
+
+    rail: most of a block at 0 or full scale (probe unplugged or shorted);
+    stuck: the same code `stuck_samples` times in a row, when real probes
+    always dither by a code or two; noisy: the spread of codes within
+    blocks (pooled, so the signal moving between blocks does not count)
+    above `max_noise`.
+    """
+
+    def __init__(self, rail_fraction=0.5, stuck_samples=256, max_noise=20.0, half_life=256,
+                 full_scale=ADC_FULL_SCALE):
+        self.rail_fraction = rail_fraction
+        self.stuck_samples = stuck_samples
+        self.max_noise = max_noise
+        self.full_scale = full_scale
+        self.stats = RunningStats(half_life)
+        self.decay = self.stats.decay
+        self.noise_m2 = 0.0
+        self.noise_dof = 0.0
+        self.stuck_code = None
+        self.stuck_run = 0
+
+    @property
+    def noise(self):
+        """Decaying pooled within-block standard deviation, in codes"""
+        return math.sqrt(self.noise_m2 / self.noise_dof) if self.noise_dof else 0.0
+
+    def update(self, block):
+        """Faults seen in a block of raw codes"""
+        block = np.asarray(block, dtype=float)
+        if not block.size:
+            return set()
+        faults = set()
+        low = block.min()
+        high = block.max()
+
+        railed = np.count_nonzero((block <= 0) | (block >= self.full_scale))
+        if railed > self.rail_fraction * block.size:
+            faults.add('rail')
+
+        if low == high:
+            self.stuck_run = self.stuck_run + block.size if low == self.stuck_code else block.size
+            self.stuck_code = low
+        else:
+            self.stuck_run = 0
+            self.stuck_code = None
+        if self.stuck_run >= self.stuck_samples:
+            faults.add('stuck')
+
+        m2 = self.stats.add_block(block)
+        decay = self.decay ** block.size
+        self.noise_m2 = self.noise_m2 * decay + m2
+        self.noise_dof = self.noise_dof * decay + block.size - 1
+        if self.noise > self.max_noise:
+            faults.add('noisy')
+        return faults
+
+
+class ReadingCheck:
+    """Checks on one converted reading
+
+    out_of_range: outside what the probe can plausibly report (a DS18B20
+    power-on 85°C, a dry TDS probe); step: a change larger than `max_step`
+    between readings while no dose is mixing in; drift: the trend between
+    doses, fitted since the last calibration, steeper than `drift_limit`
+    per day.
+    """
+
+    def __init__(self, valid_range=None, max_step=None, drift_limit=None, drift_time_constant=21600,
+                 min_drift_span=3600):
+        self.valid_range = valid_range
+        self.max_step = max_step
+        self.drift_limit = drift_limit
+        self.min_drift_span = min_drift_span
+        self.trend = Trend(drift_time_constant)
+        self.last = None
+
+    def reset(self):
+        """Forget the baseline (after recalibration the reading legitimately jumps)"""
+        self.trend.reset()
+        self.last = None
+
+    def update(self, value, now, mixing=False, faults=()):
+        """(faults, warnings) for one reading, adding to `faults` already found in its raw signal
+
+        `value` None is a failed read.
+        """
+        faults = set(faults)
+        warnings = set()
+        if value is None:
+            faults.add('read_error')
+            return faults, warnings
+        if self.valid_range is not None:
+            low, high = self.valid_range
+            if not low <= value <= high:
+                faults.add('out_of_range')
+        if (self.max_step is not None and self.last is not None and not mixing
+                and abs(value - self.last) > self.max_step):
+            faults.add('step')
+        self.last = value
+
+        # Doses move the reading on purpose; drift is judged between them
+        if self.drift_limit is not None and not mixing and not faults:
+            self.trend.add(now, value)
+            drift = self.drift_per_day()
+            if drift is not None and abs(drift) > self.drift_limit:
+                warnings.add('drift')
+        return faults, warnings
+
+    def drift_per_day(self):
+        """Fitted trend in units per day, or None until it covers `min_drift_span`"""
+        if self.trend.span() < self.min_drift_span:
+            return None
+        return self.trend.slope * 86400
+
+
+class SensorState:
+    """Trust of one reading, with hysteresis
+
+    A fault makes the reading untrusted at once; it is trusted again only
+    after `recovery` consecutive clean readings.
+    """
+
+    def __init__(self, name, recovery=3):
+        self.name = name
+        self.recovery = recovery
+        self.faults = set()          # latest faults
+        self.warnings = set()
+        self.trusted = True
+        self.clean = 0
+        self.since = None            # time the current trust state began
+
+    def update(self, faults, warnings, now):
+        """Returns True when trust changed"""
+        self.faults = faults
+        self.warnings = warnings
+        if faults:
+            self.clean = 0
+            changed = self.trusted
+            self.trusted = False
+        else:
+            self.clean += 1
+            changed = not self.trusted and self.clean >= self.recovery
+            if changed:
+                self.trusted = True
+        if changed or self.since is None:
+            self.since = now
+        return changed
+
+
+class HealthMonitor:
+    """Health of every sensor of one tank
+
+    check_block() takes raw ADC blocks, check_reading() converted readings;
+    trusted() is what dosing asks before acting on a reading.
+    """
+
+    def __init__(self, settings, on_change=None):
+        s = settings
+        self.settings = settings
+        self.on_change = on_change  # called with (name, state) when trust changes
+        self.signals = {name: SignalCheck(s.adc_rail_fraction, s.adc_stuck_samples, s.adc_max_noise)
+                        for name in ('tds', 'ph')}
+        self.signal_faults = {name: set() for name in self.signals}
+        self.readings = {
+            'tds': ReadingCheck(s.tds_valid_range, s.tds_max_step, s.tds_drift_limit,
+                                s.drift_time_constant),
+            'ph': ReadingCheck(s.ph_valid_range, s.ph_max_step, s.ph_drift_limit,
+                               s.drift_time_constant),
+            'temperature': ReadingCheck(s.temperature_valid_range),
+            'water_level': ReadingCheck(s.water_level_valid_range),
+        }
+        self.states = {name: SensorState(name, s.health_recovery_readings) for name in self.readings}
+        self.calibrated = {}         # reading -> time of its calibration
+
+    def check_block(self, name, block):
+        """Raw ADC checks for a reading; their faults count towards its next check_reading()"""
+        try:
+            self.signal_faults[name] = self.signals[name].update(block)
+        except Exception as e:
+            logger.error(f"Error checking {name} signal: {e}")
+
+    def check_reading(self, name, value, now=None, mixing=False):
+        """Judge a new reading; returns True if it can be trusted"""
+        now = time.time() if now is None else now
+        faults, warnings = self.readings[name].update(value, now, mixing, self.signal_faults.get(name, ()))
+        if self.calibration_due(name, now):
+            warnings.add('calibration_due')
+        state = self.states[name]
+        if state.update(faults, warnings, now) and self.on_change is not None:
+            self.on_change(name, state)
+        return state.trusted
+
+    def calibration_applied(self, name, updated):
+        """A new calibration: restart drift tracking from it"""
+        if updated == self.calibrated.get(name):
+            return
+        self.calibrated[name] = updated
+        self.readings[name].reset()
+
+    def calibration_due(self, name, now):
+        updated = self.calibrated.get(name)
+        max_age = self.settings.calibration_max_age_days
+        return bool(updated and max_age and now - updated > max_age * 86400)
+
+    def trusted(self, name):
+        return self.states[name].trusted
+
+    def status(self):
+        """{reading: {'trusted', 'faults', 'warnings', ...}} for publishing"""
+        status = {}
+        for name, state in self.states.items():
+            entry = {
+                'trusted': state.trusted,
+                'faults': sorted(state.faults),
+                'warnings': sorted(state.warnings),
+            }
+            if name in self.signals:
+                entry['noise'] = round(self.signals[name].noise, 2)
+            drift = self.readings[name].drift_per_day()
+            if drift is not None:
+                entry['drift_per_day'] = round(drift, 3)
+            status[name] = entry
+        return status
@@ -4,47 +4,140 @@ Measures distance to water surface in cm
 """
 
 import time
+import threading
 import logging
 import RPi.GPIO as GPIO
+from monitoring.metrics import Counter, Histogram
 
 logger = logging.getLogger(__name__)
 
+READ_SECONDS = Histogram('hydroponic_level_read_seconds', 'Duration of one water level reading', ['trig_pin'])
+MISSED_ECHOES = Counter('hydroponic_level_missed_echoes_total',
+                        'Ultrasonic pings that got no echo', ['trig_pin'])
+
 class LevelSensor:
-    def __init__(self, trig_pin=15, echo_pin=18):
+    def __init__(self, trig_pin=15, echo_pin=18, mode='edge', burst=5, ping_interval=0.06):
         self.trig_pin = trig_pin
         self.echo_pin = echo_pin
         self.speed_of_sound = 34300  # cm/s at 20°C
+        self.mode = mode             # 'edge' (interrupt driven) or 'poll'
+        self.burst = burst           # pings per reading in edge mode
+        self.ping_interval = ping_interval  # HC-SR04 needs ~60 ms between pings
+        self.max_echo = 0.04         # Max 40ms wait (about 6.8m)
+
+        # Edge timestamps, written from the GPIO callback thread
+        self.echo_start = None
+        self.echo_end = None
+        self.echo_done = threading.Event()
+
+        self.read_seconds = READ_SECONDS.labels(trig_pin)
+        self.missed_echoes = MISSED_ECHOES.labels(trig_pin)
 
         GPIO.setmode(GPIO.BCM)
         GPIO.setup(self.trig_pin, GPIO.OUT)
         GPIO.setup(self.echo_pin, GPIO.IN)
         GPIO.output(self.trig_pin, False)
+
+        if self.mode == 'edge':
+            try:
+                GPIO.add_event_detect(self.echo_pin, GPIO.BOTH, callback=self._on_edge)
+            except Exception as e:
+                logger.warning(f"Edge detection unavailable on GPIO {echo_pin}, polling instead: {e}")
+                self.mode = 'poll'
+
         time.sleep(0.5)  # Initial settling time
 
-    def read(self):
-        """Measure distance to water surface in cm"""
-        try:
-            # Send trigger pulse
-            GPIO.output(self.trig_pin, True)
-            time.sleep(0.00001)  # 10 µs pulse
-            GPIO.output(self.trig_pin, False)
+    @staticmethod
+    def speed_of_sound_at(temperature):
+        """Speed of sound in air (cm/s) at a temperature in °C"""
+        return (331.3 + 0.606 * temperature) * 100
+
+    def _on_edge(self, channel):
+        """GPIO callback: timestamp echo rising/falling edges"""
+        now = time.perf_counter()
+        if GPIO.input(channel):
+            self.echo_start = now
+        elif self.echo_start is not None:
+            self.echo_end = now
+            self.echo_done.set()
+
+    def _trigger(self):
+        """Send a 10 µs trigger pulse"""
+        GPIO.output(self.trig_pin, True)
+        time.sleep(0.00001)
+        GPIO.output(self.trig_pin, False)
 
-            # Wait for echo start
-            pulse_start = time.time()
-            timeout = pulse_start + 0.04  # Max 40ms wait (about 6.8m)
-            while GPIO.input(self.echo_pin) == 0 and pulse_start < timeout:
-                pulse_start = time.time()
+    def ping(self):
+        """Fire one ping and wait (without spinning) for the echo; returns seconds or None"""
+        self.echo_start = None
+        self.echo_end = None
+        self.echo_done.clear()
+        self._trigger()
 
-            # Wait for echo end
-            pulse_end = time.time()
-            while GPIO.input(self.echo_pin) == 1 and pulse_end < timeout:
-                pulse_end = time.time()
+        if not self.echo_done.wait(self.max_echo):
+            return None
+        return self.echo_end - self.echo_start
+
+    def ping_polling(self):
+        """Fire one ping and busy-wait on the echo pin; returns seconds"""
+        self._trigger()
+
+        # Wait for echo start
+        pulse_start = time.perf_counter()
+        timeout = pulse_start + self.max_echo
+        while GPIO.input(self.echo_pin) == 0 and pulse_start < timeout:
+            pulse_start = time.perf_counter()
+
+        # Wait for echo end
+        pulse_end = time.perf_counter()
+        while GPIO.input(self.echo_pin) == 1 and pulse_end < timeout:
+            pulse_end = time.perf_counter()
+
+        return pulse_end - pulse_start
+
+    @staticmethod
+    def robust_median(values, max_deviations=3.0):
+        """Median after dropping values more than N MADs from the median"""
+        values = sorted(values)
+        median = values[len(values) // 2]
+        mad = sorted(abs(v - median) for v in values)[len(values) // 2]
+        if mad > 0:
+            values = [v for v in values if abs(v - median) <= max_deviations * mad]
+        return values[len(values) // 2]
+
+    def read(self, temperature=None):
+        """Measure distance to water surface in cm, or None if the read failed
+
+        `temperature` (°C) corrects the speed of sound; without it the
+        20°C constant is used.
+        """
+        start = time.perf_counter()
+        try:
+            if temperature is None:
+                speed = self.speed_of_sound
+            else:
+                speed = self.speed_of_sound_at(temperature)
 
-            # Calculate pulse duration
-            pulse_duration = pulse_end - pulse_start
+            if self.mode == 'poll':
+                pulse_duration = self.ping_polling()
+            else:
+                # Median of a burst, skipping pings that never echoed
+                durations = []
+                for i in range(self.burst):
+                    if i:
+                        time.sleep(self.ping_interval)
+                    duration = self.ping()
+                    if duration is not None:
+                        durations.append(duration)
+                    else:
+                        self.missed_echoes.inc()
+                if not durations:
+                    logger.error("No echo received from level sensor")
+                    return None
+                pulse_duration = self.robust_median(durations)
 
             # Calculate distance (cm)
-            distance = pulse_duration * self.speed_of_sound / 2
+            distance = pulse_duration * speed / 2
 
             # Log and return
             logger.debug(f"Water level distance: {distance:.1f} cm")
@@ -52,8 +145,12 @@ class LevelSensor:
 
         except Exception as e:
             logger.error(f"Error reading water level: {e}")
-            return 0.0
+            return None
+        finally:
+            self.read_seconds.observe(time.perf_counter() - start)
 
     def cleanup(self):
         """Clean up GPIO pins"""
-        GPIO.cleanup([self.trig_pin, self.echo_pin])
\ No newline at end of file
+        if self.mode == 'edge':
+            GPIO.remove_event_detect(self.echo_pin)
+        GPIO.cleanup([self.trig_pin, self.echo_pin])
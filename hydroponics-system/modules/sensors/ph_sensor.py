@@ -1,64 +1,99 @@
-                            """
-                            pH Sensor Interface
-                            Uses analog input via MCP3008 ADC
-                            """
-
-                            import spidev
-                            import time
-                            import logging
-                            from config.settings import Settings
-
-                            logger = logging.getLogger(__name__)
-
-                            class PHSensor:
-                                def __init__(self, channel=1, spi_bus=0, spi_device=0):
-                                    self.channel = channel
-                                    self.spi = spidev.SpiDev()
-                                    self.spi.open(spi_bus, spi_device)
-                                    self.spi.max_speed_hz = 1350000
-
-                                    # Load calibration from settings
-                                    settings = Settings()
-                                    self.calibration_offset = settings.ph_calibration_offset
-                                    self.calibration_slope = settings.ph_calibration_slope
-                                    self.reference_voltage = 3.3
-
-                                def read_adc(self):
-                                    """Read raw value from MCP3008"""
-                                    adc = self.spi.xfer2([1, (8 + self.channel) << 4, 0])
-                                    data = ((adc[1] & 3) << 8) + adc[2]
-                                    return data
-
-                                def read(self):
-                                    """Read pH value"""
-                                    try:
-                                        # Take multiple readings for stability
-                                        readings = []
-                                        for _ in range(10):
-                                            readings.append(self.read_adc())
-                                            time.sleep(0.01)
-
-                                        # Average the readings
-                                        avg_reading = sum(readings) / len(readings)
-
-                                        # Convert to voltage
-                                        voltage = (avg_reading / 1023.0) * self.reference_voltage
-
-                                        # Convert voltage to pH
-                                        # Typical pH probe outputs ~2.5V at pH 7.0
-                                        # Changes by ~0.18V per pH unit
-                                        ph = 7.0 + ((2.5 - voltage) / 0.18)
-
-                                        # Apply calibration
-                                        ph = (ph * self.calibration_slope) + self.calibration_offset
-
-                                        # Constrain to valid pH range
-                                        return max(0, min(14, ph))
-
-                                    except Exception as e:
-                                        logger.error(f"Error reading pH sensor: {e}")
-                                        return 7.0
-
-                                def cleanup(self):
-                                    """Clean up SPI connection"""
-                                    self.spi.close()
\ No newline at end of file
+"""
+pH Sensor Interface
+Uses analog input via MCP3008 ADC
+"""
+
+import logging
+import numpy as np
+from config.settings import Settings
+from sensors.adc_bus import MCP3008Bus
+from sensors.filters import FilterChain
+from sensors.conversion import CodeTable
+
+logger = logging.getLogger(__name__)
+
+class PHSensor:
+    def __init__(self, channel=1, spi_bus=0, spi_device=0, samples=10, filters=None):
+        self.channel = channel
+        self.samples = samples
+        self.bus = MCP3008Bus.shared(spi_bus, spi_device)
+
+        # Streaming filter from raw codes to one value; state persists across reads
+        self.filters = FilterChain.from_spec(filters)
+
+        # Load calibration from settings (until a stored calibration is applied)
+        settings = Settings()
+        self.default_offset = settings.ph_calibration_offset
+        self.default_slope = settings.ph_calibration_slope
+        self.calibration_offset = self.default_offset
+        self.calibration_slope = self.default_slope
+        self.reference_voltage = 3.3
+        self.calibration_id = f"ph/{spi_bus}.{spi_device}/{channel}"
+
+        # Code -> pH table, rebuilt when calibration changes
+        self.table = None
+
+    def read_adc(self):
+        """Read raw value from MCP3008"""
+        return self.bus.read_channel(self.channel)
+
+    def read(self, samples=None):
+        """Read pH value, or None if the read failed
+
+        `samples` is an optional block of raw codes from a shared bus scan;
+        without it the sensor runs its own burst.
+        """
+        try:
+            # Take multiple readings for stability
+            if samples is None:
+                samples = self.bus.scan([self.channel], self.samples)[self.channel]
+            return self.convert(samples)
+
+        except Exception as e:
+            logger.error(f"Error reading pH sensor: {e}")
+            return None
+
+    def apply_calibration(self, values):
+        """Use stored calibration values; the conversion table rebuilds on the next read"""
+        self.calibration_offset = values.get('offset', self.default_offset)
+        self.calibration_slope = values.get('slope', self.default_slope)
+
+    def calibration_key(self):
+        return (self.calibration_offset, self.calibration_slope, self.reference_voltage)
+
+    def curve(self, codes):
+        """pH for an array of raw ADC codes"""
+        # Convert to voltage
+        voltage = (codes / 1023.0) * self.reference_voltage
+
+        # Convert voltage to pH
+        # Typical pH probe outputs ~2.5V at pH 7.0
+        # Changes by ~0.18V per pH unit
+        ph = 7.0 + ((2.5 - voltage) / 0.18)
+
+        # Apply calibration
+        ph = (ph * self.calibration_slope) + self.calibration_offset
+
+        # Constrain to valid pH range
+        return np.clip(ph, 0, 14)
+
+    def lookup_table(self):
+        """Conversion table for the current calibration"""
+        key = self.calibration_key()
+        if self.table is None or self.table.key != key:
+            self.table = CodeTable(self.curve, key)
+        return self.table
+
+    def convert(self, samples):
+        """Convert a block of raw ADC codes to pH"""
+        # Filter the readings, then look the filtered code up
+        avg_reading = self.filters.process(samples)
+        return self.lookup_table().lookup(avg_reading)
+
+    def convert_block(self, samples):
+        """Convert every raw code of a block to pH, unfiltered"""
+        return self.lookup_table().convert(samples)
+
+    def cleanup(self):
+        """Release the shared SPI bus"""
+        self.bus.release()
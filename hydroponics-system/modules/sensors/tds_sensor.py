@@ -1,62 +1,98 @@
-                    """
-                    TDS (Total Dissolved Solids) Sensor Interface
-                    Uses analog input via MCP3008 ADC
-                    """
-
-                    import spidev
-                    import time
-                    import logging
-
-                    logger = logging.getLogger(__name__)
-
-                    class TDSSensor:
-                        def __init__(self, channel=0, spi_bus=0, spi_device=0):
-                            self.channel = channel
-                            self.spi = spidev.SpiDev()
-                            self.spi.open(spi_bus, spi_device)
-                            self.spi.max_speed_hz = 1350000
-
-                            # Calibration values
-                            self.calibration_factor = 0.5
-                            self.reference_voltage = 3.3
-
-                        def read_adc(self):
-                            """Read raw value from MCP3008"""
-                            adc = self.spi.xfer2([1, (8 + self.channel) << 4, 0])
-                            data = ((adc[1] & 3) << 8) + adc[2]
-                            return data
-
-                        def read(self, temperature=25.0):
-                            """Read TDS value with temperature compensation"""
-                            try:
-                                # Take multiple readings for stability
-                                readings = []
-                                for _ in range(10):
-                                    readings.append(self.read_adc())
-                                    time.sleep(0.01)
-
-                                # Average the readings
-                                avg_reading = sum(readings) / len(readings)
-
-                                # Convert to voltage
-                                voltage = (avg_reading / 1023.0) * self.reference_voltage
-
-                                # Convert to TDS (ppm)
-                                # Temperature compensation formula
-                                compensation_coefficient = 1.0 + 0.02 * (temperature - 25.0)
-                                compensated_voltage = voltage / compensation_coefficient
-
-                                # TDS calculation
-                                tds = (133.42 * compensated_voltage**3 - 
-                                       255.86 * compensated_voltage**2 + 
-                                       857.39 * compensated_voltage) * self.calibration_factor
-
-                                return max(0, tds)  # Ensure non-negative
-
-                            except Exception as e:
-                                logger.error(f"Error reading TDS sensor: {e}")
-                                return 0
-
-                        def cleanup(self):
-                            """Clean up SPI connection"""
-                            self.spi.close()
\ No newline at end of file
+"""
+TDS (Total Dissolved Solids) Sensor Interface
+Uses analog input via MCP3008 ADC
+"""
+
+import logging
+import numpy as np
+from config.settings import Settings
+from sensors.adc_bus import MCP3008Bus
+from sensors.filters import FilterChain
+from sensors.conversion import TemperatureTable
+
+logger = logging.getLogger(__name__)
+
+class TDSSensor:
+    def __init__(self, channel=0, spi_bus=0, spi_device=0, samples=10, filters=None,
+                 temperature_grid=(0.0, 40.0, 0.5)):
+        self.channel = channel
+        self.samples = samples
+        self.bus = MCP3008Bus.shared(spi_bus, spi_device)
+
+        # Streaming filter from raw codes to one value; state persists across reads
+        self.filters = FilterChain.from_spec(filters)
+
+        # Calibration values (settings defaults until a stored calibration is applied)
+        self.default_factor = Settings().tds_calibration_factor
+        self.calibration_factor = self.default_factor
+        self.reference_voltage = 3.3
+        self.calibration_id = f"tds/{spi_bus}.{spi_device}/{channel}"
+
+        # Code -> ppm tables over temperature, rebuilt when calibration changes
+        self.temperature_grid = temperature_grid
+        self.table = None
+
+    def read_adc(self):
+        """Read raw value from MCP3008"""
+        return self.bus.read_channel(self.channel)
+
+    def read(self, temperature=25.0, samples=None):
+        """Read TDS value with temperature compensation, or None if the read failed
+
+        `samples` is an optional block of raw codes from a shared bus scan;
+        without it the sensor runs its own burst.
+        """
+        try:
+            # Take multiple readings for stability
+            if samples is None:
+                samples = self.bus.scan([self.channel], self.samples)[self.channel]
+            return self.convert(samples, temperature)
+
+        except Exception as e:
+            logger.error(f"Error reading TDS sensor: {e}")
+            return None
+
+    def apply_calibration(self, values):
+        """Use stored calibration values; conversion tables rebuild on the next read"""
+        self.calibration_factor = values.get('factor', self.default_factor)
+
+    def calibration_key(self):
+        return (self.calibration_factor, self.reference_voltage)
+
+    def curve(self, codes, temperature):
+        """TDS (ppm) for an array of raw ADC codes at one temperature"""
+        # Convert to voltage
+        voltage = (codes / 1023.0) * self.reference_voltage
+
+        # Convert to TDS (ppm)
+        # Temperature compensation formula
+        compensation_coefficient = 1.0 + 0.02 * (temperature - 25.0)
+        compensated_voltage = voltage / compensation_coefficient
+
+        # TDS calculation
+        tds = (133.42 * compensated_voltage**3 - 
+               255.86 * compensated_voltage**2 + 
+               857.39 * compensated_voltage) * self.calibration_factor
+
+        return np.maximum(0, tds)  # Ensure non-negative
+
+    def lookup_table(self):
+        """Conversion table for the current calibration"""
+        key = self.calibration_key()
+        if self.table is None or self.table.key != key:
+            self.table = TemperatureTable(self.curve, self.temperature_grid, key)
+        return self.table
+
+    def convert(self, samples, temperature=25.0):
+        """Convert a block of raw ADC codes to TDS (ppm)"""
+        # Filter the readings, then look the filtered code up
+        avg_reading = self.filters.process(samples)
+        return self.lookup_table().lookup(avg_reading, temperature)
+
+    def convert_block(self, samples, temperature=25.0):
+        """Convert every raw code of a block to TDS (ppm), unfiltered"""
+        return self.lookup_table().convert(samples, temperature)
+
+    def cleanup(self):
+        """Release the shared SPI bus"""
+        self.bus.release()
@@ -1,64 +1,138 @@
-                            """
-                            pH Sensor Interface
-                            Uses analog input via MCP3008 ADC
-                            """
-
-                            import spidev
-                            import time
-                            import logging
-                            from config.settings import Settings
-
-                            logger = logging.getLogger(__name__)
-
-                            class PHSensor:
-                                def __init__(self, channel=1, spi_bus=0, spi_device=0):
-                                    self.channel = channel
-                                    self.spi = spidev.SpiDev()
-                                    self.spi.open(spi_bus, spi_device)
-                                    self.spi.max_speed_hz = 1350000
-
-                                    # Load calibration from settings
-                                    settings = Settings()
-                                    self.calibration_offset = settings.ph_calibration_offset
-                                    self.calibration_slope = settings.ph_calibration_slope
-                                    self.reference_voltage = 3.3
-
-                                def read_adc(self):
-                                    """Read raw value from MCP3008"""
-                                    adc = self.spi.xfer2([1, (8 + self.channel) << 4, 0])
-                                    data = ((adc[1] & 3) << 8) + adc[2]
-                                    return data
-
-                                def read(self):
-                                    """Read pH value"""
-                                    try:
-                                        # Take multiple readings for stability
-                                        readings = []
-                                        for _ in range(10):
-                                            readings.append(self.read_adc())
-                                            time.sleep(0.01)
-
-                                        # Average the readings
-                                        avg_reading = sum(readings) / len(readings)
-
-                                        # Convert to voltage
-                                        voltage = (avg_reading / 1023.0) * self.reference_voltage
-
-                                        # Convert voltage to pH
-                                        # Typical pH probe outputs ~2.5V at pH 7.0
-                                        # Changes by ~0.18V per pH unit
-                                        ph = 7.0 + ((2.5 - voltage) / 0.18)
-
-                                        # Apply calibration
-                                        ph = (ph * self.calibration_slope) + self.calibration_offset
-
-                                        # Constrain to valid pH range
-                                        return max(0, min(14, ph))
-
-                                    except Exception as e:
-                                        logger.error(f"Error reading pH sensor: {e}")
-                                        return 7.0
-
-                                def cleanup(self):
-                                    """Clean up SPI connection"""
-                                    self.spi.close()
\ No newline at end of file
+"""
+DS18B20 Temperature Sensor Interface
+Uses the 1-Wire bus via w1thermsensor
+
+Several probes (reservoir, air, root zone...) can share the bus. Reads are
+split in two: start() broadcasts one Convert T to every probe through the
+kernel's therm_bulk_read file and returns at once, and collect() later
+waits out whatever is left of the conversion before reading each probe's
+result, so the conversion (750 ms at 12 bits) overlaps other work. On
+kernels without bulk read (before 5.10), or without write access to it,
+collect() converts each probe in turn as before.
+"""
+
+import os
+import time
+import threading
+import logging
+from w1thermsensor import W1ThermSensor
+
+logger = logging.getLogger(__name__)
+
+# Maximum conversion time per resolution (bits -> seconds), from the DS18B20 datasheet
+CONVERSION_TIME = {9: 0.09375, 10: 0.1875, 11: 0.375, 12: 0.75}
+
+# A conversion started longer ago than this is too old to collect; start another
+MAX_CONVERSION_AGE = 10.0
+
+# Bulk conversions in progress by bus (bulk read file -> monotonic start time),
+# shared so tanks with probes on one bus trigger it once
+bulk_started = {}
+bulk_lock = threading.Lock()
+
+
+class TempSensor:
+    def __init__(self, sensor_id=None, probes=None, resolution=12, bulk_read_file=None):
+        # The reservoir probe compensates TDS; `probes` adds named ones, {name: sensor id}
+        self.primary = 'reservoir'
+        self.probe_ids = {self.primary: sensor_id}
+        self.probe_ids.update(probes or {})
+        self.resolution = resolution
+        self.bulk_read_file = bulk_read_file or os.path.join(
+            str(W1ThermSensor.BASE_DIRECTORY), 'w1_bus_master1', 'therm_bulk_read')
+        self.bulk = os.path.exists(self.bulk_read_file)
+        self.sensors = {}                # probe name -> W1ThermSensor
+        self.started = None              # monotonic start of the conversion to collect
+        self.collected = None            # start of the last conversion collected
+        self.lock = threading.Lock()
+        self.find_probes()
+
+    def find_probes(self):
+        """Open probes not found yet and set their resolution"""
+        named = {sensor_id for sensor_id in self.probe_ids.values() if sensor_id is not None}
+        for name, sensor_id in self.probe_ids.items():
+            if name in self.sensors:
+                continue
+            try:
+                if sensor_id is None:
+                    # First probe on the bus that is not assigned to another name
+                    sensor = next(s for s in W1ThermSensor.get_available_sensors() if s.id not in named)
+                else:
+                    sensor = W1ThermSensor(sensor_id=sensor_id)
+                if sensor.get_resolution() != self.resolution:
+                    sensor.set_resolution(self.resolution)
+                self.sensors[name] = sensor
+            except StopIteration:
+                logger.error(f"Failed to find DS18B20 temperature sensor for {name}")
+            except Exception as e:
+                logger.error(f"Failed to find DS18B20 temperature sensor for {name}: {e}")
+
+    def conversion_time(self):
+        return CONVERSION_TIME.get(self.resolution, CONVERSION_TIME[12])
+
+    def start(self):
+        """Start a conversion on every probe of the bus without waiting; False if unsupported"""
+        with self.lock:
+            if not self.bulk:
+                return False
+            now = time.monotonic()
+            with bulk_lock:
+                started = bulk_started.get(self.bulk_read_file)
+                # Another sensor on this bus may have started one this sensor has not read yet
+                if (started is not None and now - started < MAX_CONVERSION_AGE
+                        and (self.collected is None or started > self.collected)):
+                    self.started = started
+                    return True
+                try:
+                    with open(self.bulk_read_file, 'w') as f:
+                        f.write('trigger\n')
+                except OSError as e:
+                    logger.warning(f"1-Wire bulk conversion unavailable, converting probes in turn: {e}")
+                    self.bulk = False
+                    return False
+                bulk_started[self.bulk_read_file] = now
+            self.started = now
+            return True
+
+    def collect(self):
+        """{probe name: °C or None}, waiting for the started conversion (starting one if none is)"""
+        with self.lock:
+            started = self.started
+        if started is None or time.monotonic() - started > MAX_CONVERSION_AGE:
+            self.start()
+            with self.lock:
+                started = self.started
+
+        if started is not None:
+            remaining = started + self.conversion_time() - time.monotonic()
+            if remaining > 0:
+                time.sleep(remaining)
+        with self.lock:
+            self.started = None
+            self.collected = started
+
+        if len(self.sensors) < len(self.probe_ids):
+            self.find_probes()
+        readings = {}
+        for name in self.probe_ids:
+            sensor = self.sensors.get(name)
+            try:
+                # After a bulk conversion this reads the result without converting again
+                readings[name] = sensor.get_temperature() if sensor is not None else None
+            except Exception as e:
+                logger.error(f"Error reading temperature sensor {name}: {e}")
+                readings[name] = None
+        return readings
+
+    def read(self):
+        """Read water temperature in °C, or None if the read failed"""
+        try:
+            return self.collect().get(self.primary)
+
+        except Exception as e:
+            logger.error(f"Error reading temperature sensor: {e}")
+            return None
+
+    def cleanup(self):
+        """Nothing to release on the 1-Wire bus"""
+        pass
@@ -0,0 +1,61 @@
+"""
+Simulated Hardware
+Drop-in stand-ins for spidev, RPi.GPIO, w1thermsensor and pyserial driven
+by a tank chemistry model, so the system runs (and is benchmarked) off a Pi.
+
+Call install() before importing any sensor or controller module.
+"""
+
+import sys
+
+from sim.tank import TankModel
+from sim import spidev, gpio, w1thermsensor, serial
+
+
+def attach_tank(tank, tds_channel=0, ph_channel=1, trig_pin=15, echo_pin=18,
+                probe_id='3c01d607e0aa', pump_ports=None):
+    """Wire one simulated reservoir's probes, level sensor and pumps"""
+    if pump_ports is None:
+        pump_ports = {'/dev/ttyACM0': 'nutrient', '/dev/ttyACM1': 'ph'}
+
+    spidev.channels[tds_channel] = spidev.tds_voltage(tank)
+    spidev.channels[ph_channel] = spidev.ph_voltage(tank)
+    gpio.attach_ultrasonic(trig_pin, echo_pin, tank)
+    w1thermsensor.attach_probe(probe_id, lambda: tank.temperature)
+    for port, pump_type in pump_ports.items():
+        serial.attach_pico(port, pump_type, tank)
+    return tank
+
+
+def install(tank=None, adc_noise=0.003, spike_rate=0.0, temp_delay_scale=1.0,
+            temp_bulk_read=True, serial_latency=0.005, pico_protocol='framed', **wiring):
+    """Register the simulated backends in sys.modules and wire them to a tank
+
+    `wiring` is passed to attach_tank() for the first tank; call
+    attach_tank() again for more. `pico_protocol` is the firmware of the
+    simulated Picos ('framed' or 'ascii'); `temp_bulk_read` gives the
+    1-Wire bus a bulk conversion file, as kernels since 5.10 do. Returns the TankModel so callers
+    can inspect or steer it.
+    """
+    if tank is None:
+        tank = TankModel()
+
+    spidev.settings.update(tank=tank, noise=adc_noise, spike_rate=spike_rate)
+    for channel in range(8):
+        spidev.channels.setdefault(channel, spidev.sine(period=30 + 10 * channel))
+    w1thermsensor.settings.update(tank=tank, delay_scale=temp_delay_scale)
+    if temp_bulk_read:
+        w1thermsensor.setup_bus()
+    serial.settings.update(tank=tank, latency=serial_latency, protocol=pico_protocol)
+    attach_tank(tank, **wiring)
+
+    rpi = type(sys)('RPi')
+    rpi.GPIO = gpio
+    sys.modules.update({
+        'spidev': spidev,
+        'RPi': rpi,
+        'RPi.GPIO': gpio,
+        'w1thermsensor': w1thermsensor,
+        'serial': serial,
+    })
+    return tank
@@ -0,0 +1,97 @@
+"""
+Simulated RPi.GPIO
+HC-SR04 echo timing on configurable trigger/echo pin pairs
+"""
+
+import time
+import threading
+
+BCM = 11
+BOARD = 10
+OUT = 0
+IN = 1
+LOW = 0
+HIGH = 1
+RISING = 31
+FALLING = 32
+BOTH = 33
+PUD_OFF = 20
+PUD_DOWN = 21
+PUD_UP = 22
+
+ECHO_DELAY = 0.0004  # seconds between trigger and echo rising edge
+
+pins = {}            # pin -> output level
+echoes = {}          # echo pin -> (rise, fall) perf_counter times
+callbacks = {}       # echo pin -> callback(pin)
+ultrasonic = {}      # trig pin -> (echo pin, tank)
+
+
+def attach_ultrasonic(trig_pin, echo_pin, tank):
+    """Wire a simulated HC-SR04 measuring the tank's water surface"""
+    ultrasonic[trig_pin] = (echo_pin, tank)
+
+
+def setmode(mode):
+    pass
+
+
+def setwarnings(flag):
+    pass
+
+
+def setup(pin, direction, pull_up_down=PUD_OFF, initial=LOW):
+    pins.setdefault(pin, initial)
+
+
+def output(pin, value):
+    previous = pins.get(pin, LOW)
+    pins[pin] = int(bool(value))
+    if previous and not value and pin in ultrasonic:
+        _echo(*ultrasonic[pin])
+
+
+def _echo(echo_pin, tank):
+    """Schedule the echo pulse for a trigger falling edge"""
+    speed = (331.3 + 0.606 * tank.air_temperature) * 100
+    rise = time.perf_counter() + ECHO_DELAY
+    fall = rise + 2 * tank.distance / speed
+    echoes[echo_pin] = (rise, fall)
+
+    callback = callbacks.get(echo_pin)
+    if callback is not None:
+        threading.Thread(target=_fire, args=(echo_pin, callback, rise, fall), daemon=True).start()
+
+
+def _fire(pin, callback, rise, fall):
+    for edge in (rise, fall):
+        delay = edge - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        callback(pin)
+
+
+def input(pin):
+    if pin in echoes:
+        rise, fall = echoes[pin]
+        return HIGH if rise <= time.perf_counter() < fall else LOW
+    return pins.get(pin, LOW)
+
+
+def add_event_detect(pin, edge, callback=None, bouncetime=None):
+    callbacks[pin] = callback
+
+
+def remove_event_detect(pin):
+    callbacks.pop(pin, None)
+
+
+def cleanup(channels=None):
+    if channels is None:
+        channels = list(pins)
+    elif isinstance(channels, int):
+        channels = [channels]
+    for pin in channels:
+        pins.pop(pin, None)
+        callbacks.pop(pin, None)
+        echoes.pop(pin, None)
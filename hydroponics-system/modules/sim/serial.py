@@ -0,0 +1,279 @@
+"""
+Simulated pyserial
+Pico pump peers speaking the framed protocol (controllers.pico_protocol)
+or the older ASCII DOSE/STOP/ACK lines
+"""
+
+import time
+import heapq
+import random
+import itertools
+import threading
+from collections import OrderedDict
+import controllers.pico_protocol as pico
+
+picos = {}           # port -> Pico
+settings = {
+    'latency': 0.005,        # seconds from command to reply
+    'tank': None,
+    'protocol': 'framed',    # firmware of newly attached Picos: 'framed' or 'ascii'
+    'flow_rate': 10.0,       # ml per second while a pump runs
+    'loss': 0.0,             # chance that a frame is lost in either direction
+    'telemetry_interval': 1.0,
+}
+
+
+class SerialException(IOError):
+    pass
+
+
+class Pico:
+    """Firmware state of one board, kept across reconnects of its port"""
+
+    def __init__(self, protocol):
+        self.protocol = protocol
+        self.pumps = []                  # pump type per channel
+        self.tanks = {}                  # pump type -> tank (None: the default tank)
+        self.decoder = pico.FrameDecoder()
+        self.line = b''
+        self.replies = OrderedDict()     # recent seq -> ACK frame, for repeated commands
+        self.running = {}                # channel -> (seq, ml, started, duration)
+        self.unacked = {}                # (seq, channel) -> DONE frame, resent until the host ACKs it
+        self.next_telemetry = 0.0
+        self.outbox = []                 # heap of (due, order, bytes)
+        self.order = itertools.count()
+        self.lock = threading.Lock()
+
+    def reset(self):
+        """A new connection: drop unread output and partial input"""
+        with self.lock:
+            self.outbox = []
+            self.decoder = pico.FrameDecoder()
+            self.line = b''
+
+    def reply(self, data, delay=None):
+        heapq.heappush(self.outbox, (time.monotonic() + (settings['latency'] if delay is None else delay),
+                                     next(self.order), data))
+
+    def send(self, msg_type, seq, payload=b''):
+        if random.random() < settings['loss']:
+            return
+        self.reply(pico.encode(msg_type, seq, payload))
+
+    def tank(self, pump_type):
+        return self.tanks.get(pump_type) or settings['tank']
+
+    def receive(self, data):
+        with self.lock:
+            if self.protocol == 'ascii':
+                self.line += data
+                while b'\n' in self.line:
+                    line, self.line = self.line.split(b'\n', 1)
+                    self.handle_line(line.decode(errors='replace').split())
+            else:
+                for version, msg_type, seq, payload in self.decoder.feed(data):
+                    if random.random() >= settings['loss']:
+                        self.handle_frame(version, msg_type, seq, payload)
+
+    def handle_line(self, words):
+        """ASCII firmware behaviour for one command line"""
+        if not words:
+            return
+        if words[0] == 'DOSE' and len(words) == 3:
+            tank = self.tank(words[1])
+            if tank is not None:
+                tank.dose(words[1], float(words[2]))
+            self.reply(b'ACK\n')
+        elif words[0] == 'STOP':
+            pass
+        else:
+            self.reply(b'ERR\n')
+
+    def handle_frame(self, version, msg_type, seq, payload):
+        """Framed firmware behaviour for one command"""
+        if version != pico.VERSION:
+            self.send(pico.NAK, seq, bytes([pico.NAK_VERSION]))
+            return
+        if msg_type == pico.ACK:
+            if payload:
+                self.unacked.pop((seq, payload[0]), None)
+            return
+        if msg_type == pico.HELLO:
+            # A new session: numbers seen before belong to the old one
+            self.replies.clear()
+            self.send(pico.HELLO_REPLY, seq,
+                      pico.HELLO_INFO.pack(pico.VERSION, len(self.pumps)) + b'sim-pico 1.0')
+            return
+        if seq in self.replies:
+            # A resent command: acknowledge again, never run twice
+            self.reply(self.replies[seq])
+            return
+
+        if msg_type == pico.DOSE:
+            try:
+                entries = pico.decode_entries(pico.DOSE_ENTRY, payload)
+            except ValueError:
+                self.send(pico.NAK, seq, bytes([pico.NAK_PAYLOAD]))
+                return
+            statuses = bytes(self.start_dose(seq, channel, ml) for channel, ml in entries)
+        elif msg_type == pico.STOP:
+            if len(payload) != 1:
+                self.send(pico.NAK, seq, bytes([pico.NAK_PAYLOAD]))
+                return
+            for channel in list(self.running):
+                if payload[0] & (1 << channel):
+                    self.finish(channel, time.monotonic(), fault=1)
+            statuses = b''
+        else:
+            self.send(pico.NAK, seq, bytes([pico.NAK_TYPE]))
+            return
+
+        ack = pico.encode(pico.ACK, seq, statuses)
+        self.replies[seq] = ack
+        while len(self.replies) > 32:
+            self.replies.popitem(last=False)
+        if random.random() >= settings['loss']:
+            self.reply(ack)
+
+    def start_dose(self, seq, channel, ml):
+        if channel >= len(self.pumps):
+            return pico.REJECT_CHANNEL
+        if channel in self.running:
+            return pico.REJECT_BUSY
+        if not 0 < ml <= 1000:
+            return pico.REJECT_AMOUNT
+        pump_type = self.pumps[channel]
+        tank = self.tank(pump_type)
+        if tank is not None:
+            tank.dose(pump_type, ml)
+        self.running[channel] = (seq, ml, time.monotonic(), ml / settings['flow_rate'])
+        return pico.ACCEPTED
+
+    def finish(self, channel, now, fault=0):
+        seq, ml, started, duration = self.running.pop(channel)
+        elapsed = now - started
+        delivered = ml if not fault else min(ml, elapsed * settings['flow_rate'])
+        frame = pico.encode(pico.DONE, seq, pico.DONE_ENTRY.pack(channel, delivered, int(elapsed * 1000), fault))
+        self.unacked[(seq, channel)] = frame
+        if random.random() >= settings['loss']:
+            self.reply(frame)
+
+    def telemetry(self, now):
+        entries = []
+        for channel in range(len(self.pumps)):
+            run = self.running.get(channel)
+            if run is None:
+                entries.append(pico.TELEMETRY_ENTRY.pack(channel, 0, 0.0, 0, 0))
+            else:
+                seq, ml, started, duration = run
+                elapsed = now - started
+                entries.append(pico.TELEMETRY_ENTRY.pack(channel, 1, min(ml, elapsed * settings['flow_rate']),
+                                                         int(elapsed * 1000), 0))
+        return b''.join(entries)
+
+    def update(self, now):
+        """Finish pumps whose time is up and stream telemetry while any run"""
+        with self.lock:
+            if self.protocol != 'framed':
+                return
+            for channel, (seq, ml, started, duration) in list(self.running.items()):
+                if now >= started + duration:
+                    self.finish(channel, now)
+            if (self.running or self.unacked) and now >= self.next_telemetry:
+                self.next_telemetry = now + settings['telemetry_interval']
+                if self.running:
+                    self.send(pico.TELEMETRY, 0, self.telemetry(now))
+                for frame in self.unacked.values():
+                    if random.random() >= settings['loss']:
+                        self.reply(frame)
+
+    def take(self, now):
+        """Output bytes due by `now`"""
+        with self.lock:
+            data = b''
+            while self.outbox and self.outbox[0][0] <= now:
+                data += heapq.heappop(self.outbox)[2]
+            return data
+
+    def next_due(self):
+        with self.lock:
+            due = [self.outbox[0][0]] if self.outbox else []
+            due += [started + duration for seq, ml, started, duration in self.running.values()]
+            if self.running or self.unacked:
+                due.append(self.next_telemetry)
+            return min(due) if due else None
+
+
+def attach_pico(port, pump_type, tank=None, protocol=None):
+    """Register a simulated Pico pump controller on a port (again for another channel)"""
+    board = picos.get(port)
+    if board is None or (protocol is not None and board.protocol != protocol):
+        board = picos[port] = Pico(protocol or settings['protocol'])
+    if pump_type not in board.pumps:
+        board.pumps.append(pump_type)
+    board.tanks[pump_type] = tank
+
+
+class Serial:
+    def __init__(self, port, baudrate=9600, timeout=None, **kwargs):
+        if port not in picos:
+            raise SerialException(f"could not open port {port}: No such file or directory")
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.pico = picos[port]
+        self.pico.reset()
+        self.rx = b''
+        self.is_open = True
+
+    def write(self, data):
+        if not self.is_open:
+            raise SerialException("Attempting to use a port that is not open")
+        self.pico.receive(bytes(data))
+        return len(data)
+
+    def poll(self):
+        now = time.monotonic()
+        self.pico.update(now)
+        self.rx += self.pico.take(now)
+
+    def wait(self, ready):
+        """Poll until ready() or the timeout passes"""
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while True:
+            self.poll()
+            if ready():
+                return
+            now = time.monotonic()
+            if deadline is not None and now >= deadline:
+                return
+            due = self.pico.next_due()
+            wait = 0.01 if due is None else max(due - now, 0.0005)
+            if deadline is not None:
+                wait = min(wait, deadline - now)
+            time.sleep(min(wait, 0.01))
+
+    def read(self, size=1):
+        self.wait(lambda: self.rx)
+        data, self.rx = self.rx[:size], self.rx[size:]
+        return data
+
+    def readline(self):
+        self.wait(lambda: b'\n' in self.rx)
+        if b'\n' not in self.rx:
+            data, self.rx = self.rx, b''
+            return data
+        line, self.rx = self.rx.split(b'\n', 1)
+        return line + b'\n'
+
+    @property
+    def in_waiting(self):
+        self.poll()
+        return len(self.rx)
+
+    def reset_input_buffer(self):
+        self.poll()
+        self.rx = b''
+
+    def close(self):
+        self.is_open = False
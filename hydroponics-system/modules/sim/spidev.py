@@ -0,0 +1,69 @@
+"""
+Simulated spidev
+MCP3008 on SPI with per-channel waveforms and noise
+"""
+
+import math
+import time
+
+REFERENCE_VOLTAGE = 3.3
+
+# channel -> function(t) returning volts; shared by every SpiDev handle
+channels = {}
+settings = {'noise': 0.003, 'spike_rate': 0.0, 'spike': 0.5, 'tank': None}
+
+
+def sine(offset=1.65, amplitude=0.5, period=60.0):
+    """Waveform helper for unused channels"""
+    return lambda t: offset + amplitude * math.sin(2 * math.pi * t / period)
+
+
+def tds_voltage(tank, calibration_factor=0.5):
+    """Probe voltage that the TDS conversion maps back to the tank's TDS"""
+    def source(t):
+        target = tank.value('tds') / calibration_factor
+        lo, hi = 0.0, REFERENCE_VOLTAGE
+        for _ in range(30):
+            v = (lo + hi) / 2
+            if 133.42 * v**3 - 255.86 * v**2 + 857.39 * v < target:
+                lo = v
+            else:
+                hi = v
+        return v * (1.0 + 0.02 * (tank.temperature - 25.0))
+    return source
+
+
+def ph_voltage(tank):
+    """Probe voltage for the tank's pH (2.5 V at pH 7, -0.18 V/pH)"""
+    return lambda t: 2.5 - (tank.value('ph') - 7.0) * 0.18
+
+
+class SpiDev:
+    def __init__(self):
+        self.max_speed_hz = 500000
+        self.transfers = 0
+        self.opened = None
+
+    def open(self, bus, device):
+        self.opened = (bus, device)
+
+    def xfer2(self, data):
+        """One MCP3008 conversion frame"""
+        self.transfers += 1
+        channel = (data[1] >> 4) - 8
+        source = channels.get(channel)
+        tank = settings['tank']
+        t = tank.now() if tank is not None else time.monotonic()
+        volts = source(t) if source is not None else 0.0
+        if tank is not None:
+            volts += tank.noise(settings['noise'])
+            if settings['spike_rate'] and tank.random.random() < settings['spike_rate']:
+                volts += settings['spike']
+        code = int(round(volts / REFERENCE_VOLTAGE * 1023))
+        code = max(0, min(1023, code))
+        return [0, (code >> 8) & 3, code & 0xFF]
+
+    xfer = xfer2
+
+    def close(self):
+        self.opened = None
@@ -0,0 +1,101 @@
+"""
+Simulated Reservoir
+Simple tank chemistry model driving the simulated hardware backends
+"""
+
+import math
+import time
+import random
+import threading
+
+
+class TankModel:
+    """Reservoir state with dose mixing, plant uptake drift and evaporation
+
+    Doses mix in exponentially with `mixing_time`; between doses TDS falls
+    and pH rises at fixed rates, and the water surface drops as water
+    evaporates. The clock is the real monotonic clock times `time_scale`
+    plus any manual `advance()`, so fast-forward runs need no sleeping.
+    """
+
+    def __init__(self, tds=900.0, ph=6.0, temperature=21.0, distance=20.0,
+                 ppm_per_ml=8.0, ph_per_ml=-0.04, mixing_time=120.0,
+                 tds_drift=-0.5, ph_drift=0.002, evaporation=0.001,
+                 time_scale=1.0, seed=None):
+        self.base = {'tds': tds, 'ph': ph}
+        self.temperature = temperature
+        self.distance = distance          # cm from sensor to water surface
+        self.air_temperature = temperature
+        self.effects = {'nutrient': ('tds', ppm_per_ml), 'ph': ('ph', ph_per_ml)}
+        self.mixing_time = mixing_time    # seconds
+        self.drift = {'tds': tds_drift, 'ph': ph_drift}  # per minute
+        self.evaporation = evaporation    # cm per minute
+        self.time_scale = time_scale
+        self.random = random.Random(seed)
+
+        self.lock = threading.Lock()
+        self.offset = 0.0
+        self.started = time.monotonic()
+        self.updated = self.now()
+        self.doses = []                   # (time, key, delta)
+        self.dose_log = []                # (time, pump_type, ml)
+
+    def now(self):
+        """Simulated seconds since the model started"""
+        return (time.monotonic() - self.started) * self.time_scale + self.offset
+
+    def advance(self, seconds):
+        """Jump the simulated clock forward"""
+        with self.lock:
+            self.offset += seconds
+
+    def _update(self):
+        now = self.now()
+        minutes = (now - self.updated) / 60.0
+        self.updated = now
+        for key, rate in self.drift.items():
+            self.base[key] += rate * minutes
+        self.distance += self.evaporation * minutes
+
+        # Fold fully mixed doses into the base values
+        remaining = []
+        for t, key, delta in self.doses:
+            if now - t > 10 * self.mixing_time:
+                self.base[key] += delta
+            else:
+                remaining.append((t, key, delta))
+        self.doses = remaining
+        return now
+
+    def value(self, key):
+        """Current TDS (ppm) or pH including doses still mixing"""
+        with self.lock:
+            now = self._update()
+            value = self.base[key]
+            for t, k, delta in self.doses:
+                if k == key:
+                    value += delta * (1 - math.exp(-(now - t) / self.mixing_time))
+        if key == 'ph':
+            return max(0.0, min(14.0, value))
+        return max(0.0, value)
+
+    def state(self):
+        """Snapshot of every modelled quantity"""
+        return {
+            'tds': self.value('tds'),
+            'ph': self.value('ph'),
+            'temperature': self.temperature,
+            'water_level': self.distance,
+        }
+
+    def dose(self, pump_type, ml):
+        """Add a dose from a pump ('nutrient' or 'ph')"""
+        key, per_ml = self.effects[pump_type]
+        with self.lock:
+            now = self._update()
+            self.doses.append((now, key, per_ml * ml))
+            self.dose_log.append((now, pump_type, ml))
+
+    def noise(self, sigma):
+        """Gaussian noise sample"""
+        return self.random.gauss(0.0, sigma) if sigma else 0.0
@@ -0,0 +1,110 @@
+"""
+Simulated w1thermsensor
+DS18B20 probes with resolution-dependent conversion time
+
+setup_bus() adds a therm_bulk_read file like the kernel's (5.10+): once
+'trigger' is written to it, every probe's next read returns as soon as
+the conversion started by the write is complete instead of converting.
+"""
+
+import os
+import time
+import tempfile
+from enum import Enum
+from pathlib import Path
+
+# Conversion time per resolution (bits -> seconds), from the DS18B20 datasheet
+CONVERSION_TIME = {9: 0.09375, 10: 0.1875, 11: 0.375, 12: 0.75}
+
+probes = {}          # sensor id -> {'source': fn() -> °C, 'resolution': bits, 'bulk_read': trigger time}
+settings = {'delay_scale': 1.0, 'noise': 0.02, 'tank': None}
+
+
+class Sensor(int, Enum):
+    DS18S20 = 0x10
+    DS1822 = 0x22
+    DS18B20 = 0x28
+
+
+class Unit(Enum):
+    DEGREES_C = "celsius"
+
+
+class W1ThermSensorError(Exception):
+    pass
+
+
+class NoSensorFoundError(W1ThermSensorError):
+    pass
+
+
+class SensorNotReadyError(W1ThermSensorError):
+    pass
+
+
+def attach_probe(sensor_id, source, resolution=12):
+    """Register a simulated probe reading source() in °C"""
+    probes[sensor_id] = {'source': source, 'resolution': resolution, 'bulk_read': 0}
+
+
+def setup_bus(path=None):
+    """Create a bus directory with a bulk conversion file and point W1ThermSensor at it"""
+    path = Path(path or tempfile.mkdtemp(prefix='sim-w1-'))
+    master = path / 'w1_bus_master1'
+    master.mkdir(parents=True, exist_ok=True)
+    (master / 'therm_bulk_read').write_text('0\n')
+    W1ThermSensor.BASE_DIRECTORY = path
+    return path
+
+
+def bulk_trigger_time():
+    """Wall time of the last write to therm_bulk_read, or None"""
+    try:
+        return os.stat(W1ThermSensor.BASE_DIRECTORY / 'w1_bus_master1' / 'therm_bulk_read').st_mtime_ns
+    except OSError:
+        return None
+
+
+class W1ThermSensor:
+    BASE_DIRECTORY = Path('/sys/bus/w1/devices')
+
+    def __init__(self, sensor_type=None, sensor_id=None):
+        if sensor_id is None:
+            if not probes:
+                raise NoSensorFoundError("No simulated DS18B20 attached")
+            sensor_id = sorted(probes)[0]
+        if sensor_id not in probes:
+            raise NoSensorFoundError(f"No simulated DS18B20 with id {sensor_id}")
+        self.type = Sensor.DS18B20
+        self.id = sensor_id
+
+    @classmethod
+    def get_available_sensors(cls, types=None):
+        return [cls(sensor_id=sensor_id) for sensor_id in sorted(probes)]
+
+    def _quantize(self, celsius):
+        step = 0.5 / (1 << (probes[self.id]['resolution'] - 9))
+        return round(celsius / step) * step
+
+    def get_temperature(self, unit=Unit.DEGREES_C):
+        """Wait out the conversion (only its remainder after a bulk trigger), then return °C"""
+        probe = probes[self.id]
+        conversion = CONVERSION_TIME[probe['resolution']] * settings['delay_scale']
+        triggered = bulk_trigger_time()
+        if triggered is not None and triggered > probe['bulk_read']:
+            probe['bulk_read'] = triggered
+            conversion = triggered / 1e9 + conversion - time.time()
+        if conversion > 0:
+            time.sleep(conversion)
+        tank = settings['tank']
+        noise = tank.noise(settings['noise']) if tank is not None else 0.0
+        return self._quantize(probe['source']() + noise)
+
+    def get_resolution(self):
+        return probes[self.id]['resolution']
+
+    def set_resolution(self, resolution, persist=False):
+        if resolution not in CONVERSION_TIME:
+            raise ValueError(f"Unsupported resolution {resolution}")
+        probes[self.id]['resolution'] = resolution
+        return True
@@ -0,0 +1,72 @@
+"""
+Calibration Store
+Persistent per-sensor calibration values in a small JSON file, keyed by
+sensor type, SPI bus and ADC channel (e.g. "ph/0.0/1")
+"""
+
+import os
+import json
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def sensor_key(kind, spi_bus, spi_device, channel):
+    return f"{kind}/{spi_bus}.{spi_device}/{channel}"
+
+
+class CalibrationStore:
+    """Calibration file shared by calibration.py (writer) and the controller
+
+    Writes go to a temp file that is renamed into place, so a reader never
+    sees a partial file; reload() re-reads only when the file changed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.version = None
+
+    def stat(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def reload(self):
+        """Re-read the file if it changed; returns True when entries changed"""
+        version = self.stat()
+        if version == self.version:
+            return False
+        entries = {}
+        if version is not None:
+            with open(self.path) as f:
+                entries = json.load(f).get('sensors', {})
+        self.version = version
+        changed = entries != self.entries
+        self.entries = entries
+        return changed
+
+    def get(self, key):
+        """Stored values for a sensor ({} when it was never calibrated)"""
+        return dict(self.entries.get(key, {}))
+
+    def set(self, key, values):
+        """Store values for a sensor, keeping every other sensor's entry"""
+        self.reload()
+        entry = dict(values)
+        entry['updated'] = time.time()
+        self.entries[key] = entry
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_file = self.path + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump({'sensors': self.entries}, f, indent=2, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.path)
+        self.version = self.stat()
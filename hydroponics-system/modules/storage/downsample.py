@@ -0,0 +1,73 @@
+"""
+Series Downsampling
+Reduce long time series to a chart-sized number of points
+"""
+
+def lttb(points, threshold):
+    """Largest-Triangle-Three-Buckets downsampling of [(ts, value)]
+
+    Keeps the first and last points and, for each bucket in between, the
+    point forming the largest triangle with its neighbours, which preserves
+    the visual shape of the series.
+    """
+    n = len(points)
+    if threshold >= n or threshold < 3:
+        return list(points)
+
+    sampled = [points[0]]
+    bucket_size = (n - 2) / (threshold - 2)
+    a = 0  # index of the last selected point
+
+    for i in range(threshold - 2):
+        # Average of the next bucket is the third triangle vertex
+        next_start = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, n)
+        next_bucket = points[next_start:next_end] or [points[-1]]
+        avg_ts = sum(p[0] for p in next_bucket) / len(next_bucket)
+        avg_value = sum(p[1] for p in next_bucket) / len(next_bucket)
+
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+        a_ts, a_value = points[a]
+        best_area = -1
+        best = start
+        for j in range(start, end):
+            ts, value = points[j]
+            area = abs((a_ts - avg_ts) * (value - a_value) -
+                       (a_ts - ts) * (avg_value - a_value))
+            if area > best_area:
+                best_area = area
+                best = j
+        sampled.append(points[best])
+        a = best
+
+    sampled.append(points[-1])
+    return sampled
+
+
+def minmax(points, threshold):
+    """Min/max bucketing of [(ts, value, low, high)]
+
+    Emits the lowest and highest sample of each bucket in time order, so
+    spikes survive downsampling.
+    """
+    n = len(points)
+    buckets = max(threshold // 2, 1)
+    if n <= threshold:
+        return [(p[0], p[1]) for p in points]
+
+    sampled = []
+    size = n / buckets
+    for i in range(buckets):
+        bucket = points[int(i * size):int((i + 1) * size)]
+        if not bucket:
+            continue
+        low = min(bucket, key=lambda p: p[2])
+        high = max(bucket, key=lambda p: p[3])
+        if low[0] <= high[0]:
+            sampled.append((low[0], low[2]))
+            sampled.append((high[0], high[3]))
+        else:
+            sampled.append((high[0], high[3]))
+            sampled.append((low[0], low[2]))
+    return sampled
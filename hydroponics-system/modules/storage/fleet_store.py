@@ -0,0 +1,177 @@
+"""
+Fleet Store
+The collector's database: every unit's readings and events, plus the units
+seen and the batches already ingested
+
+Readings go through a HistoryStore under "<unit>/<metric>" names, so the
+collector keeps the same raw table, rollups and retention as each unit.
+"""
+
+import re
+import json
+import time
+import sqlite3
+import logging
+from storage.history_store import HistoryStore, HOUR
+
+logger = logging.getLogger(__name__)
+
+FLEET_SCHEMA = """
+CREATE TABLE IF NOT EXISTS units (
+    name TEXT PRIMARY KEY,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    address TEXT,
+    latest TEXT NOT NULL DEFAULT '{}'
+);
+CREATE TABLE IF NOT EXISTS batches (
+    unit TEXT NOT NULL,
+    batch TEXT NOT NULL,
+    received REAL NOT NULL,
+    PRIMARY KEY (unit, batch)
+) WITHOUT ROWID;
+"""
+
+UNIT_NAME = re.compile(r'^[A-Za-z0-9_.-]{1,64}$')
+
+# Batch ids are kept this long to recognise a batch sent again
+BATCH_RETENTION = 7 * 86400
+
+
+def check_batch(batch):
+    """Raise ValueError unless `batch` is a well-formed uplink batch"""
+    if not isinstance(batch, dict):
+        raise ValueError("batch must be an object")
+    if not isinstance(batch.get('unit'), str) or not UNIT_NAME.match(batch['unit']):
+        raise ValueError("bad unit name")
+    if not isinstance(batch.get('batch'), str) or not batch['batch']:
+        raise ValueError("missing batch id")
+    for reading in batch.get('readings', []):
+        if (not isinstance(reading, list) or len(reading) != 3 or not isinstance(reading[0], str)
+                or not all(isinstance(x, (int, float)) for x in reading[1:])):
+            raise ValueError(f"bad reading {reading!r}")
+    for event in batch.get('events', []):
+        if (not isinstance(event, list) or len(event) != 5 or not isinstance(event[0], (int, float))
+                or not isinstance(event[1], str) or not isinstance(event[2], str)):
+            raise ValueError(f"bad event {event!r}")
+
+
+class FleetStore:
+    def __init__(self, path, raw_days=30, minute_days=180, hour_days=1825):
+        # Batches are written directly, never queued for a flush
+        self.history = HistoryStore(path, raw_days=raw_days, minute_days=minute_days, hour_days=hour_days)
+        self.db = self.history.db
+        self.last_prune = 0
+        with self.history.lock:
+            self.db.executescript(FLEET_SCHEMA)
+
+    def ingest(self, batch, address=None):
+        """Store one uplink batch; returns False if it was already stored"""
+        check_batch(batch)
+        unit = batch['unit']
+        now = time.time()
+        readings = [(f"{unit}/{metric}", ts, float(value)) for metric, ts, value in batch.get('readings', [])]
+        events = [(ts, kind, f"{unit}/{source}", value, int(bool(ok)))
+                  for ts, kind, source, value, ok in batch.get('events', [])]
+        latest = {}
+        for metric, ts, value in batch.get('readings', []):
+            if ts >= latest.get(metric, (0, None))[0]:
+                latest[metric] = (ts, value)
+
+        # Data, batch id and unit commit together: a batch is stored whole or
+        # not at all, so one sent again after a crash is never stored twice
+        with self.history.lock:
+            try:
+                with self.db:
+                    seen = self.db.execute("SELECT 1 FROM batches WHERE unit = ? AND batch = ?",
+                                           (unit, batch['batch'])).fetchone()
+                    if seen:
+                        return False
+                    self.history.write(readings, events)
+
+                    row = self.db.execute("SELECT latest FROM units WHERE name = ?", (unit,)).fetchone()
+                    merged = json.loads(row[0]) if row else {}
+                    for metric, (ts, value) in latest.items():
+                        if metric not in merged or ts >= merged[metric][0]:
+                            merged[metric] = [ts, value]
+                    self.db.execute("INSERT INTO batches (unit, batch, received) VALUES (?, ?, ?)",
+                                    (unit, batch['batch'], now))
+                    self.db.execute(
+                        "INSERT INTO units (name, first_seen, last_seen, address, latest) "
+                        "VALUES (?, ?, ?, ?, ?) ON CONFLICT (name) DO UPDATE SET "
+                        "last_seen = excluded.last_seen, address = excluded.address, latest = excluded.latest",
+                        (unit, now, now, address, json.dumps(merged)))
+            except sqlite3.Error:
+                self.history.metric_ids.clear()  # ids created in the rolled-back transaction
+                raise
+
+        if now - self.last_prune >= HOUR:
+            self.last_prune = now
+            with self.history.lock:
+                with self.db:
+                    self.db.execute("DELETE FROM batches WHERE received < ?", (now - BATCH_RETENTION,))
+            self.history.prune()
+        return True
+
+    def units(self):
+        """Every unit as {'name', 'first_seen', 'last_seen', 'address', 'metrics'}"""
+        with self.history.lock:
+            rows = self.db.execute(
+                "SELECT name, first_seen, last_seen, address, latest FROM units ORDER BY name").fetchall()
+        return [{'name': name, 'first_seen': first_seen, 'last_seen': last_seen, 'address': address,
+                 'metrics': sorted(json.loads(latest))}
+                for name, first_seen, last_seen, address, latest in rows]
+
+    def unit_names(self, units=None):
+        names = [unit['name'] for unit in self.units()]
+        return [name for name in names if name in units] if units else names
+
+    def latest(self, metric, units=None):
+        """{unit: [ts, value]} of the newest reading of `metric` on each unit that has one"""
+        with self.history.lock:
+            rows = self.db.execute("SELECT name, latest FROM units ORDER BY name").fetchall()
+        latest = {}
+        for name, values in rows:
+            if units and name not in units:
+                continue
+            value = json.loads(values).get(metric)
+            if value is not None:
+                latest[name] = value
+        return latest
+
+    def series(self, metric, start, end, max_points=None, units=None):
+        """{unit: [(ts, mean, min, max)]} of `metric`, at the finest resolution that fits"""
+        series = {}
+        for name in self.unit_names(units):
+            rows = self.history.query(f"{name}/{metric}", start, end, max_points)
+            if rows:
+                series[name] = rows
+        return series
+
+    def compare(self, metric, start, end, units=None):
+        """{unit: {'count', 'mean', 'min', 'max'}} of `metric`, from the hourly rollups"""
+        summary = {}
+        for name in self.unit_names(units):
+            buckets = self.history.query_rollup(f"{name}/{metric}", start, end, HOUR)
+            count = sum(bucket[1] for bucket in buckets)
+            if not count:
+                continue
+            summary[name] = {
+                'count': count,
+                'mean': sum(bucket[1] * bucket[2] for bucket in buckets) / count,
+                'min': min(bucket[3] for bucket in buckets),
+                'max': max(bucket[4] for bucket in buckets),
+            }
+        return summary
+
+    def events(self, start, end, kind=None, units=None):
+        """Events as [(ts, unit, kind, source, value, ok)]"""
+        events = []
+        for ts, event_kind, source, value, ok in self.history.query_events(start, end, kind):
+            unit, _, source = source.partition('/')
+            if not units or unit in units:
+                events.append((ts, unit, event_kind, source, value, bool(ok)))
+        return events
+
+    def close(self):
+        self.history.close()
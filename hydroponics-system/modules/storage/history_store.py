@@ -0,0 +1,284 @@
+"""
+Sensor History Store
+Append-only SQLite (WAL) time-series store with 1-minute/1-hour/1-day rollups
+"""
+
+import os
+import time
+import sqlite3
+import threading
+import logging
+from monitoring.tracing import traced
+
+logger = logging.getLogger(__name__)
+
+# Rollup resolutions in seconds
+MINUTE = 60
+HOUR = 3600
+DAY = 86400
+RESOLUTIONS = (MINUTE, HOUR, DAY)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metrics (
+    id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE NOT NULL
+);
+CREATE TABLE IF NOT EXISTS readings (
+    metric_id INTEGER NOT NULL,
+    ts REAL NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (metric_id, ts)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rollups (
+    resolution INTEGER NOT NULL,
+    metric_id INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    total REAL NOT NULL,
+    min REAL NOT NULL,
+    max REAL NOT NULL,
+    PRIMARY KEY (resolution, metric_id, bucket)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS events (
+    ts REAL NOT NULL,
+    kind TEXT NOT NULL,
+    source TEXT NOT NULL,
+    value REAL,
+    ok INTEGER
+);
+CREATE INDEX IF NOT EXISTS events_ts ON events (ts);
+"""
+
+UPSERT_ROLLUP = """
+INSERT INTO rollups (resolution, metric_id, bucket, count, total, min, max)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (resolution, metric_id, bucket) DO UPDATE SET
+    count = count + excluded.count,
+    total = total + excluded.total,
+    min = MIN(min, excluded.min),
+    max = MAX(max, excluded.max)
+"""
+
+class HistoryStore:
+    def __init__(self, path, flush_interval=300, batch_size=500,
+                 raw_days=30, minute_days=180, hour_days=1825, readonly=False):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        # Retention per table; daily rollups are kept forever
+        self.retention = {
+            None: raw_days * DAY,
+            MINUTE: minute_days * DAY,
+            HOUR: hour_days * DAY,
+        }
+        self.readonly = readonly
+
+        self.lock = threading.Lock()
+        self.pending = []       # (metric, ts, value)
+        self.pending_events = []
+        self.last_flush = time.monotonic()
+        self.last_prune = 0
+        self.metric_ids = {}
+
+        if readonly:
+            self.db = sqlite3.connect(f"file:{path}?mode=ro", uri=True,
+                                      check_same_thread=False)
+        else:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            # auto_vacuum only takes effect before the first table is created
+            self.db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            self.db.execute("PRAGMA journal_mode = WAL")
+            self.db.execute("PRAGMA synchronous = NORMAL")
+            self.db.executescript(SCHEMA)
+
+    def _metric_id(self, name):
+        """Look up (and on the writer, create) the id for a metric name"""
+        metric_id = self.metric_ids.get(name)
+        if metric_id is None:
+            row = self.db.execute("SELECT id FROM metrics WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                if self.readonly:
+                    return None
+                metric_id = self.db.execute("INSERT INTO metrics (name) VALUES (?)", (name,)).lastrowid
+            else:
+                metric_id = row[0]
+            self.metric_ids[name] = metric_id
+        return metric_id
+
+    def record(self, ts, values):
+        """Queue one reading per metric; written on the next batch flush"""
+        with self.lock:
+            for metric, value in values.items():
+                if value is not None:
+                    self.pending.append((metric, ts, float(value)))
+        self._maybe_flush()
+
+    def record_event(self, kind, source, value=None, ok=True, ts=None):
+        """Queue a discrete event such as a pump dose"""
+        with self.lock:
+            self.pending_events.append((ts or time.time(), kind, source, value, int(bool(ok))))
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if (len(self.pending) >= self.batch_size or
+                time.monotonic() - self.last_flush >= self.flush_interval):
+            self.flush()
+
+    @traced('history_flush')
+    def flush(self):
+        """Write queued readings and events in one transaction"""
+        with self.lock:
+            pending, self.pending = self.pending, []
+            events, self.pending_events = self.pending_events, []
+            self.last_flush = time.monotonic()
+            if not pending and not events:
+                return
+
+            try:
+                with self.db:
+                    self.write(pending, events)
+            except sqlite3.Error as e:
+                logger.error(f"Error writing history: {e}")
+                self.metric_ids.clear()  # ids created in the rolled-back transaction
+                return
+
+        if time.time() - self.last_prune >= HOUR:
+            self.prune()
+
+    def write(self, readings, events):
+        """Insert [(metric, ts, value)] and [(ts, kind, source, value, ok)]
+
+        The caller holds the lock and a transaction, so other writes can
+        commit together with these.
+        """
+        # The first reading stored at a timestamp stands; only rows actually
+        # inserted go into the rollups
+        inserted = []
+        for metric, ts, value in readings:
+            row = (self._metric_id(metric), ts, value)
+            if self.db.execute("INSERT OR IGNORE INTO readings (metric_id, ts, value) "
+                               "VALUES (?, ?, ?)", row).rowcount:
+                inserted.append(row)
+        self.db.executemany(UPSERT_ROLLUP, self._rollup_rows(inserted))
+        self.db.executemany(
+            "INSERT INTO events (ts, kind, source, value, ok) VALUES (?, ?, ?, ?, ?)", events)
+
+    @staticmethod
+    def _rollup_rows(rows):
+        """Pre-aggregate a batch per (resolution, metric, bucket)"""
+        buckets = {}
+        for metric_id, ts, value in rows:
+            for resolution in RESOLUTIONS:
+                key = (resolution, metric_id, int(ts // resolution) * resolution)
+                agg = buckets.get(key)
+                if agg is None:
+                    buckets[key] = [1, value, value, value]
+                else:
+                    agg[0] += 1
+                    agg[1] += value
+                    agg[2] = min(agg[2], value)
+                    agg[3] = max(agg[3], value)
+        return [key + tuple(agg) for key, agg in buckets.items()]
+
+    def prune(self):
+        """Drop data older than each table's retention and reclaim pages"""
+        now = time.time()
+        self.last_prune = now
+        with self.lock:
+            try:
+                with self.db:
+                    self.db.execute("DELETE FROM readings WHERE ts < ?",
+                                    (now - self.retention[None],))
+                    self.db.execute("DELETE FROM events WHERE ts < ?",
+                                    (now - self.retention[None],))
+                    for resolution in (MINUTE, HOUR):
+                        self.db.execute("DELETE FROM rollups WHERE resolution = ? AND bucket < ?",
+                                        (resolution, now - self.retention[resolution]))
+                self.db.execute("PRAGMA incremental_vacuum")
+            except sqlite3.Error as e:
+                logger.error(f"Error pruning history: {e}")
+
+    def query_raw(self, metric, start, end):
+        """Raw readings as [(ts, value)]"""
+        with self.lock:
+            metric_id = self._metric_id(metric)
+            if metric_id is None:
+                return []
+            return self.db.execute(
+                "SELECT ts, value FROM readings WHERE metric_id = ? AND ts >= ? AND ts < ? ORDER BY ts",
+                (metric_id, start, end)).fetchall()
+
+    def count_raw(self, metric, start, end):
+        """Number of raw readings in a range (index-only)"""
+        with self.lock:
+            metric_id = self._metric_id(metric)
+            if metric_id is None:
+                return 0
+            return self.db.execute(
+                "SELECT COUNT(*) FROM readings WHERE metric_id = ? AND ts >= ? AND ts < ?",
+                (metric_id, start, end)).fetchone()[0]
+
+    def query_rollup(self, metric, start, end, resolution):
+        """Rollup buckets as [(bucket_ts, count, mean, min, max)]"""
+        with self.lock:
+            metric_id = self._metric_id(metric)
+            if metric_id is None:
+                return []
+            return self.db.execute(
+                "SELECT bucket, count, total / count, min, max FROM rollups "
+                "WHERE resolution = ? AND metric_id = ? AND bucket >= ? AND bucket < ? ORDER BY bucket",
+                (resolution, metric_id, int(start // resolution) * resolution, end)).fetchall()
+
+    def query(self, metric, start, end, max_points=None):
+        """Finest series that still fits in max_points, as [(ts, mean, min, max)]
+
+        Raw readings are used while they are retained and fit; otherwise
+        the finest rollup resolution that fits (falling back to daily).
+        """
+        span = max(end - start, 1)
+        now = time.time()
+        if start >= now - self.retention[None]:
+            if max_points is None or self.count_raw(metric, start, end) <= max_points:
+                return [(ts, v, v, v) for ts, v in self.query_raw(metric, start, end)]
+        for resolution in RESOLUTIONS:
+            retained = self.retention.get(resolution)
+            if retained is not None and start < now - retained:
+                continue
+            if max_points is None or span / resolution <= max_points or resolution == DAY:
+                rows = self.query_rollup(metric, start, end, resolution)
+                return [(bucket, mean, lo, hi) for bucket, count, mean, lo, hi in rows]
+        return []
+
+    def query_events(self, start, end, kind=None):
+        """Events as [(ts, kind, source, value, ok)]"""
+        sql = "SELECT ts, kind, source, value, ok FROM events WHERE ts >= ? AND ts < ?"
+        args = [start, end]
+        if kind is not None:
+            sql += " AND kind = ?"
+            args.append(kind)
+        with self.lock:
+            return self.db.execute(sql + " ORDER BY ts", args).fetchall()
+
+    def last_modified(self):
+        """Timestamp of the newest stored reading, or None"""
+        with self.lock:
+            row = self.db.execute(
+                "SELECT MAX((SELECT MAX(ts) FROM readings WHERE metric_id = metrics.id)) "
+                "FROM metrics").fetchone()
+        return row[0]
+
+    def first_reading(self, metric):
+        """Timestamp of the oldest raw reading of a metric, or None"""
+        with self.lock:
+            metric_id = self._metric_id(metric)
+            if metric_id is None:
+                return None
+            return self.db.execute("SELECT MIN(ts) FROM readings WHERE metric_id = ?",
+                                   (metric_id,)).fetchone()[0]
+
+    def close(self):
+        """Flush anything queued and close the database"""
+        if not self.readonly:
+            self.flush()
+        self.db.close()
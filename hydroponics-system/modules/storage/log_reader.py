@@ -0,0 +1,326 @@
+"""
+Log Reader
+Serves the newest lines of the controller log without reading the whole
+file: the live log is read backwards from the end in blocks, and new lines
+are fetched forwards from a cursor
+
+A cursor is "<file id>:<byte offset>", where the file id is a checksum of
+the file's first line. Rotation keeps the first line, so a cursor into the
+live file still resolves once that file has been gzipped to an archive;
+a small index of the archives (id and time of the last line), rebuilt
+only when an archive changes, finds it and lets time-bounded reads skip
+archives without decompressing them.
+"""
+
+import os
+import io
+import re
+import gzip
+import json
+import zlib
+import threading
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+BLOCK = 65536                   # bytes per backwards read
+MAX_SCAN = 8 * 1048576          # bytes examined per request before handing back a cursor
+FIRST_LINE_MAX = 4096
+
+LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARNING': 30, 'ERROR': 40, 'CRITICAL': 50}
+
+TEXT_LINE = re.compile(r'^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d{3}) - (\S+) - ([A-Z]+) - (.*)$')
+# Level of a raw line, checked before the (much slower) full parse
+RAW_LEVEL = re.compile(rb'^(?:\S+ \S+ - \S+ - ([A-Z]+) - |\{.*?"level":"([A-Z]+)")')
+
+
+def parse_line(line):
+    """Log entry {'ts', 'level', 'logger', 'msg'} for a text or JSON line
+
+    Lines in neither format (e.g. a traceback) keep their text as msg with
+    no level.
+    """
+    if line.startswith('{'):
+        try:
+            entry = json.loads(line)
+            return {'ts': entry['ts'], 'level': entry['level'],
+                    'logger': entry['logger'], 'msg': entry['msg']}
+        except (ValueError, KeyError, TypeError):
+            pass
+    match = TEXT_LINE.match(line)
+    if match is None:
+        return {'ts': None, 'level': None, 'logger': None, 'msg': line}
+    asctime, name, level, message = match.groups()
+    try:
+        ts = datetime.strptime(asctime, '%Y-%m-%d %H:%M:%S,%f').timestamp()
+    except ValueError:
+        ts = None
+    return {'ts': ts, 'level': level, 'logger': name, 'msg': message}
+
+
+def read_backwards(f, end, block=BLOCK):
+    """(offset, line) pairs from byte `end` back to the start of `f`, newest first"""
+    pos = end
+    tail = b''
+    while pos > 0:
+        size = min(block, pos)
+        pos -= size
+        f.seek(pos)
+        chunk = f.read(size) + tail
+        lines = chunk.split(b'\n')
+        tail = lines[0]
+        line_end = pos + len(chunk)
+        for line in reversed(lines[1:]):
+            start = line_end - len(line)
+            if line:
+                yield start, line
+            line_end = start - 1
+    if tail:
+        yield 0, tail
+
+
+def complete_end(f, size):
+    """Offset just past the last complete line (a line being written is left out)"""
+    pos = size
+    while pos > 0:
+        start = max(pos - BLOCK, 0)
+        f.seek(start)
+        chunk = f.read(pos - start)
+        newline = chunk.rfind(b'\n')
+        if newline >= 0:
+            return start + newline + 1
+        pos = start
+    return 0
+
+
+def first_line_id(f):
+    """Checksum of the first complete line, or None while the file has none"""
+    f.seek(0)
+    head = f.read(FIRST_LINE_MAX)
+    newline = head.find(b'\n')
+    if newline < 0:
+        return None
+    return f"{zlib.crc32(head[:newline]):08x}"
+
+
+class LogFilter:
+    """Minimum level and case-insensitive keyword"""
+
+    def __init__(self, level=None, keyword=None):
+        self.min_level = LEVELS.get((level or '').upper(), 0)
+        self.keyword = (keyword or '').lower().encode()
+
+    def match(self, raw):
+        """Parsed entry if the raw line passes, else None"""
+        if self.keyword and self.keyword not in raw.lower():
+            return None
+        if self.min_level:
+            found = RAW_LEVEL.match(raw)
+            if found is None:
+                return None
+            level = (found.group(1) or found.group(2)).decode()
+            if LEVELS.get(level, 0) < self.min_level:
+                return None
+        return parse_line(raw.decode('utf-8', errors='replace'))
+
+
+class LogReader:
+    """Tail, page back through and follow a log file and its rotated archives
+
+    Archives are <path>.1.gz (newest) to <path>.N.gz, as written by
+    LogWriter; they are small, so one is decompressed whole when a request
+    reaches into it.
+    """
+
+    def __init__(self, path, block=BLOCK, max_scan=MAX_SCAN):
+        self.path = path
+        self.block = block
+        self.max_scan = max_scan
+        self.lock = threading.Lock()
+        self.index = {}                 # archive path -> (stat, {'id', 'last_ts'})
+        self.cached = (None, None)      # (archive path and stat, decompressed bytes)
+
+    def archive_paths(self):
+        """Archives newest first"""
+        paths = []
+        n = 1
+        while os.path.exists(f"{self.path}.{n}.gz"):
+            paths.append(f"{self.path}.{n}.gz")
+            n += 1
+        return paths
+
+    def read_archive(self, path, stat):
+        with self.lock:
+            key, data = self.cached
+            if key == (path, stat):
+                return data
+        with gzip.open(path, 'rb') as f:
+            data = f.read()
+        with self.lock:
+            self.cached = ((path, stat), data)
+        return data
+
+    def archive_entry(self, path):
+        """Index entry for an archive, rebuilt only if the archive changed"""
+        st = os.stat(path)
+        stat = (st.st_mtime_ns, st.st_size)
+        with self.lock:
+            indexed = self.index.get(path)
+        if indexed is not None and indexed[0] == stat:
+            return indexed[1]
+
+        data = self.read_archive(path, stat)
+        f = io.BytesIO(data)
+        last = next((parse_line(line.decode('utf-8', errors='replace'))
+                     for offset, line in read_backwards(f, len(data), self.block)), None)
+        entry = {
+            'id': first_line_id(f),
+            'last_ts': last and last['ts'],
+        }
+        with self.lock:
+            self.index[path] = (stat, entry)
+        return entry
+
+    def files(self):
+        """[(id, opener, last_ts)] for every log file, oldest first
+
+        opener() returns (file, end of the last complete line); last_ts is
+        None for the live file.
+        """
+        files = []
+        for path in reversed(self.archive_paths()):
+            try:
+                entry = self.archive_entry(path)
+            except (OSError, EOFError, zlib.error) as e:
+                logger.error(f"Error indexing log archive {path}: {e}")
+                continue
+            files.append((entry['id'] or '-', self.archive_opener(path), entry['last_ts']))
+        try:
+            with open(self.path, 'rb') as f:
+                files.append((first_line_id(f) or '-', self.live_opener, None))
+        except FileNotFoundError:
+            pass
+        return files
+
+    def archive_opener(self, path):
+        def opener():
+            st = os.stat(path)
+            data = self.read_archive(path, (st.st_mtime_ns, st.st_size))
+            return io.BytesIO(data), len(data)
+        return opener
+
+    def live_opener(self):
+        f = open(self.path, 'rb')
+        return f, complete_end(f, os.fstat(f.fileno()).st_size)
+
+    def live_cursor(self):
+        """Cursor at the end of the live log"""
+        try:
+            with open(self.path, 'rb') as f:
+                return f"{first_line_id(f) or '-'}:{complete_end(f, os.fstat(f.fileno()).st_size)}"
+        except FileNotFoundError:
+            return '-:0'
+
+    def locate(self, files, cursor):
+        """(position in files, offset) for a cursor, or None if its file is gone"""
+        file_id, _, offset = (cursor or '').partition(':')
+        try:
+            offset = int(offset)
+        except ValueError:
+            return None
+        for i, (fid, opener, last_ts) in enumerate(files):
+            if fid == file_id:
+                return i, offset
+        # A cursor taken while the live file was still empty
+        if offset == 0 and files:
+            return len(files) - 1, 0
+        return None
+
+    def tail(self, limit=50, level=None, keyword=None, before=None, since=None):
+        """Newest matching entries, optionally older than the `before` cursor
+
+        `since` (epoch seconds) stops the walk back at that time, skipping
+        archives that end earlier without opening them. Returns (entries
+        oldest first, cursor for the next older page or None once there is
+        nothing older to read).
+        """
+        match = LogFilter(level, keyword).match
+        files = self.files()
+        if before:
+            located = self.locate(files, before)
+            if located is None:
+                return [], None
+            index, end = located
+        else:
+            index, end = len(files) - 1, None
+
+        entries = []
+        scanned = 0
+        while index >= 0:
+            file_id, opener, last_ts = files[index]
+            if since is not None and last_ts is not None and last_ts < since:
+                break
+            f, size = opener()
+            try:
+                if end is None:
+                    end = size
+                for offset, raw in read_backwards(f, min(end, size), self.block):
+                    scanned += len(raw) + 1
+                    entry = match(raw)
+                    if entry is not None:
+                        if since is not None and entry['ts'] is not None and entry['ts'] < since:
+                            entries.reverse()
+                            return entries, None
+                        entries.append(entry)
+                    if len(entries) >= limit or scanned >= self.max_scan:
+                        entries.reverse()
+                        return entries, f"{file_id}:{offset}"
+            finally:
+                f.close()
+            index -= 1
+            end = None
+        entries.reverse()
+        return entries, None
+
+    def follow(self, cursor, limit=200, level=None, keyword=None):
+        """Entries written after `cursor`
+
+        Returns (entries oldest first, cursor to continue from, more), with
+        more set when `limit` or the scan budget cut the batch short, or
+        (None, cursor, False) if the cursor's file no longer exists.
+        """
+        match = LogFilter(level, keyword).match
+        files = self.files()
+        located = self.locate(files, cursor)
+        if located is None:
+            return None, self.live_cursor(), False
+        index, offset = located
+
+        entries = []
+        scanned = 0
+        while True:
+            file_id, opener, last_ts = files[index]
+            f, size = opener()
+            try:
+                if offset > size:
+                    offset = 0  # truncated in place
+                f.seek(offset)
+                data = f.read(min(size - offset, self.max_scan - scanned))
+            finally:
+                f.close()
+            data = data[:data.rfind(b'\n') + 1]
+            for raw in data.split(b'\n')[:-1]:
+                offset += len(raw) + 1
+                scanned += len(raw) + 1
+                entry = match(raw)
+                if entry is not None:
+                    entries.append(entry)
+                    if len(entries) >= limit:
+                        return entries, f"{file_id}:{offset}", True
+            if offset < size:
+                return entries, f"{file_id}:{offset}", True
+            if index == len(files) - 1 or scanned >= self.max_scan:
+                return entries, f"{file_id}:{offset}", index < len(files) - 1
+            index += 1
+            offset = 0
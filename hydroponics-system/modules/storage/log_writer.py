@@ -0,0 +1,173 @@
+"""
+Asynchronous Log Writer
+Moves log formatting and file I/O off the control loop: records are queued
+and written by a background thread in batches, with size-based rotation
+and gzip compression of old files
+"""
+
+import os
+import sys
+import json
+import gzip
+import time
+import queue
+import shutil
+import logging
+import threading
+import logging.handlers
+from monitoring.tracing import traced
+
+STOP = object()
+
+
+class JSONFormatter(logging.Formatter):
+    """One compact JSON object per line
+
+    Structured values passed as `extra={'fields': {...}}` are merged into
+    the record, so readings stay machine-readable instead of living only
+    inside the message text.
+    """
+
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, separators=(',', ':'), default=str)
+
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    """Queues records as they are, leaving formatting to the writer thread
+
+    A full queue drops the record (counted in `dropped`) rather than block
+    the caller.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogWriter:
+    """Background writer batching records to a rotating, compressed log file
+
+    Lines are written when `flush_bytes` have built up, every
+    `flush_interval` seconds, or at once for ERROR and above. When the file
+    passes `max_bytes` it is gzipped to <file>.1.gz, older archives shift
+    up, and at most `backup_count` archives are kept.
+    """
+
+    def __init__(self, path, formatter, flush_interval=30, flush_bytes=65536,
+                 max_bytes=1048576, backup_count=5, queue_size=10000, console=True):
+        self.path = path
+        self.formatter = formatter
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.console = console
+
+        self.queue = queue.Queue(queue_size)
+        self.handler = LogQueueHandler(self.queue)
+        self.buffer = []
+        self.buffered = 0
+        self.reported_drops = 0
+        self.thread = threading.Thread(target=self.run, name='log-writer', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                record = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                record = None
+            if record is STOP:
+                break
+
+            urgent = False
+            if record is not None:
+                urgent = self.add(record)
+            if urgent or self.buffered >= self.flush_bytes or time.monotonic() >= deadline:
+                self.flush()
+                deadline = time.monotonic() + self.flush_interval
+        self.flush()
+
+    def add(self, record):
+        """Format one record into the buffer; returns True if it should be written now"""
+        try:
+            line = self.formatter.format(record) + '\n'
+        except Exception as e:
+            line = f"Unformattable log record from {record.name}: {e}\n"
+        self.buffer.append(line)
+        self.buffered += len(line)
+        if self.console:
+            sys.stderr.write(line)
+        return record.levelno >= logging.ERROR
+
+    @traced('log_flush')
+    def flush(self):
+        """Append buffered lines to the log file in one write, rotating if it grew too big"""
+        dropped = self.handler.dropped - self.reported_drops
+        if dropped:
+            self.reported_drops += dropped
+            self.buffer.append(self.formatter.format(logging.makeLogRecord({
+                'name': __name__, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                'msg': f"Log queue full, dropped {dropped} records"})) + '\n')
+        if not self.buffer:
+            return
+
+        try:
+            with open(self.path, 'a') as f:
+                f.write(''.join(self.buffer))
+                size = f.tell()
+            if self.max_bytes and size >= self.max_bytes:
+                self.rotate()
+        except Exception as e:
+            sys.stderr.write(f"Error writing log file {self.path}: {e}\n")
+        self.buffer = []
+        self.buffered = 0
+
+    def archive(self, n):
+        return f"{self.path}.{n}.gz"
+
+    def rotate(self):
+        """Compress the current file into the archive set"""
+        if not self.backup_count:
+            os.truncate(self.path, 0)
+            return
+        for n in range(self.backup_count - 1, 0, -1):
+            if os.path.exists(self.archive(n)):
+                os.replace(self.archive(n), self.archive(n + 1))
+
+        # Compress under temporary names so a crash never leaves a truncated archive
+        rotated = self.path + '.rotating'
+        os.replace(self.path, rotated)
+        with open(rotated, 'rb') as src, gzip.open(self.archive(1) + '.tmp', 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(self.archive(1) + '.tmp', self.archive(1))
+        os.remove(rotated)
+
+    def stop(self, timeout=5):
+        """Write everything still queued and stop the thread"""
+        try:
+            self.queue.put(STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        self.thread.join(timeout)
@@ -0,0 +1,124 @@
+"""
+Shared-Memory Snapshot Channel
+Fixed-layout mmap region (under /dev/shm) carrying the latest sensor
+snapshot from the controller to the web interface without touching flash
+"""
+
+import os
+import time
+import mmap
+import json
+import struct
+import zlib
+import logging
+from monitoring.tracing import TRACER
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'HYD1'
+# magic, padding, sequence, payload length, payload crc32
+HEADER = struct.Struct('<4s4xQII')
+SEQ_OFFSET = 8
+DEFAULT_CAPACITY = 16384
+
+
+class SnapshotChannel:
+    """Single-writer, many-reader snapshot slot guarded by a sequence lock
+
+    The writer makes the sequence odd, writes the payload, then makes it
+    even again. Readers retry while the sequence is odd or changed under
+    them, and the payload CRC catches any copy torn despite that.
+    """
+
+    def __init__(self, path, capacity=DEFAULT_CAPACITY, writer=False):
+        self.path = path
+        self.capacity = capacity
+        self.writer = writer
+        size = HEADER.size + capacity
+
+        if writer:
+            # Reuse the existing file so readers' mappings stay valid across restarts
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if os.fstat(fd).st_size < size:
+                    os.ftruncate(fd, size)
+                self.map = mmap.mmap(fd, size)
+            finally:
+                os.close(fd)
+            magic, seq, length, crc = HEADER.unpack_from(self.map, 0)
+            if magic != MAGIC:
+                HEADER.pack_into(self.map, 0, MAGIC, 0, 0, 0)
+                seq = 0
+            self.seq = seq + (seq & 1)  # recover from a writer that died mid-update
+        else:
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                self.map = mmap.mmap(fd, size, prot=mmap.PROT_READ)
+            finally:
+                os.close(fd)
+
+    def sequence(self):
+        """Current sequence number (cheap change check for readers)"""
+        return struct.unpack_from('<Q', self.map, SEQ_OFFSET)[0]
+
+    def publish(self, data):
+        """Write a new snapshot"""
+        payload = json.dumps(data).encode()
+        if len(payload) > self.capacity:
+            logger.error(f"Snapshot of {len(payload)} bytes exceeds shared memory slot ({self.capacity})")
+            return False
+
+        self.seq += 1
+        struct.pack_into('<Q', self.map, SEQ_OFFSET, self.seq)
+        self.map[HEADER.size:HEADER.size + len(payload)] = payload
+        self.seq += 1
+        HEADER.pack_into(self.map, 0, MAGIC, self.seq, len(payload), zlib.crc32(payload))
+        return True
+
+    def read(self, retries=100):
+        """Return (sequence, payload str) of a consistent snapshot, or (sequence, None)"""
+        seq = 0
+        for _ in range(retries):
+            magic, seq, length, crc = HEADER.unpack_from(self.map, 0)
+            if magic != MAGIC or seq == 0:
+                return seq, None
+            if seq & 1 or length > self.capacity:
+                continue
+            payload = self.map[HEADER.size:HEADER.size + length]
+            if self.sequence() == seq and zlib.crc32(payload) == crc:
+                return seq, payload.decode()
+        return seq, None
+
+    def close(self):
+        self.map.close()
+
+
+class SnapshotPublisher:
+    """Controller side: publish to shared memory, with a periodic JSON file fallback"""
+
+    def __init__(self, shm_path, data_file, file_interval):
+        self.data_file = data_file
+        self.file_interval = file_interval
+        self.last_file_write = 0
+
+        # Shared-memory snapshot for the web interface (no flash writes)
+        self.channel = None
+        try:
+            self.channel = SnapshotChannel(shm_path, writer=True)
+        except OSError as e:
+            logger.error(f"Shared memory snapshot unavailable, using JSON file only: {e}")
+
+    def publish(self, data):
+        """Share the snapshot through shared memory, writing the JSON file
+        only every file_interval seconds (or whenever shared memory fails)"""
+        published = self.channel is not None and self.channel.publish(data)
+
+        now = time.monotonic()
+        if not published or (self.file_interval and now - self.last_file_write >= self.file_interval):
+            # Write to a temp file and rename so readers never see a partial file
+            with TRACER.span('snapshot_file'):
+                tmp_file = self.data_file + '.tmp'
+                with open(tmp_file, 'w') as f:
+                    json.dump(data, f)
+                os.replace(tmp_file, self.data_file)
+            self.last_file_write = now
@@ -0,0 +1,261 @@
+"""
+Telemetry Uplink
+Store-and-forward of readings and pump events to a central collector
+
+record() and record_event() only append to memory, so the control loop
+never waits on the network. A background thread gathers what arrived
+every `interval` seconds into one gzipped JSON batch and posts it to the
+collector's /ingest. While the collector is unreachable (or answers 429 or
+503) batches are spooled to disk and sent oldest first once it is back,
+with exponential backoff between attempts.
+
+Everything is bounded: readings beyond `max_pending` in memory are
+dropped; once the spool passes 80% of `spool_max_bytes` only one reading
+per metric every `thin_interval` seconds is kept (events always are);
+past the limit the oldest batches are deleted. Each batch carries an id
+so the collector can ignore one it already has.
+"""
+
+import os
+import json
+import gzip
+import time
+import socket
+import threading
+import logging
+import collections
+import urllib.error
+import urllib.request
+from monitoring.metrics import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+SPOOL_HIGH_WATER = 0.8
+
+UPLINK_BATCHES = Counter('hydroponic_uplink_batches_total', 'Telemetry batches accepted by the collector')
+UPLINK_FAILURES = Counter('hydroponic_uplink_failures_total', 'Failed telemetry batch uploads')
+UPLINK_DROPPED = Counter('hydroponic_uplink_dropped_total',
+                         'Telemetry dropped to stay within the uplink bounds', ['kind'])
+UPLINK_SPOOLED = Gauge('hydroponic_uplink_spool_bytes', 'Telemetry waiting on disk for the collector')
+
+
+class CollectorBusy(Exception):
+    """The collector asked to be retried later"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"collector busy, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class Uplink:
+    def __init__(self, url, spool_dir, unit=None, token=None, interval=30, max_pending=20000,
+                 spool_max_bytes=52428800, thin_interval=300, timeout=10, max_backoff=600):
+        self.url = url.rstrip('/') + '/ingest'
+        self.spool_dir = spool_dir
+        self.unit = unit or socket.gethostname()
+        self.token = token
+        self.interval = interval
+        self.max_pending = max_pending
+        self.spool_max_bytes = spool_max_bytes
+        self.thin_interval = thin_interval
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+
+        self.lock = threading.Lock()
+        self.readings = []               # [metric, ts, value]
+        self.events = []                 # [ts, kind, source, value, ok]
+        self.thinning = False            # spool nearly full: keep fewer readings
+        self.last_kept = {}              # metric -> ts of the last reading kept while thinning
+        self.backoff = 0
+        self.retry_at = 0.0
+
+        # Spooled batches, oldest first; only the uplink thread (and stop(),
+        # after it has ended) touches these, so the directory is listed once
+        self.spool_files = collections.OrderedDict()    # file name -> bytes
+        self.spool_bytes = 0
+        os.makedirs(spool_dir, exist_ok=True)
+        self.scan_spool()
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='uplink', daemon=True)
+        self.thread.start()
+
+    def record(self, ts, values):
+        """Queue readings {metric: value} taken at `ts` (never blocks on I/O)"""
+        with self.lock:
+            for metric, value in values.items():
+                if value is None:
+                    continue
+                if len(self.readings) >= self.max_pending:
+                    UPLINK_DROPPED.labels('reading').inc()
+                    continue
+                if self.thinning:
+                    if ts - self.last_kept.get(metric, 0) < self.thin_interval:
+                        continue
+                    self.last_kept[metric] = ts
+                self.readings.append([metric, ts, float(value)])
+
+    def record_event(self, kind, source, value=None, ok=True, ts=None):
+        """Queue a discrete event such as a pump dose"""
+        with self.lock:
+            if len(self.events) >= self.max_pending:
+                UPLINK_DROPPED.labels('event').inc()
+                return
+            self.events.append([ts or time.time(), kind, source, value, bool(ok)])
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            try:
+                self.forward(self.take_batch())
+            except Exception as e:
+                logger.error(f"Uplink error: {e}")
+
+    def take_batch(self):
+        """The queued telemetry as one batch, or None if nothing is queued"""
+        with self.lock:
+            readings, self.readings = self.readings, []
+            events, self.events = self.events, []
+        if not readings and not events:
+            return None
+        return {'unit': self.unit, 'batch': str(time.time_ns()), 'readings': readings, 'events': events}
+
+    def forward(self, batch):
+        """Send spooled batches oldest first, then `batch`; spool whatever cannot go now"""
+        body = gzip.compress(json.dumps(batch, separators=(',', ':')).encode()) if batch else None
+        if time.monotonic() < self.retry_at:
+            if body is not None:
+                self.spool(batch['batch'], body)
+            return
+
+        for name in list(self.spool_files):
+            try:
+                with open(os.path.join(self.spool_dir, name), 'rb') as f:
+                    spooled = f.read()
+            except OSError as e:
+                logger.error(f"Unreadable uplink batch {name}, dropping it: {e}")
+                self.remove(name)
+                self.check_spool()
+                continue
+            if not self.send(spooled):
+                if body is not None:
+                    self.spool(batch['batch'], body)
+                return
+            self.remove(name)
+            self.check_spool()
+            if self.stopping.is_set():
+                break
+
+        if body is not None and not self.send(body):
+            self.spool(batch['batch'], body)
+
+    def send(self, body):
+        """Post one compressed batch; False (and a backoff) if it has to wait"""
+        headers = {'Content-Type': 'application/json', 'Content-Encoding': 'gzip'}
+        if self.token:
+            headers['Authorization'] = f"Bearer {self.token}"
+        request = urllib.request.Request(self.url, data=body, headers=headers, method='POST')
+        try:
+            try:
+                with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                    response.read()
+            except urllib.error.HTTPError as e:
+                if e.code in (429, 503):
+                    raise CollectorBusy(float(e.headers.get('Retry-After') or self.interval))
+                if 400 <= e.code < 500 and e.code not in (401, 403, 408):
+                    # The collector will never take this batch; do not let it block the rest
+                    logger.error(f"Collector rejected a telemetry batch ({e.code}), dropping it")
+                    UPLINK_DROPPED.labels('batch').inc()
+                    return True
+                raise
+        except Exception as e:
+            UPLINK_FAILURES.inc()
+            retry_after = e.retry_after if isinstance(e, CollectorBusy) else 0
+            self.backoff = min(max(self.backoff * 2, self.interval), self.max_backoff)
+            wait = max(self.backoff, retry_after)
+            self.retry_at = time.monotonic() + wait
+            logger.warning(f"Telemetry upload failed, retrying in {wait:.0f}s: {e}")
+            return False
+        UPLINK_BATCHES.inc()
+        if self.backoff:
+            logger.info("Telemetry uplink restored")
+        self.backoff = 0
+        return True
+
+    def scan_spool(self):
+        """Pick up the batches spooled before this start"""
+        try:
+            names = sorted(name for name in os.listdir(self.spool_dir) if name.endswith('.json.gz'))
+        except OSError:
+            names = []
+        for name in names:
+            try:
+                self.spool_files[name] = os.path.getsize(os.path.join(self.spool_dir, name))
+            except OSError:
+                continue
+            self.spool_bytes += self.spool_files[name]
+        self.check_spool()
+
+    def spool(self, batch_id, body):
+        """Keep a batch on disk until the collector takes it"""
+        name = f"{batch_id}.json.gz"
+        path = os.path.join(self.spool_dir, name)
+        try:
+            # Write then rename, so a crash never leaves half a batch to send
+            with open(path + '.tmp', 'wb') as f:
+                f.write(body)
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            logger.error(f"Error spooling telemetry batch: {e}")
+            UPLINK_DROPPED.labels('batch').inc()
+            return
+        self.spool_bytes += len(body) - self.spool_files.pop(name, 0)
+        self.spool_files[name] = len(body)
+        self.check_spool()
+
+    def remove(self, name):
+        """Delete a spooled batch"""
+        try:
+            os.remove(os.path.join(self.spool_dir, name))
+        except OSError:
+            pass
+        self.spool_bytes -= self.spool_files.pop(name, 0)
+
+    def check_spool(self):
+        """Enforce the spool limit, dropping the oldest batches"""
+        dropped = 0
+        while self.spool_files and self.spool_bytes > self.spool_max_bytes:
+            self.remove(next(iter(self.spool_files)))
+            dropped += 1
+        if dropped:
+            UPLINK_DROPPED.labels('batch').inc(dropped)
+            logger.warning(f"Telemetry spool full, dropped the {dropped} oldest batches")
+
+        thinning = self.spool_bytes > SPOOL_HIGH_WATER * self.spool_max_bytes
+        if thinning != self.thinning:
+            if thinning:
+                logger.warning(f"Telemetry spool nearly full, keeping one reading per metric "
+                               f"every {self.thin_interval}s")
+            else:
+                logger.info("Telemetry spool drained, sending every reading")
+            with self.lock:
+                self.thinning = thinning
+                self.last_kept = {}
+        UPLINK_SPOOLED.set(self.spool_bytes)
+
+    def stop(self):
+        """End the thread, spooling what is still queued for the next start"""
+        self.stopping.set()
+        self.thread.join(timeout=self.timeout + 1)
+        batch = self.take_batch()
+        if batch is not None:
+            self.spool(batch['batch'], gzip.compress(json.dumps(batch, separators=(',', ':')).encode()))
+
+
+def build_uplink(settings):
+    """The uplink configured in settings, or None when there is no collector"""
+    s = settings
+    if not s.uplink_url:
+        return None
+    return Uplink(s.uplink_url, s.uplink_spool_dir, unit=s.unit_name, token=s.uplink_token,
+                  interval=s.uplink_interval, max_pending=s.uplink_max_pending,
+                  spool_max_bytes=s.uplink_spool_max_bytes, thin_interval=s.uplink_thin_interval,
+                  timeout=s.uplink_timeout, max_backoff=s.uplink_max_backoff)
@@ -0,0 +1,475 @@
+#!/usr/bin/env python3
+"""
+Replay Recorded Sensor Data
+Runs recorded readings through the controller's dosing and alert logic far
+faster than real time, to compare settings against real tank behaviour
+
+Readings are streamed from the history database (a day at a time) or from
+hydroponic.log files, text or JSON lines, rotated .gz archives included.
+Replay is open loop by default: the recorded readings are used as they are,
+so doses that a different setting would have made do not change them. With
+--closed-loop the readings are corrected instead, taking out the modelled
+effect of the doses actually made and adding that of the replayed ones.
+"""
+
+import os
+import re
+import sys
+import json
+import gzip
+import math
+import time
+import argparse
+import itertools
+import logging
+from datetime import datetime
+from multiprocessing import Pool
+from concurrent.futures import Future
+
+try:
+    import main
+except ImportError:
+    # Replay never touches hardware; the simulated drivers satisfy the imports off a Pi
+    import sim
+    sim.install()
+    import main
+
+from config.settings import Settings
+from controllers.pump_controller import Delivery
+from storage.history_store import HistoryStore, DAY
+
+METRICS = ('tds', 'ph', 'temperature', 'water_level')
+PUMPS = {'nutrient': 'tds', 'ph': 'ph'}
+
+# Gaps longer than this many update intervals (controller down, sensors
+# unplugged) are not counted as time in or out of band
+MAX_GAP_INTERVALS = 10
+
+# Controller logging during replay would be one line per recorded reading
+QUIET = logging.getLogger('replay.controller')
+QUIET.disabled = True
+
+TEXT_LINE = re.compile(r'^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d{3}) - (\S+) - \w+ - (.*)$')
+READINGS_MESSAGE = re.compile(r'Sensor readings - TDS: ([-\d.]+) ppm, pH: ([-\d.]+), '
+                              r'Temp: ([-\d.]+)°C, Level: ([-\d.]+)cm')
+DOSED_MESSAGE = re.compile(r'Dosed ([\d.]+)ml of (\w+)')
+
+
+def history_records(path, tank=None, start=None, end=None, chunk=DAY):
+    """Stream (ts, readings, doses) from the history database
+
+    Readings recorded together are merged into one record; doses made
+    since the previous record come with the next one as [(pump, ml)].
+    """
+    prefix = f"{tank}." if tank else ''
+    store = HistoryStore(path, readonly=True)
+    try:
+        if start is None:
+            firsts = [store.first_reading(prefix + metric) for metric in METRICS]
+            firsts = [ts for ts in firsts if ts is not None]
+            if not firsts:
+                return
+            start = min(firsts)
+        if end is None:
+            end = (store.last_modified() or start) + 1
+
+        sources = {prefix + pump: pump for pump in PUMPS}
+        doses = []
+        while start < end:
+            stop = min(start + chunk, end)
+            merged = {}
+            for metric in METRICS:
+                for ts, value in store.query_raw(prefix + metric, start, stop):
+                    merged.setdefault(ts, {})[metric] = value
+            events = [(ts, sources[source], value) for ts, kind, source, value, ok
+                      in store.query_events(start, stop, 'dose') if ok and source in sources]
+
+            i = 0
+            for ts in sorted(merged):
+                while i < len(events) and events[i][0] <= ts:
+                    doses.append(events[i][1:])
+                    i += 1
+                yield ts, merged[ts], doses
+                doses = []
+            doses.extend(event[1:] for event in events[i:])
+            start = stop
+    finally:
+        store.close()
+
+
+def log_files(path):
+    """A log file preceded by its rotated archives, oldest first"""
+    archives = []
+    n = 1
+    while os.path.exists(f"{path}.{n}.gz"):
+        archives.append(f"{path}.{n}.gz")
+        n += 1
+    return archives[::-1] + ([path] if os.path.exists(path) else [])
+
+
+def open_log(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', errors='replace')
+    return open(path, errors='replace')
+
+
+def parse_log_line(line):
+    """(ts, logger, message, fields) for a text or JSON log line, or None"""
+    if line.startswith('{'):
+        try:
+            entry = json.loads(line)
+            return entry['ts'], entry['logger'], entry['msg'], entry
+        except (ValueError, KeyError):
+            return None
+    match = TEXT_LINE.match(line)
+    if match is None:
+        return None
+    asctime, name, message = match.groups()
+    ts = datetime.strptime(asctime, '%Y-%m-%d %H:%M:%S,%f').timestamp()
+    return ts, name, message, None
+
+
+def log_records(paths, tank=None):
+    """Stream (ts, readings, doses) from controller log files, in the order given
+
+    Dose lines come from the pump controller, which does not say which
+    tank it serves, so recorded doses are only attributed without `tank`.
+    """
+    # The controller logs as __main__ when started as a script
+    sources = {'main', '__main__'} if tank is None else {f"main.{tank}", f"__main__.{tank}"}
+    doses = []
+    for path in paths:
+        with open_log(path) as f:
+            for line in f:
+                parsed = parse_log_line(line.rstrip('\n'))
+                if parsed is None:
+                    continue
+                ts, name, message, fields = parsed
+
+                if tank is None and name.endswith('pump_controller'):
+                    match = DOSED_MESSAGE.search(message)
+                    if match and match.group(2) in PUMPS:
+                        doses.append((match.group(2), float(match.group(1))))
+                    continue
+                if name not in sources or not message.startswith('Sensor readings'):
+                    continue
+
+                if fields is not None and all(metric in fields for metric in METRICS):
+                    readings = {metric: float(fields[metric]) for metric in METRICS}
+                else:
+                    match = READINGS_MESSAGE.search(message)
+                    if match is None:
+                        continue
+                    readings = dict(zip(METRICS, map(float, match.groups())))
+                yield ts, readings, doses
+                doses = []
+
+
+def open_source(source):
+    """Records for a picklable source description, opened in whichever process replays it"""
+    kind = source[0]
+    if kind == 'history':
+        _, path, tank, start, end = source
+        return history_records(path, tank, start, end)
+    if kind == 'log':
+        _, paths, tank = source
+        return log_records(paths, tank)
+    raise ValueError(f"Unknown replay source {kind}")
+
+
+class ReplayPump:
+    """Stands in for a pump: every dose succeeds at once and is counted"""
+
+    def __init__(self, pump_type, clock):
+        self.pump_type = pump_type
+        self.clock = clock
+        self.doses = 0
+        self.ml = 0.0
+        self.started = []       # (ts, ml) not yet handed to the plant correction
+
+    def dose_async(self, ml_amount):
+        self.doses += 1
+        self.ml += ml_amount
+        self.started.append((self.clock(), ml_amount))
+        future = Future()
+        future.set_result(Delivery(ml_amount, ml_amount))
+        return future
+
+
+class NullSink:
+    """Stands in for the history store, alert dispatcher and uplink: keeps nothing"""
+
+    def record(self, ts, values):
+        pass
+
+    def record_event(self, kind, source, value=None, ok=True, ts=None):
+        pass
+
+    def query_events(self, start, end, kind=None):
+        return []
+
+    def submit(self, event):
+        pass
+
+    def stop(self):
+        pass
+
+
+class ReplayController(main.HydroponicController):
+    """The controller's decision logic without sensors, pumps or storage
+
+    Time is the recorded time of the reading being replayed. Dose-response
+    models start from the settings.py priors and learn from the replay.
+    """
+
+    def __init__(self, settings):
+        self.now = 0.0
+        sink = NullSink()
+        self.init_decisions(settings, history=sink, dispatcher=sink, uplink=sink)
+        self.logger = QUIET
+        self.pumps = {pump: ReplayPump(pump, self.clock) for pump in PUMPS}
+        self.nutrient_pump = self.pumps['nutrient']
+        self.ph_pump = self.pumps['ph']
+
+    def clock(self):
+        return self.now
+
+
+class PlantCorrection:
+    """Counterfactual readings for closed-loop replay
+
+    Each dose moves its reading by gain * ml, approached exponentially over
+    the mixing time (the same first-order response the dosing model
+    assumes). Recorded doses are subtracted and replayed ones added.
+    """
+
+    def __init__(self, settings):
+        self.gains = {'nutrient': settings.nutrient_ppm_per_ml, 'ph': settings.ph_per_ml}
+        self.tau = max(settings.mixing_time, 1.0)
+        self.doses = []                         # (ts, pump, signed ml)
+        self.settled = {metric: 0.0 for metric in PUMPS.values()}
+
+    def add(self, ts, pump, ml):
+        self.doses.append((ts, pump, ml))
+
+    def correct(self, ts, readings):
+        offsets = dict(self.settled)
+        active = []
+        for dosed_at, pump, ml in self.doses:
+            effect = self.gains[pump] * ml
+            elapsed = max(ts - dosed_at, 0.0)
+            if elapsed > 10 * self.tau:
+                self.settled[PUMPS[pump]] += effect
+                offsets[PUMPS[pump]] += effect
+                continue
+            active.append((dosed_at, pump, ml))
+            offsets[PUMPS[pump]] += effect * (1 - math.exp(-elapsed / self.tau))
+        self.doses = active
+
+        corrected = dict(readings)
+        if 'tds' in corrected:
+            corrected['tds'] = max(corrected['tds'] + offsets['tds'], 0.0)
+        if 'ph' in corrected:
+            corrected['ph'] = min(max(corrected['ph'] + offsets['ph'], 0.0), 14.0)
+        return corrected
+
+
+class ReplayStats:
+    """Doses, time out of band and alert episodes over one replay"""
+
+    def __init__(self, settings):
+        self.bands = {'tds': (settings.target_tds_min, settings.target_tds_max),
+                      'ph': (settings.target_ph_min, settings.target_ph_max)}
+        self.max_gap = MAX_GAP_INTERVALS * settings.update_interval
+        self.records = 0
+        self.first = self.last = None
+        self.covered = 0.0
+        self.out_of_band = {metric: 0.0 for metric in self.bands}
+        self.alerts = {}
+        self.active = set()
+
+    def add(self, ts, data, alerts):
+        if self.last is not None:
+            # Each reading holds until the next one
+            dt = ts - self.last
+            if 0 < dt <= self.max_gap:
+                self.covered += dt
+                for metric, (low, high) in self.bands.items():
+                    if not low <= self.previous[metric] <= high:
+                        self.out_of_band[metric] += dt
+        else:
+            self.first = ts
+        self.last = ts
+        self.previous = {metric: data[metric] for metric in self.bands}
+        self.records += 1
+
+        # An alert raised on consecutive readings is one episode
+        kinds = {kind for kind, message in alerts}
+        for kind in kinds - self.active:
+            self.alerts[kind] = self.alerts.get(kind, 0) + 1
+        self.active = kinds
+
+    def result(self, controller):
+        hours = self.covered / 3600
+        return {
+            'records': self.records,
+            'hours': round(hours, 2),
+            'doses': {pump: p.doses for pump, p in controller.pumps.items()},
+            'ml': {pump: round(p.ml, 1) for pump, p in controller.pumps.items()},
+            'out_of_band_hours': {m: round(s / 3600, 2) for m, s in self.out_of_band.items()},
+            'out_of_band_fraction': {m: round(s / self.covered, 4) if self.covered else 0.0
+                                     for m, s in self.out_of_band.items()},
+            'alerts': dict(sorted(self.alerts.items())),
+        }
+
+
+def replay(records, overrides=None, closed_loop=False):
+    """Run records through a ReplayController with settings.py plus `overrides`"""
+    settings = Settings()
+    for key, value in (overrides or {}).items():
+        if not hasattr(Settings, key):
+            raise ValueError(f"Unknown setting {key}")
+        setattr(settings, key, value)
+
+    controller = ReplayController(settings)
+    stats = ReplayStats(settings)
+    plant = PlantCorrection(settings) if closed_loop else None
+    data = controller.data
+
+    for ts, readings, doses in records:
+        controller.now = ts
+        if plant is not None:
+            for pump, ml in doses:
+                plant.add(ts, pump, -ml)
+            readings = plant.correct(ts, readings)
+        data.update(readings)
+        data['timestamp'] = ts
+        controller.assess_readings(readings, ts)
+
+        # Same order as a scheduled cycle; dosing only acts on fresh TDS/pH
+        if 'tds' in readings or 'ph' in readings:
+            controller.control_nutrients()
+            controller.control_ph()
+        stats.add(ts, data, controller.check_alerts())
+        controller.scheduler.run_commands()  # dose corrections from the pump callbacks
+
+        if plant is not None:
+            for pump in controller.pumps.values():
+                for dosed_at, ml in pump.started:
+                    plant.add(dosed_at, pump.pump_type, ml)
+                pump.started.clear()
+        else:
+            for pump in controller.pumps.values():
+                pump.started.clear()
+
+    return stats.result(controller)
+
+
+def replay_job(job):
+    source, overrides, closed_loop = job
+    start = time.perf_counter()
+    result = replay(open_source(source), overrides, closed_loop)
+    result['seconds'] = round(time.perf_counter() - start, 3)
+    return overrides, result
+
+
+def sweep(source, grid, base=None, closed_loop=False, processes=None):
+    """Replay every combination of the `grid` values ({setting: [values]}) across CPU cores
+
+    Each worker streams the source itself, so nothing is loaded up front
+    or copied between processes. Returns [(overrides, result)] in grid order.
+    """
+    names = sorted(grid)
+    jobs = []
+    for values in itertools.product(*(grid[name] for name in names)):
+        overrides = dict(base or {})
+        overrides.update(zip(names, values))
+        jobs.append((source, overrides, closed_loop))
+    if len(jobs) == 1 or processes == 1:
+        return [replay_job(job) for job in jobs]
+    with Pool(processes) as pool:
+        return pool.map(replay_job, jobs, chunksize=1)
+
+
+def parse_value(text):
+    """Setting values as JSON where possible ('12', '[1, 2]', 'true'), else as strings"""
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def print_results(results, grid):
+    names = sorted(grid)
+    header = names + ['doses N/pH', 'ml N/pH', 'TDS out h (%)', 'pH out h (%)', 'alerts', 'speed']
+    rows = []
+    for overrides, r in results:
+        speed = r['hours'] * 3600 / r['seconds'] if r['seconds'] else 0
+        alerts = ', '.join(f"{kind} {n}" for kind, n in r['alerts'].items()) or '-'
+        rows.append([str(overrides[name]) for name in names] + [
+            f"{r['doses']['nutrient']}/{r['doses']['ph']}",
+            f"{r['ml']['nutrient']:.0f}/{r['ml']['ph']:.0f}",
+            f"{r['out_of_band_hours']['tds']:.1f} ({100 * r['out_of_band_fraction']['tds']:.1f})",
+            f"{r['out_of_band_hours']['ph']:.1f} ({100 * r['out_of_band_fraction']['ph']:.1f})",
+            alerts,
+            f"{speed:,.0f}x",
+        ])
+    widths = [max(len(row[i]) for row in rows + [header]) for i in range(len(header))]
+    for row in [header] + rows:
+        print('  '.join(cell.ljust(width) for cell, width in zip(row, widths)))
+    if results:
+        r = results[0][1]
+        print(f"\n{r['records']} readings over {r['hours']:.1f}h per run")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded readings through the control logic")
+    source_group = parser.add_mutually_exclusive_group()
+    source_group.add_argument('--history', metavar='DB',
+                              help="history database (default from settings.py)")
+    source_group.add_argument('--log', nargs='+', metavar='FILE',
+                              help="log files; a live log brings its rotated archives with it")
+    parser.add_argument('--tank', help="tank name when several tanks were recorded")
+    parser.add_argument('--days', type=float, help="only replay the last N days of history")
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE',
+                        help="override a setting for every run")
+    parser.add_argument('--sweep', action='append', default=[], metavar='NAME=V1,V2,...',
+                        help="replay once per value (several --sweep options combine)")
+    parser.add_argument('--closed-loop', action='store_true',
+                        help="correct readings for the modelled effect of replayed vs recorded doses")
+    parser.add_argument('--processes', type=int, help="worker processes (default: one per core)")
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    args = parser.parse_args()
+
+    if args.log:
+        paths = []
+        for path in args.log:
+            paths.extend(log_files(path) if not path.endswith('.gz') else [path])
+        if not paths:
+            sys.exit(f"Error: no log files at {', '.join(args.log)}")
+        source = ('log', paths, args.tank)
+    else:
+        path = args.history or Settings.history_db
+        if not os.path.exists(path):
+            sys.exit(f"Error: no history database at {path}")
+        start = time.time() - args.days * DAY if args.days else None
+        source = ('history', path, args.tank, start, None)
+
+    base = {}
+    for item in args.set:
+        name, _, value = item.partition('=')
+        base[name] = parse_value(value)
+    grid = {}
+    for item in args.sweep:
+        name, _, values = item.partition('=')
+        grid[name] = [parse_value(value) for value in values.split(',')]
+
+    try:
+        results = sweep(source, grid, base, args.closed_loop, args.processes)
+    except ValueError as e:
+        sys.exit(f"Error: {e}")
+
+    if args.json:
+        print(json.dumps([{'settings': overrides, **result} for overrides, result in results], indent=2))
+    else:
+        print_results(results, grid)
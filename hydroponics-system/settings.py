@@ -1,38 +1,188 @@
-        """
-        System configuration and settings
-        """
-
-        class Settings:
-            # Sensor calibration values
-            tds_calibration_factor = 0.5  # Adjust based on calibration
-            ph_calibration_offset = 0.0   # Adjust based on calibration
-            ph_calibration_slope = 1.0    # Adjust based on calibration
-
-            # Target values for leafy greens
-            target_tds_min = 800          # ppm
-            target_tds_max = 1200         # ppm
-            target_ph_min = 5.5           # pH
-            target_ph_max = 6.5           # pH
-
-            # Temperature limits
-            min_temp = 18.0               # °C
-            max_temp = 26.0               # °C
-
-            # Water level
-            min_water_level = 10.0        # cm from sensor
-
-            # Dosing parameters
-            nutrient_dose_ml = 10         # ml per dose
-            ph_dose_ml = 5                # ml per dose
-
-            # Timing
-            update_interval = 60          # seconds between readings
-
-            # Hardware pins (for reference)
-            mcp3008_clk = 11
-            mcp3008_dout = 9
-            mcp3008_din = 10
-            mcp3008_cs = 8
-            temp_sensor_pin = 4
-            ultrasonic_trig = 15
-            ultrasonic_echo = 18
\ No newline at end of file
+"""
+System configuration and settings
+"""
+
+class Settings:
+    # Sensor calibration defaults; calibration.py stores measured values in
+    # calibration_file, which the controller re-reads while running
+    tds_calibration_factor = 0.5  # Adjust based on calibration
+    ph_calibration_offset = 0.0   # Adjust based on calibration
+    ph_calibration_slope = 1.0    # Adjust based on calibration
+    calibration_file = '/home/pi/hydroponic/config/calibration.json'
+    calibration_reload_interval = 5  # seconds between checks for a new calibration
+
+    # Target values for leafy greens
+    target_tds_min = 800          # ppm
+    target_tds_max = 1200         # ppm
+    target_ph_min = 5.5           # pH
+    target_ph_max = 6.5           # pH
+
+    # Temperature limits
+    min_temp = 18.0               # °C
+    max_temp = 26.0               # °C
+    temp_hysteresis = 0.5         # °C back inside the limits before a temperature alert clears
+
+    # Water level
+    min_water_level = 10.0        # cm from sensor
+    water_level_hysteresis = 1.0  # cm above min_water_level before a low level alert clears
+    level_watch_margin = 5.0      # cm above min_water_level below which the level is read every fast_interval
+
+    # Dosing parameters
+    nutrient_dose_ml = 10         # ml per dose
+    ph_dose_ml = 5                # ml per dose
+
+    # Dosing control: 'model' learns each tank's dose response and sizes
+    # doses to reach the middle of the target band; 'threshold' gives the
+    # fixed doses above whenever a limit is crossed
+    dosing_mode = 'model'
+    nutrient_ppm_per_ml = 8.0     # initial guess, learned from dose history
+    ph_per_ml = -0.04             # pH change per ml of pH down, initial guess
+    mixing_time = 120             # seconds (dose mixing time constant), initial guess
+    dose_gain = 0.8               # fraction of the modelled dose given
+    dose_integral_gain = 0.1      # per minute, corrects persistent shortfall
+    min_dose_ml = 1.0             # smaller doses are skipped
+    nutrient_max_dose_ml = 30     # ml per dose
+    ph_max_dose_ml = 15           # ml per dose
+    dose_learning_days = 14       # dose history used to fit the model at startup
+
+    # Timing
+    update_interval = 60          # seconds between TDS/pH readings while stable
+    fast_interval = 10            # seconds between TDS/pH readings while out of band or mixing
+    temp_interval = 60            # seconds between temperature readings
+    level_interval = 60           # seconds between water level readings
+
+    # ADC sampling
+    adc_samples = 8               # samples per channel per burst scan
+
+    # Filter chains from raw ADC codes to one value per reading. Stages:
+    # despike(k), median, mean, trimmed_mean(proportion), ema(alpha),
+    # kalman(process_var, measurement_var); ema and kalman carry state
+    # across cycles.
+    tds_filter = [('despike', 3.0), ('median',), ('kalman', 4.0, 16.0)]
+    ph_filter = [('despike', 3.0), ('median',), ('kalman', 1.0, 16.0)]
+
+    # TDS code -> ppm tables are precomputed over this temperature grid
+    # (low, high, step in C); readings outside it are computed directly
+    tds_temperature_grid = (0.0, 40.0, 0.5)
+
+    # Sensor acquisition
+    concurrent_acquisition = True # read independent sensors in parallel
+    adc_read_timeout = 0.5        # seconds
+    temp_read_timeout = 1.5       # seconds (DS18B20 12-bit conversion is 750 ms)
+    level_read_timeout = 1.0      # seconds
+
+    # Ultrasonic level sensor
+    level_mode = 'edge'           # 'edge' (GPIO interrupts) or 'poll' (busy-wait)
+    level_burst = 5               # pings per reading, median with outlier rejection
+
+    # Sensor health: a reading with any fault is untrusted and never dosed on
+    health_recovery_readings = 3  # clean readings before an untrusted sensor is trusted again
+    adc_rail_fraction = 0.5       # share of raw codes at 0 or 1023 that means a railed probe
+    adc_stuck_samples = 256       # identical raw codes in a row that mean a stuck channel
+    adc_max_noise = 20.0          # codes (spread of raw samples within a burst)
+    tds_valid_range = (0, 5000)   # ppm
+    ph_valid_range = (1.0, 13.0)  # pH
+    temperature_valid_range = (0.0, 40.0)    # °C (a DS18B20 reads 85 after a power glitch)
+    water_level_valid_range = (2.0, 400.0)   # cm (HC-SR04 range)
+    tds_max_step = 300            # ppm between readings while no dose is mixing
+    ph_max_step = 1.0             # pH between readings while no dose is mixing
+    tds_drift_limit = 200         # ppm per day between doses before warning of drift
+    ph_drift_limit = 0.5          # pH per day between doses before warning of drift
+    drift_time_constant = 21600   # seconds of readings the drift trend follows
+    calibration_max_age_days = 30 # warn when a stored calibration is older (0 = never)
+
+    # History store
+    history_db = '/home/pi/hydroponic/logs/history.db'
+    history_flush_interval = 300  # seconds between batched writes to the SD card
+    history_raw_days = 30         # days of raw readings kept
+    history_minute_days = 180     # days of 1-minute rollups kept
+    history_hour_days = 1825      # days of 1-hour rollups kept (1-day kept forever)
+
+    # Files
+    log_file = '/home/pi/hydroponic/logs/hydroponic.log'
+    data_file = '/home/pi/hydroponic/logs/current_data.json'
+
+    # Logging
+    log_format = 'text'           # 'text' or 'json' (one JSON object per line)
+    log_async = True              # format and write logs on a background thread
+    log_flush_interval = 30       # seconds between batched writes (errors are written at once)
+    log_flush_bytes = 65536       # write early once this much is buffered
+    log_max_bytes = 1048576       # rotate the log file at this size
+    log_backup_count = 5          # gzipped old log files kept
+    log_queue_size = 10000        # records queued before new ones are dropped
+
+    # Alerts: notified when raised, when cleared and as reminders, from
+    # background threads so a slow sink never delays the control loop
+    alert_clear_readings = 2      # readings without a condition before its alert clears
+    alert_min_interval = 300      # seconds between notifications of one alert (critical ones go at once)
+    alert_repeat_interval = 3600  # seconds between reminders while an alert stays active (0 = never)
+    alert_file = '/home/pi/hydroponic/logs/alerts.jsonl'  # one JSON line per notification (None = off)
+    alert_webhook_url = None      # POSTed JSON per notification, e.g. a Home Assistant webhook
+    alert_smtp_host = None        # email notifications when set with alert_email_to
+    alert_smtp_port = 587
+    alert_smtp_starttls = True
+    alert_smtp_user = None
+    alert_smtp_password = None
+    alert_email_from = 'hydroponic@localhost'
+    alert_email_to = []           # recipient addresses
+    alert_sink_timeout = 10       # seconds per delivery attempt
+    alert_retries = 2             # further attempts after a failed delivery
+    alert_retry_delay = 5         # seconds between attempts
+    alert_queue_size = 100        # notifications queued per sink before the oldest are dropped
+
+    # Fleet uplink: readings and pump events batched, gzipped and posted to
+    # a central collector (collector.py) from a background thread, spooled
+    # to disk while the collector cannot be reached
+    uplink_url = None             # collector base URL, e.g. 'http://fleet.local:8090' (None = off)
+    uplink_token = None           # shared secret the collector was started with
+    unit_name = None              # this unit's name in the fleet (None = hostname)
+    uplink_interval = 30          # seconds between batches
+    uplink_spool_dir = '/home/pi/hydroponic/logs/uplink'
+    uplink_spool_max_bytes = 52428800  # spooled batches kept while offline, oldest dropped beyond
+    uplink_thin_interval = 300    # seconds per reading per metric kept once the spool is 80% full
+    uplink_max_pending = 20000    # readings queued between batches before new ones are dropped
+    uplink_timeout = 10           # seconds per upload attempt
+    uplink_max_backoff = 600      # longest wait between attempts while the collector is down
+
+    # Tracing: spans for every stage of every cycle in a ring buffer, dumped
+    # as a Chrome trace on SIGUSR2 (which turns tracing on if it is off)
+    trace_enabled = False         # record from startup; off costs one check per stage
+    trace_buffer_spans = 50000    # spans kept, oldest dropped first (about 100 bytes each)
+    trace_dir = '/home/pi/hydroponic/logs/traces'
+    trace_slow_cycle = 0          # seconds; a longer cycle dumps the trace by itself (0 = never)
+    trace_dump_interval = 300     # seconds between automatic dumps
+    profile_interval = 0          # seconds between stack samples while tracing, e.g. 0.005 (0 = off)
+
+    # Snapshot sharing with the web interface
+    snapshot_shm_path = '/dev/shm/hydroponic_snapshot'
+    snapshot_file_interval = 600  # seconds between JSON file fallback writes (0 = never)
+    metrics_shm_path = '/dev/shm/hydroponic_metrics'
+    command_socket_path = '/dev/shm/hydroponic_commands'  # manual commands from the web interface
+    metrics_interval = 15         # seconds between metrics updates for /metrics
+
+    # Multi-tank mode: when this file exists it lists the reservoirs to run,
+    # each overriding any of the settings above and below
+    tanks_file = '/home/pi/hydroponic/config/tanks.json'
+
+    # Hardware pins
+    mcp3008_clk = 11
+    mcp3008_dout = 9
+    mcp3008_din = 10
+    mcp3008_cs = 8
+    temp_sensor_pin = 4
+    ultrasonic_trig = 15
+    ultrasonic_echo = 18
+
+    # Hardware assignment
+    tds_channel = 0               # MCP3008 channel
+    ph_channel = 1                # MCP3008 channel
+    temp_sensor_id = None         # DS18B20 id of the reservoir probe (None = first found)
+    temp_probes = {}              # more DS18B20s on the bus, {name: id}, e.g. {'air': '3c01d607e0bb'}
+    temp_resolution = 12          # DS18B20 bits: 9 (94 ms, 0.5°C) to 12 (750 ms, 0.0625°C)
+    nutrient_pump_port = '/dev/ttyACM0'
+    ph_pump_port = '/dev/ttyACM1'  # may equal nutrient_pump_port (one Pico, two channels)
+
+    # Pump link
+    pump_protocol = 'auto'        # 'auto' (framed if the Pico firmware answers), 'framed' or 'ascii'
+    pump_retries = 3              # resends of an unacknowledged framed command
+    pump_dose_timeout = 300       # seconds to wait for a dose's completion report
\ No newline at end of file
@@ -1,54 +1,241 @@
-// Update sensor readings and log entries
+// Tank to show in multi-tank mode (?tank=name), default the first one
+const selectedTank = new URLSearchParams(window.location.search).get('tank');
+let shownTank = selectedTank;
+
+// Render a sensor snapshot
+function renderData(data) {
+    if (data.tanks) {
+        const name = selectedTank && data.tanks[selectedTank] ? selectedTank : Object.keys(data.tanks)[0];
+        if (name !== shownTank) {
+            shownTank = name;
+            updateHistory();
+        }
+        data = data.tanks[name];
+    }
+
+    // Update sensor values
+    document.getElementById('tds').textContent = data.tds.toFixed(0) + ' ppm';
+    document.getElementById('ph').textContent = data.ph.toFixed(2);
+    document.getElementById('temperature').textContent = data.temperature.toFixed(1) + ' °C';
+    document.getElementById('water_level').textContent = data.water_level.toFixed(1) + ' cm';
+
+    // Grey out readings the controller does not trust, with the reason on hover
+    const health = data.sensor_health || {};
+    for (const name of ['tds', 'ph', 'temperature', 'water_level']) {
+        const element = document.getElementById(name);
+        const state = health[name];
+        const untrusted = state && !state.trusted;
+        element.classList.toggle('untrusted', Boolean(untrusted));
+        element.classList.toggle('drifting', Boolean(state && state.warnings.length));
+        element.title = state ? state.faults.concat(state.warnings).join(', ') : '';
+    }
+
+    // Active alerts, most severe first
+    const alerts = data.alerts || [];
+    document.getElementById('alerts').replaceChildren(...alerts.map(alertRow));
+
+    // Update timestamp
+    const timestamp = new Date(data.timestamp);
+    document.getElementById('timestamp').textContent = timestamp.toLocaleString();
+}
+
+function alertRow(item) {
+    const row = document.createElement('div');
+    row.className = 'alert-item ' + item.severity;
+    const since = item.since ? ' (since ' + new Date(item.since * 1000).toLocaleString() + ')' : '';
+    row.textContent = item.message + since;
+    return row;
+}
+
+// Fetch the latest snapshot once
 function updateData() {
     fetch('/data')
+        .then(response => response.json())
+        .then(renderData)
+        .catch(error => {
+            console.error('Error fetching data:', error);
+        });
+}
+
+// Snapshots are pushed over Server-Sent Events as soon as the controller
+// writes them; fall back to polling only where EventSource is missing
+if (window.EventSource) {
+    const source = new EventSource('/stream');
+    source.onmessage = event => renderData(JSON.parse(event.data));
+} else {
+    updateData();
+    setInterval(updateData, 5000);
+}
+
+// Draw a downsampled history series on the chart canvas
+function drawHistory(points) {
+    const canvas = document.getElementById('history_chart');
+    const ctx = canvas.getContext('2d');
+    ctx.clearRect(0, 0, canvas.width, canvas.height);
+    if (points.length < 2) {
+        return;
+    }
+
+    const pad = 30;
+    const t0 = points[0][0];
+    const t1 = points[points.length - 1][0];
+    const values = points.map(p => p[1]);
+    const lo = Math.min(...values);
+    const hi = Math.max(...values);
+    const x = t => pad + (t - t0) / (t1 - t0 || 1) * (canvas.width - 2 * pad);
+    const y = v => canvas.height - pad - (v - lo) / (hi - lo || 1) * (canvas.height - 2 * pad);
+
+    ctx.fillStyle = '#333';
+    ctx.fillText(hi.toFixed(2), 0, pad);
+    ctx.fillText(lo.toFixed(2), 0, canvas.height - pad);
+
+    ctx.strokeStyle = '#3498db';
+    ctx.beginPath();
+    points.forEach((p, i) => {
+        if (i === 0) {
+            ctx.moveTo(x(p[0]), y(p[1]));
+        } else {
+            ctx.lineTo(x(p[0]), y(p[1]));
+        }
+    });
+    ctx.stroke();
+}
+
+// Fetch a chart-sized history series; the server downsamples and the
+// browser revalidates with the ETag, so unchanged ranges cost a 304
+function updateHistory() {
+    const metric = document.getElementById('history_metric').value;
+    const range = document.getElementById('history_range').value;
+    const points = document.getElementById('history_chart').width / 3;
+    const tank = shownTank ? `&tank=${encodeURIComponent(shownTank)}` : '';
+    fetch(`/history?metric=${metric}&range=${range}&points=${Math.round(points)}${tank}`)
+        .then(response => response.json())
+        .then(data => drawHistory(data.points))
+        .catch(error => {
+            console.error('Error fetching history:', error);
+        });
+}
+
+document.getElementById('history_metric').addEventListener('change', updateHistory);
+document.getElementById('history_range').addEventListener('change', updateHistory);
+updateHistory();
+setInterval(updateHistory, 60000);
+
+// System log: the last entries once, then only what was written since
+// (the server hands back a cursor); older pages on demand
+const LOG_LIMIT = 100;
+const LOG_MAX_SHOWN = 500;
+let logCursor = null;
+let logBefore = null;
+
+function logQuery() {
+    const level = document.getElementById('log_level').value;
+    const keyword = document.getElementById('log_search').value.trim();
+    return `&level=${encodeURIComponent(level)}&q=${encodeURIComponent(keyword)}`;
+}
+
+function logRow(entry) {
+    const row = document.createElement('div');
+    row.className = 'log-entry ' + (entry.level || '');
+    const time = entry.ts ? new Date(entry.ts * 1000).toLocaleString() + ' ' : '';
+    row.textContent = time + (entry.level ? entry.level + ' ' : '') + entry.msg;
+    return row;
+}
+
+function showOlderButton() {
+    document.getElementById('log_older').style.display = logBefore ? '' : 'none';
+}
+
+function loadLog() {
+    fetch(`/logs?limit=${LOG_LIMIT}${logQuery()}`)
         .then(response => response.json())
         .then(data => {
-            // Update sensor values
-            document.getElementById('tds').textContent = data.tds.toFixed(0) + ' ppm';
-            document.getElementById('ph').textContent = data.ph.toFixed(2);
-            document.getElementById('temperature').textContent = data.temperature.toFixed(1) + ' °C';
-            document.getElementById('water_level').textContent = data.water_level.toFixed(1) + ' cm';
-
-            // Update timestamp
-            const timestamp = new Date(data.timestamp);
-            document.getElementById('timestamp').textContent = timestamp.toLocaleString();
+            const panel = document.getElementById('log_entries');
+            panel.replaceChildren(...data.entries.map(logRow));
+            panel.scrollTop = panel.scrollHeight;
+            logCursor = data.cursor;
+            logBefore = data.before;
+            showOlderButton();
         })
         .catch(error => {
-            console.error('Error fetching data:', error);
+            console.error('Error fetching log:', error);
         });
 }
 
-// Initial data update
-updateData();
+function followLog() {
+    if (!logCursor) {
+        return;
+    }
+    fetch(`/logs?limit=${LOG_LIMIT}&after=${encodeURIComponent(logCursor)}${logQuery()}`)
+        .then(response => response.json())
+        .then(data => {
+            if (data.reset) {
+                loadLog();
+                return;
+            }
+            const panel = document.getElementById('log_entries');
+            const atBottom = panel.scrollTop + panel.clientHeight >= panel.scrollHeight - 5;
+            panel.append(...data.entries.map(logRow));
+            while (panel.childElementCount > LOG_MAX_SHOWN) {
+                panel.firstElementChild.remove();
+            }
+            if (atBottom) {
+                panel.scrollTop = panel.scrollHeight;
+            }
+            logCursor = data.cursor;
+            if (data.more) {
+                followLog();
+            }
+        })
+        .catch(error => {
+            console.error('Error fetching log:', error);
+        });
+}
+
+function loadOlderLog() {
+    fetch(`/logs?limit=${LOG_LIMIT}&before=${encodeURIComponent(logBefore)}${logQuery()}`)
+        .then(response => response.json())
+        .then(data => {
+            document.getElementById('log_entries').prepend(...data.entries.map(logRow));
+            logBefore = data.before;
+            showOlderButton();
+        })
+        .catch(error => {
+            console.error('Error fetching log:', error);
+        });
+}
 
-// Update data every 5 seconds
-setInterval(updateData, 5000);
+document.getElementById('log_level').addEventListener('change', loadLog);
+document.getElementById('log_search').addEventListener('change', loadLog);
+document.getElementById('log_older').addEventListener('click', loadOlderLog);
+loadLog();
+setInterval(followLog, 5000);
+
+// Manual pump control: the controller carries out the dose
+function manualDose(pump, ml, started, failed) {
+    fetch('/dose/' + pump, {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({ml: ml})
+    })
+        .then(response => response.json())
+        .then(data => {
+            if(data.success) {
+                alert(started);
+            } else {
+                alert(failed + (data.error ? ': ' + data.error : ''));
+            }
+        });
+}
 
-// Manual pump control
 document.getElementById('dose_nutrient').addEventListener('click', function() {
     if(confirm('Dose 10ml of nutrients?')) {
-        fetch('/dose/nutrient/10')
-            .then(response => response.json())
-            .then(data => {
-                if(data.success) {
-                    alert('Nutrients dosed successfully');
-                } else {
-                    alert('Error dosing nutrients');
-                }
-            });
+        manualDose('nutrient', 10, 'Nutrients dose started', 'Error dosing nutrients');
     }
 });
 
 document.getElementById('dose_ph').addEventListener('click', function() {
     if(confirm('Dose 5ml of pH adjuster?')) {
-        fetch('/dose/ph/5')
-            .then(response => response.json())
-            .then(data => {
-                if(data.success) {
-                    alert('pH adjuster dosed successfully');
-                } else {
-                    alert('Error dosing pH adjuster');
-                }
-            });
+        manualDose('ph', 5, 'pH adjuster dose started', 'Error dosing pH adjuster');
     }
 });
\ No newline at end of file
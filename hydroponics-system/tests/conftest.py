@@ -0,0 +1,29 @@
+"""
+Test setup: the project's packages on sys.path and the simulated hardware
+installed before anything imports a driver
+"""
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+from run_benchmarks import setup_paths, configure
+
+setup_paths()
+import sim
+
+TANK = sim.install(temp_delay_scale=0)
+configure(tempfile.mkdtemp(prefix='hydroponic-test-'))
+
+
+@pytest.fixture(scope='module')
+def controller():
+    """A controller on the simulated tank, serving the command channel"""
+    import main
+    controller = main.HydroponicController()
+    controller.commands = main.start_commands(main.Settings, controller.handle_command)
+    yield controller
+    controller.stop()
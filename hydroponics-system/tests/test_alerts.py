@@ -0,0 +1,153 @@
+"""
+Alert pipeline: deduplication, hysteresis and rate limiting of alerts,
+and delivery to the sinks
+"""
+
+import time
+import threading
+
+from monitoring.alerts import AlertTracker, SinkWorker
+
+HOT = ('high_temperature', None, "Temperature too high: 31.0°C")
+
+
+def states(notifications):
+    return [event['state'] for event in notifications]
+
+
+def test_alert_is_raised_once_while_present():
+    tracker = AlertTracker(clear_readings=2, min_interval=300, repeat_interval=3600)
+    assert states(tracker.update([HOT], 0)) == ['raised']
+    for t in (60, 120, 180):
+        assert tracker.update([HOT], t) == []
+    assert tracker.active('high_temperature')
+
+
+def test_alert_clears_after_clear_readings():
+    tracker = AlertTracker(clear_readings=3, min_interval=0, repeat_interval=3600)
+    tracker.update([HOT], 0)
+    assert tracker.update([], 60) == []
+    assert tracker.update([], 120) == []
+    assert tracker.active('high_temperature')
+
+    cleared = tracker.update([], 180)
+    assert states(cleared) == ['cleared']
+    assert not tracker.active('high_temperature')
+    assert tracker.alerts == {}
+
+
+def test_condition_back_before_clear_readings_keeps_the_alert():
+    tracker = AlertTracker(clear_readings=2, min_interval=0, repeat_interval=3600)
+    tracker.update([HOT], 0)
+    tracker.update([], 60)
+    assert tracker.update([HOT], 120) == []
+    assert tracker.update([], 180) == []
+    assert tracker.active('high_temperature')
+
+
+def test_changes_within_min_interval_are_coalesced():
+    tracker = AlertTracker(clear_readings=1, min_interval=300, repeat_interval=3600)
+    tracker.update([HOT], 0)
+    assert tracker.update([], 60) == []       # cleared too soon after the raise
+    assert tracker.update([HOT], 120) == []   # back to the state last reported
+    assert tracker.update([], 180) == []
+
+    cleared = tracker.update([], 300)
+    assert states(cleared) == ['cleared']
+    assert cleared[0]['since'] == 180
+
+
+def test_critical_alerts_ignore_min_interval():
+    low = ('low_water_level', None, "Water level low: 4.0cm")
+    tracker = AlertTracker(clear_readings=1, min_interval=300, repeat_interval=3600)
+    assert states(tracker.update([low], 0)) == ['raised']
+    assert states(tracker.update([], 60)) == ['cleared']
+    assert states(tracker.update([low], 120)) == ['raised']
+
+
+def test_active_alert_repeats_every_repeat_interval():
+    tracker = AlertTracker(clear_readings=2, min_interval=300, repeat_interval=3600)
+    tracker.update([HOT], 0)
+    assert tracker.update([HOT], 3599) == []
+    assert states(tracker.update([HOT], 3600)) == ['repeated']
+    assert tracker.update([HOT], 3660) == []
+
+
+def test_sensor_alerts_are_tracked_per_sensor():
+    tracker = AlertTracker(clear_readings=1, min_interval=300)
+    events = tracker.update([('sensor_fault', 'ph', "pH sensor fault"),
+                             ('sensor_fault', 'tds', "TDS sensor fault")], 0)
+    assert sorted(event['subject'] for event in events) == ['ph', 'tds']
+    assert tracker.active('sensor_fault', 'ph')
+    assert not tracker.active('sensor_fault')
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+class RecordingSink:
+    """Sink that fails its first `failures` sends and can be held on `gate`"""
+
+    name = 'test'
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.attempts = 0
+        self.delivered = []
+        self.started = threading.Event()
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def send(self, event):
+        self.started.set()
+        self.gate.wait()
+        self.attempts += 1
+        if self.attempts <= self.failures:
+            raise OSError("connection refused")
+        self.delivered.append(event)
+
+
+def test_failed_delivery_is_retried():
+    sink = RecordingSink(failures=2)
+    worker = SinkWorker(sink, retries=2, retry_delay=0)
+    sent = worker.sent.value
+    worker.put(1)
+    wait_for(lambda: worker.sent.value > sent)
+    worker.stop(timeout=2)
+    assert sink.delivered == [1]
+    assert sink.attempts == 3
+    assert worker.sent.value == sent + 1
+
+
+def test_delivery_gives_up_after_retries():
+    sink = RecordingSink(failures=10)
+    worker = SinkWorker(sink, retries=2, retry_delay=0)
+    failures = worker.failures.value
+    worker.put(1)
+    wait_for(lambda: worker.failures.value > failures)
+    worker.stop(timeout=2)
+    assert sink.delivered == []
+    assert sink.attempts == 3
+    assert worker.failures.value == failures + 1
+
+
+def test_full_queue_drops_the_oldest_notification():
+    sink = RecordingSink()
+    sink.gate.clear()
+    worker = SinkWorker(sink, queue_size=2, retries=0, retry_delay=0)
+    dropped = worker.dropped.value
+
+    worker.put(1)
+    assert sink.started.wait(2)   # 1 is being sent, the queue is empty
+    for event in (2, 3, 4):
+        worker.put(event)          # 4 pushes out 2
+    assert worker.dropped.value == dropped + 1
+
+    sink.gate.set()
+    wait_for(lambda: len(sink.delivered) == 3)
+    worker.stop(timeout=2)
+    assert not worker.thread.is_alive()
+    assert sink.delivered == [1, 3, 4]
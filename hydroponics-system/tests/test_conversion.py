@@ -0,0 +1,37 @@
+"""
+ADC conversion tables
+"""
+
+import numpy as np
+
+from sensors.conversion import CodeTable, TemperatureTable
+from sensors.tds_sensor import TDSSensor
+
+
+def test_lookup_interpolates_between_codes():
+    table = CodeTable(lambda codes: codes * 2.0)
+    assert table.lookup(10.25) == 20.5
+    assert table.lookup(-3) == 0.0
+    assert table.lookup(5000) == 2046.0
+
+
+def test_temperature_table_builds_only_the_rows_a_block_needs():
+    tds = TDSSensor()
+    table = tds.lookup_table()
+    assert table.rows.count(None) == len(table.rows)
+
+    assert table.lookup(512.5, 21.3) == float(tds.curve(512.5, 21.3))
+    assert table.rows.count(None) == len(table.rows)
+
+    codes = np.arange(0, 1024, 7)
+    block = table.convert(codes, 21.0)
+    assert np.allclose(block, tds.curve(codes.astype(float), 21.0))
+    assert len(table.rows) - table.rows.count(None) == 2
+
+
+def test_temperature_outside_the_grid_is_evaluated_directly():
+    tds = TDSSensor()
+    table = tds.lookup_table()
+    codes = np.array([100, 600])
+    assert np.allclose(table.convert(codes, 45.0), tds.curve(codes.astype(float), 45.0))
+    assert table.rows.count(None) == len(table.rows)
@@ -0,0 +1,26 @@
+"""
+Model-based dosing in the controller
+"""
+
+from concurrent.futures import Future
+
+import pytest
+
+from controllers.pump_controller import Delivery
+
+
+def test_short_delivery_corrects_model_on_scheduler_thread(controller):
+    if not controller.dosing:
+        pytest.skip("threshold dosing")
+    dosing = controller.dosing['nutrient'][1]
+    future = Future()
+    controller.start_dose = lambda pump, ml: future
+    try:
+        controller.dose_modelled('nutrient', 6, 1000.0)
+        future.set_result(Delivery(6, 2.5, fault='stall'))
+        # Not applied from the pump thread; applied when the scheduler runs its commands
+        assert (1000.0, 6) in dosing.doses
+        controller.scheduler.run_commands()
+        assert (1000.0, 2.5) in dosing.doses and (1000.0, 6) not in dosing.doses
+    finally:
+        del controller.start_dose
@@ -0,0 +1,135 @@
+"""
+Streaming filter chains: the NumPy stages against plain scalar versions,
+and the state carried from one cycle's block to the next
+"""
+
+import statistics
+
+import numpy as np
+import pytest
+
+from sensors.filters import Despike, TrimmedMean, EMA, Kalman, FilterChain
+
+
+def blocks(count=6, size=32, seed=0):
+    """ADC-like sample blocks: a slow drift, dither and the odd spike"""
+    rng = np.random.default_rng(seed)
+    result = []
+    for n in range(count):
+        block = 500 + 4 * n + rng.integers(-3, 4, size)
+        block[rng.integers(0, size, 2)] = rng.choice([0, 1023], 2)
+        result.append(block.astype(float))
+    return result
+
+
+def despike_scalar(samples, k=3.0, min_mad=1.0):
+    median = statistics.median(samples)
+    mad = max(statistics.median(abs(x - median) for x in samples), min_mad)
+    return [x for x in samples if abs(x - median) <= k * mad]
+
+
+def trimmed_mean_scalar(samples, proportion):
+    ordered = sorted(samples)
+    cut = int(len(ordered) * proportion)
+    if cut and len(ordered) - 2 * cut > 0:
+        ordered = ordered[cut:len(ordered) - cut]
+    return sum(ordered) / len(ordered)
+
+
+class EMAScalar:
+    def __init__(self, alpha):
+        self.alpha = alpha
+        self.value = None
+
+    def add(self, x):
+        self.value = x if self.value is None else self.alpha * x + (1 - self.alpha) * self.value
+        return self.value
+
+
+class KalmanScalar:
+    def __init__(self, process_var, measurement_var):
+        self.process_var = process_var
+        self.measurement_var = measurement_var
+        self.value = None
+        self.variance = None
+
+    def add(self, samples):
+        measurement = sum(samples) / len(samples)
+        noise = self.measurement_var / len(samples)
+        if self.value is None:
+            self.value, self.variance = measurement, noise
+            return self.value
+        variance = self.variance + self.process_var
+        gain = variance / (variance + noise)
+        self.value += gain * (measurement - self.value)
+        self.variance = (1 - gain) * variance
+        return self.value
+
+
+def test_despike_matches_scalar():
+    despike = Despike(k=3.0)
+    for block in blocks():
+        kept = despike(block)
+        assert kept.tolist() == despike_scalar(block.tolist())
+        assert 0.0 not in kept and 1023.0 not in kept
+
+
+def test_despike_keeps_a_quiet_blocks_dither():
+    block = np.array([512.0] * 30 + [513.0, 511.0])
+    assert Despike(k=3.0)(block).size == block.size
+
+
+@pytest.mark.parametrize('proportion', [0.1, 0.2, 0.45])
+def test_trimmed_mean_matches_scalar(proportion):
+    for block in blocks():
+        assert TrimmedMean(proportion)(block) == pytest.approx(trimmed_mean_scalar(block.tolist(), proportion))
+
+
+def test_ema_folds_every_sample_across_cycles():
+    ema = EMA(alpha=0.3)
+    scalar = EMAScalar(0.3)
+    for block in blocks():
+        for x in block:
+            scalar.add(x)
+        assert ema(block) == pytest.approx(scalar.value)
+
+
+def test_ema_state_does_not_depend_on_block_boundaries():
+    samples = np.concatenate(blocks())
+    whole = EMA(alpha=0.1)(samples)
+    split = EMA(alpha=0.1)
+    for part in np.array_split(samples, 7):
+        value = split(part)
+    assert value == pytest.approx(whole)
+
+
+def test_kalman_matches_scalar():
+    kalman = Kalman(process_var=1.0, measurement_var=16.0)
+    scalar = KalmanScalar(1.0, 16.0)
+    for block in blocks():
+        assert kalman(block) == pytest.approx(scalar.add(block.tolist()))
+    assert kalman.variance == pytest.approx(scalar.variance)
+
+
+def test_chain_matches_scalar_pipeline():
+    chain = FilterChain.from_spec([('despike', 3.0), ('median',), ('ema', 0.3)])
+    ema = EMAScalar(0.3)
+    for block in blocks():
+        expected = ema.add(statistics.median(despike_scalar(block.tolist())))
+        assert chain.process(block) == pytest.approx(expected)
+
+
+def test_reset_forgets_carried_state():
+    chain = FilterChain.from_spec([('despike', 3.0), ('kalman', 1.0, 16.0)])
+    for block in blocks():
+        chain.process(block)
+    chain.reset()
+    fresh = FilterChain.from_spec([('despike', 3.0), ('kalman', 1.0, 16.0)])
+    block = blocks(seed=5)[0]
+    assert chain.process(block) == fresh.process(block)
+
+
+def test_spec_defaults_to_mean_and_rejects_unknown_stages():
+    assert FilterChain.from_spec(None).process([1, 2, 3, 6]) == 3.0
+    with pytest.raises(ValueError):
+        FilterChain.from_spec([('lowpass', 0.5)])
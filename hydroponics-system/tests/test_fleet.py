@@ -0,0 +1,89 @@
+"""
+Fleet telemetry: the collector's store and the unit's uplink spool
+"""
+
+import os
+import time
+import sqlite3
+
+import pytest
+
+from storage.fleet_store import FleetStore
+from storage.history_store import HOUR
+from storage.uplink import Uplink
+
+
+@pytest.fixture
+def fleet(tmp_path):
+    store = FleetStore(str(tmp_path / 'fleet.db'))
+    yield store
+    store.close()
+
+
+def make_batch(batch_id, ts):
+    return {'unit': 'tank-a', 'batch': batch_id,
+            'readings': [['ph', ts, 6.0], ['ph', ts + 1, 6.2]],
+            'events': [[ts, 'dose', 'ph_up', 1.5, True]]}
+
+
+def test_batch_sent_again_is_stored_once(fleet):
+    ts = (time.time() // HOUR - 1) * HOUR + 30
+    assert fleet.ingest(make_batch('1', ts))
+    assert not fleet.ingest(make_batch('1', ts))
+
+    assert fleet.compare('ph', 0, 1e12)['tank-a']['count'] == 2
+    assert len(fleet.events(0, 1e12)) == 1
+
+
+def test_failed_batch_leaves_nothing_behind(fleet, monkeypatch):
+    ts = (time.time() // HOUR - 1) * HOUR + 30
+
+    def fail(*args):
+        raise sqlite3.OperationalError("disk I/O error")
+
+    monkeypatch.setattr(fleet.history, '_rollup_rows', fail)
+    with pytest.raises(sqlite3.OperationalError):
+        fleet.ingest(make_batch('1', ts))
+    monkeypatch.undo()
+
+    assert fleet.units() == []
+    assert fleet.ingest(make_batch('1', ts))
+    assert fleet.compare('ph', 0, 1e12)['tank-a']['count'] == 2
+
+
+@pytest.fixture
+def uplink(tmp_path):
+    # Nothing listens here, so every batch stays spooled
+    uplink = Uplink('http://127.0.0.1:9', str(tmp_path / 'spool'), unit='tank-a',
+                    interval=3600, spool_max_bytes=1000, timeout=1)
+    yield uplink
+    uplink.stopping.set()
+
+
+def test_spool_is_tracked_without_rescanning(uplink, monkeypatch):
+    monkeypatch.setattr(os, 'listdir', None)  # only the startup scan may list the directory
+    for n in range(10):
+        uplink.spool(str(n), b'x' * 300)
+
+    assert list(uplink.spool_files) == ['7.json.gz', '8.json.gz', '9.json.gz']
+    assert uplink.spool_bytes == 900
+    assert uplink.thinning
+
+    uplink.remove('7.json.gz')
+    uplink.remove('8.json.gz')
+    uplink.check_spool()
+    assert uplink.spool_bytes == 300
+    assert not uplink.thinning
+
+
+def test_spool_survives_a_restart(uplink):
+    uplink.spool('1', b'x' * 100)
+    uplink.spool('2', b'x' * 200)
+    uplink.stopping.set()
+
+    restarted = Uplink('http://127.0.0.1:9', uplink.spool_dir, interval=3600, spool_max_bytes=1000)
+    try:
+        assert list(restarted.spool_files) == ['1.json.gz', '2.json.gz']
+        assert restarted.spool_bytes == 300
+    finally:
+        restarted.stopping.set()
@@ -0,0 +1,139 @@
+"""
+Sensor health checks: raw ADC signal faults, reading faults and the
+trust hysteresis dosing depends on
+"""
+
+import numpy as np
+import pytest
+
+from config.settings import Settings
+from sensors.health import RunningStats, Trend, SignalCheck, ReadingCheck, SensorState, HealthMonitor
+
+
+def dithering(code, size=64, seed=0):
+    """A healthy block: a code or two of dither around `code`"""
+    return code + np.random.default_rng(seed).integers(-2, 3, size)
+
+
+def test_running_stats_match_numpy():
+    data = np.random.default_rng(1).normal(500, 7, 512)
+    one_by_one = RunningStats(half_life=1e9)
+    for x in data:
+        one_by_one.add(x)
+    blocks = RunningStats(half_life=1e9)
+    for block in np.split(data, 8):
+        blocks.add_block(block)
+    for stats in (one_by_one, blocks):
+        assert stats.mean == pytest.approx(data.mean())
+        assert stats.std == pytest.approx(data.std(), rel=1e-6)
+
+
+def test_trend_slope():
+    trend = Trend(time_constant=1e9)
+    for t in range(0, 7200, 60):
+        trend.add(1000.0 + t, 6.0 + 0.001 * t)
+    assert trend.slope == pytest.approx(0.001)
+    assert trend.span() == 7140
+
+
+def test_healthy_signal_has_no_faults():
+    check = SignalCheck()
+    for seed in range(10):
+        assert check.update(dithering(512, seed=seed)) == set()
+
+
+@pytest.mark.parametrize('code', [0, 1023])
+def test_railed_signal(code):
+    block = dithering(512)
+    block[:40] = code
+    assert 'rail' in SignalCheck().update(block)
+
+
+def test_stuck_signal_builds_up_over_blocks():
+    check = SignalCheck(stuck_samples=256)
+    block = np.full(64, 600)
+    assert [('stuck' in check.update(block)) for _ in range(4)] == [False, False, False, True]
+    # One dithering block ends the run
+    assert 'stuck' not in check.update(dithering(600))
+
+
+def test_noisy_signal():
+    check = SignalCheck(max_noise=20.0)
+    noisy = 512 + np.random.default_rng(2).normal(0, 60, 64)
+    assert 'noisy' in check.update(noisy)
+
+
+def test_signal_moving_between_blocks_is_not_noise():
+    check = SignalCheck(max_noise=20.0)
+    for code in range(100, 900, 100):
+        assert 'noisy' not in check.update(dithering(code))
+
+
+def test_reading_out_of_range_and_failed_read():
+    check = ReadingCheck(valid_range=(0.0, 40.0))
+    assert check.update(85.0, 0) == ({'out_of_range'}, set())
+    assert check.update(None, 1) == ({'read_error'}, set())
+    assert check.update(21.0, 2) == (set(), set())
+
+
+def test_step_is_a_fault_unless_a_dose_is_mixing():
+    check = ReadingCheck(max_step=1.0)
+    check.update(6.0, 0)
+    assert check.update(7.5, 60)[0] == {'step'}
+    assert check.update(6.0, 120, mixing=True)[0] == set()
+
+
+def test_drift_warning_once_the_trend_covers_the_span():
+    check = ReadingCheck(drift_limit=0.5, drift_time_constant=1e9, min_drift_span=3600)
+    warnings = []
+    for t in range(0, 7200 + 1, 600):
+        faults, found = check.update(6.0 + t / 86400, t)  # 1 pH per day
+        warnings.append('drift' in found)
+    assert not warnings[0]
+    assert warnings[-1]
+    assert check.drift_per_day() == pytest.approx(1.0)
+
+
+def test_trust_returns_after_recovery_clean_readings():
+    state = SensorState('ph', recovery=3)
+    assert state.update({'step'}, set(), 0)
+    assert not state.trusted
+    assert not state.update(set(), set(), 1)
+    assert not state.update(set(), set(), 2)
+    assert state.update(set(), set(), 3)
+    assert state.trusted and state.since == 3
+
+
+def test_fault_during_recovery_starts_it_again():
+    state = SensorState('ph', recovery=3)
+    state.update({'step'}, set(), 0)
+    state.update(set(), set(), 1)
+    state.update(set(), set(), 2)
+    state.update({'out_of_range'}, set(), 3)
+    for t in (4, 5):
+        state.update(set(), set(), t)
+    assert not state.trusted
+    state.update(set(), set(), 6)
+    assert state.trusted
+
+
+def test_monitor_counts_signal_faults_and_reports_changes():
+    changes = []
+    health = HealthMonitor(Settings(), on_change=lambda name, state: changes.append((name, state.trusted)))
+    health.check_block('tds', np.zeros(64))
+    assert not health.check_reading('tds', 800.0, 0)
+    assert health.status()['tds']['faults'] == ['rail']
+
+    recovery = Settings.health_recovery_readings
+    for i in range(recovery):
+        health.check_block('tds', dithering(500, seed=i))
+        health.check_reading('tds', 800.0, 60 * (i + 1))
+    assert health.trusted('tds')
+    assert changes == [('tds', False), ('tds', True)]
+
+
+def test_calibration_resets_the_step_baseline():
+    health = HealthMonitor(Settings())
+    health.check_reading('ph', 6.0, 0)
+    health.calibration_applied('ph', 100.0)
+    assert health.check_reading('ph', 8.0, 60)
@@ -0,0 +1,29 @@
+"""
+The web interface's /history endpoint
+"""
+
+import pytest
+
+import web_interface
+
+
+@pytest.fixture
+def client(controller):
+    controller.history.flush()  # the database exists once the controller has run
+    return web_interface.app.test_client()
+
+
+@pytest.mark.parametrize('query', [
+    'range=inf', 'range=nan', 'start=nan', 'end=inf', 'start=-inf&end=100',
+    'start=200&end=100', 'start=100&end=100',
+    'points=0', 'points=-5', 'points=1', 'points=2', 'points=many', 'metric=flow',
+])
+def test_bad_query_is_refused(client, query):
+    assert client.get(f'/history?{query}').status_code == 400
+
+
+def test_history_series(client):
+    response = client.get('/history?metric=tds&range=3600&points=3')
+    assert response.status_code == 200
+    assert response.json['metric'] == 'tds'
+    assert len(response.json['points']) <= 3
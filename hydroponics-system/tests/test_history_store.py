@@ -0,0 +1,31 @@
+"""
+History store: raw readings and their rollups
+"""
+
+import time
+
+import pytest
+
+from storage.history_store import HistoryStore, HOUR
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = HistoryStore(str(tmp_path / 'history.db'))
+    yield store
+    store.close()
+
+
+def test_rollups_match_raw_readings_after_rewrite(store):
+    ts = (time.time() // HOUR - 1) * HOUR + 30
+    store.record(ts, {'tds': 100})
+    store.flush()
+    store.record(ts, {'tds': 300})
+    store.record(ts + 1, {'tds': 200})
+    store.record(ts + 1, {'tds': 500})
+    store.flush()
+
+    raw = store.query_raw('tds', 0, 1e12)
+    assert raw == [(ts, 100.0), (ts + 1, 200.0)]
+    ((bucket, count, mean, low, high),) = store.query_rollup('tds', 0, 1e12, HOUR)
+    assert (count, mean, low, high) == (2, 150.0, 100.0, 200.0)
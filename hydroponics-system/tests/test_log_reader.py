@@ -0,0 +1,122 @@
+"""
+Log reader: paging back and following the controller log across
+rotations into gzip archives
+"""
+
+import logging
+
+import pytest
+
+from storage.log_reader import LogReader
+from storage.log_writer import LogWriter
+
+
+def line(n):
+    return f"line {n:03d} " + 'x' * 91
+
+
+@pytest.fixture
+def log(tmp_path):
+    return tmp_path / 'controller.log'
+
+
+def write_lines(path, numbers):
+    """Log through a LogWriter rotating every 10 lines, keeping 3 archives"""
+    writer = LogWriter(str(path), logging.Formatter('%(message)s'), flush_bytes=0,
+                       max_bytes=1000, backup_count=3, console=False)
+    log = logging.getLogger(f"test-log-reader-{id(writer)}")
+    log.propagate = False
+    log.setLevel(logging.INFO)
+    log.addHandler(writer.handler)
+    try:
+        for n in numbers:
+            log.info(line(n))
+    finally:
+        log.removeHandler(writer.handler)
+        writer.stop()
+
+
+def messages(entries):
+    return [entry['msg'] for entry in entries]
+
+
+def test_tail_pages_back_through_every_archive(log):
+    write_lines(log, range(55))  # archives hold 20-49, the live file 50-54
+    reader = LogReader(str(log))
+
+    pages = []
+    entries, cursor = reader.tail(limit=8)
+    pages.append(messages(entries))
+    while cursor is not None:
+        entries, cursor = reader.tail(limit=8, before=cursor)
+        pages.append(messages(entries))
+
+    assert pages[0] == [line(n) for n in range(47, 55)]
+    assert [msg for page in reversed(pages) for msg in page] == [line(n) for n in range(20, 55)]
+
+
+def test_page_cursor_survives_a_rotation(log):
+    write_lines(log, range(55))
+    reader = LogReader(str(log))
+    first, cursor = reader.tail(limit=3)
+    assert messages(first) == [line(n) for n in range(52, 55)]
+
+    write_lines(log, range(55, 60))  # the live file is gzipped to .1.gz
+    entries, _ = reader.tail(limit=3, before=cursor)
+    assert messages(entries) == [line(n) for n in range(49, 52)]
+
+
+def test_follow_reads_on_across_rotations(log):
+    write_lines(log, range(55))
+    reader = LogReader(str(log))
+    cursor = reader.live_cursor()
+
+    write_lines(log, range(55, 75))  # 50-59 moves to .2.gz, 60-69 to .1.gz
+    entries, cursor, more = reader.follow(cursor)
+    assert messages(entries) == [line(n) for n in range(55, 75)]
+    assert not more
+
+    write_lines(log, range(75, 77))
+    entries, cursor, more = reader.follow(cursor)
+    assert messages(entries) == [line(n) for n in range(75, 77)]
+
+
+def test_follow_in_batches_hands_back_a_cursor(log):
+    write_lines(log, range(5))
+    reader = LogReader(str(log))
+    cursor = reader.live_cursor()
+    write_lines(log, range(5, 25))
+
+    seen = []
+    more = True
+    while more:
+        entries, cursor, more = reader.follow(cursor, limit=6)
+        seen.extend(messages(entries))
+    assert seen == [line(n) for n in range(5, 25)]
+
+
+def test_cursor_into_a_deleted_archive_restarts_at_the_live_end(log):
+    write_lines(log, range(5))
+    reader = LogReader(str(log))
+    cursor = reader.live_cursor()
+
+    write_lines(log, range(5, 50))  # 0-9 rotates past the 3 archives kept
+    entries, cursor, more = reader.follow(cursor)
+    assert entries is None and not more
+    assert cursor == reader.live_cursor()
+
+
+def test_archive_index_is_rebuilt_only_when_an_archive_changes(log, monkeypatch):
+    write_lines(log, range(25))
+    reader = LogReader(str(log))
+    reader.files()
+    built = dict(reader.index)
+
+    monkeypatch.setattr(reader, 'read_archive', None)  # a rebuild would fail
+    reader.files()
+    assert reader.index == built
+
+    monkeypatch.undo()
+    write_lines(log, range(25, 30))  # shifts every archive
+    ids = [file_id for file_id, opener, last_ts in reader.files()]
+    assert len(set(ids)) == len(ids) == 3
@@ -0,0 +1,79 @@
+"""
+Log writer: batched writes from the background thread and size-based
+rotation into gzip archives
+"""
+
+import os
+import gzip
+import logging
+
+from storage.log_writer import LogWriter, JSONFormatter
+
+LINE_BYTES = 101  # line() plus its newline
+
+
+def line(n):
+    return f"line {n:03d} " + 'x' * 91
+
+
+def write_lines(path, numbers, **options):
+    """Log one line per number through a LogWriter, then stop it so everything is written"""
+    options = {'flush_bytes': 0, 'max_bytes': 1000, 'backup_count': 3, 'console': False, **options}
+    writer = LogWriter(str(path), logging.Formatter('%(message)s'), **options)
+    log = logging.getLogger(f"test-log-writer-{id(writer)}")
+    log.propagate = False
+    log.setLevel(logging.INFO)
+    log.addHandler(writer.handler)
+    try:
+        for n in numbers:
+            log.info(line(n))
+    finally:
+        log.removeHandler(writer.handler)
+        writer.stop()
+    return writer
+
+
+def lines_of(path):
+    opener = gzip.open if str(path).endswith('.gz') else open
+    with opener(path, 'rt') as f:
+        return f.read().splitlines()
+
+
+def test_file_past_max_bytes_is_compressed_to_the_first_archive(tmp_path):
+    log = tmp_path / 'controller.log'
+    write_lines(log, range(12))
+    assert lines_of(f"{log}.1.gz") == [line(n) for n in range(10)]
+    assert lines_of(log) == [line(10), line(11)]
+    assert os.path.getsize(log) == 2 * LINE_BYTES
+    assert not os.path.exists(f"{log}.2.gz")
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(('.tmp', '.rotating'))]
+
+
+def test_archives_shift_up_and_only_backup_count_are_kept(tmp_path):
+    log = tmp_path / 'controller.log'
+    write_lines(log, range(55))
+    assert lines_of(f"{log}.1.gz") == [line(n) for n in range(40, 50)]
+    assert lines_of(f"{log}.2.gz") == [line(n) for n in range(30, 40)]
+    assert lines_of(f"{log}.3.gz") == [line(n) for n in range(20, 30)]
+    assert not os.path.exists(f"{log}.4.gz")
+    assert lines_of(log) == [line(n) for n in range(50, 55)]
+
+
+def test_without_backups_the_file_is_truncated(tmp_path):
+    log = tmp_path / 'controller.log'
+    write_lines(log, range(15), backup_count=0)
+    assert lines_of(log) == [line(n) for n in range(10, 15)]
+    assert os.listdir(tmp_path) == ['controller.log']
+
+
+def test_batched_lines_are_written_on_stop(tmp_path):
+    log = tmp_path / 'controller.log'
+    write_lines(log, range(5), flush_bytes=1 << 20, flush_interval=3600)
+    assert lines_of(log) == [line(n) for n in range(5)]
+
+
+def test_json_lines_carry_structured_fields():
+    formatter = JSONFormatter()
+    record = logging.makeLogRecord({'name': 'sensors', 'levelno': logging.INFO, 'levelname': 'INFO',
+                                    'msg': "pH 6.1", 'fields': {'ph': 6.1}})
+    assert formatter.format(record).endswith('"logger":"sensors","msg":"pH 6.1","ph":6.1}')
@@ -0,0 +1,57 @@
+"""
+Manual doses from the web interface, carried out by the controller
+"""
+
+import time
+
+import pytest
+
+import web_interface
+from conftest import TANK
+
+
+def run_commands(controller):
+    controller.scheduler.run_commands()
+
+
+def wait_for_dose(count, timeout=5):
+    deadline = time.monotonic() + timeout
+    while len(TANK.dose_log) < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return TANK.dose_log[count - 1:]
+
+
+def test_dose_route_doses_through_controller(controller):
+    client = web_interface.app.test_client()
+    before = len(TANK.dose_log)
+    response = client.post('/dose/nutrient', json={'ml': 4})
+    assert response.status_code == 200 and response.json['success']
+
+    run_commands(controller)
+    ts, pump_type, ml = wait_for_dose(before + 1)[-1]
+    assert (pump_type, ml) == ('nutrient', 4)
+
+
+@pytest.mark.parametrize('body', [{'ml': 1000}, {'ml': 0}, {'ml': -2}])
+def test_dose_route_refuses_bad_amounts(controller, body):
+    client = web_interface.app.test_client()
+    response = client.post('/dose/nutrient', json=body)
+    assert response.status_code == 409
+    assert not response.json['success']
+    assert controller.scheduler.commands.empty()
+
+
+def test_dose_route_is_post_only(controller):
+    client = web_interface.app.test_client()
+    assert client.get('/dose/nutrient').status_code == 405
+    assert client.post('/dose/nutrient', json={'ml': 'lots'}).status_code == 400
+
+
+def test_manual_dose_refused_on_untrusted_reading(controller):
+    controller.health.states['tds'].trusted = False
+    try:
+        with pytest.raises(ValueError):
+            controller.manual_dose('nutrient', 5)
+    finally:
+        controller.health.states['tds'].trusted = True
+
@@ -0,0 +1,39 @@
+"""
+Runtime metrics: families, their children and the text exposition
+"""
+
+import pytest
+
+from monitoring.metrics import Registry, Family, Counter, Gauge, Histogram
+
+
+def test_family_without_a_child_type_cannot_be_created():
+    with pytest.raises(TypeError):
+        Family('hydroponic_untyped', 'No child type', registry=Registry())
+
+
+def test_labelled_children_are_created_once():
+    counter = Counter('hydroponic_reads_total', 'Reads', ['sensor'], registry=Registry())
+    assert counter.labels('ph') is counter.labels('ph')
+    assert counter.labels('ph') is not counter.labels('tds')
+
+
+def test_render():
+    registry = Registry()
+    Counter('hydroponic_reads_total', 'Reads', ['sensor'], registry=registry).labels('ph').inc(2)
+    Gauge('hydroponic_level_cm', 'Water level', registry=registry).set(18.5)
+    Histogram('hydroponic_read_seconds', 'Read time', registry=registry, buckets=(0.1, 1.0)).observe(0.5)
+
+    text = registry.render()
+    assert '# TYPE hydroponic_reads_total counter\nhydroponic_reads_total{sensor="ph"} 2.0\n' in text
+    assert 'hydroponic_level_cm 18.5\n' in text
+    assert 'hydroponic_read_seconds_bucket{le="0.1"} 0.0\n' in text
+    assert 'hydroponic_read_seconds_bucket{le="1.0"} 1.0\n' in text
+    assert 'hydroponic_read_seconds_count 1.0\n' in text
+
+
+def test_names_are_registered_once():
+    registry = Registry()
+    Gauge('hydroponic_level_cm', 'Water level', registry=registry)
+    with pytest.raises(ValueError):
+        Gauge('hydroponic_level_cm', 'Water level', registry=registry)
@@ -0,0 +1,164 @@
+"""
+PicoLink against the simulated Pico firmware: retransmission, reconnects
+and duplicate suppression
+"""
+
+import random
+import itertools
+
+import pytest
+
+import sim.serial
+from sim.tank import TankModel
+import controllers.pico_protocol as pico
+from controllers.pump_controller import PumpController
+
+ports = itertools.count()
+
+
+@pytest.fixture
+def tank():
+    return TankModel()
+
+
+def attach(tank, protocol):
+    name = f"/dev/ttyTEST{next(ports)}"
+    sim.serial.attach_pico(name, 'nutrient', tank, protocol=protocol)
+    return name
+
+
+@pytest.fixture
+def port(tank):
+    """A fresh simulated Pico driving the nutrient pump of `tank`"""
+    yield attach(tank, 'framed')
+    sim.serial.settings['loss'] = 0.0
+
+
+def open_pump(port, **options):
+    return PumpController(port, 'nutrient', settle_time=0, timeout=0.2, **options)
+
+
+def dosed(tank):
+    return [ml for ts, pump_type, ml in tank.dose_log]
+
+
+def test_dose_reported_when_pump_stops(tank, port):
+    pump = open_pump(port)
+    try:
+        delivery = pump.dose_async(2).result(timeout=5)
+    finally:
+        pump.close()
+    assert delivery and delivery.confirmed
+    assert delivery.delivered == pytest.approx(2)
+    assert dosed(tank) == [2]
+
+
+def test_new_link_is_not_taken_for_a_retransmit(tank, port):
+    # The Pico keeps its recent sequence numbers across a reconnect; a new
+    # session numbering from the same point must still run its doses
+    for ml in (2, 3):
+        pump = open_pump(port)
+        try:
+            delivery = pump.dose_async(ml).result(timeout=5)
+        finally:
+            pump.close()
+        assert delivery and delivery.confirmed
+    assert dosed(tank) == [2, 3]
+
+
+def test_reconnect_after_link_drop(tank, port):
+    pump = open_pump(port)
+    try:
+        assert pump.dose_async(1).result(timeout=5)
+        pump.link.ser.close()  # the Pico drops off the bus
+        delivery = pump.dose_async(2).result(timeout=10)
+        assert pump.link.reconnects >= 1
+    finally:
+        pump.close()
+    assert delivery and delivery.confirmed
+    assert dosed(tank) == [1, 2]
+
+
+def test_lossy_link_never_doses_twice(tank, port):
+    random.seed(3)  # the simulated line drops frames at random
+    sim.serial.settings['loss'] = 0.3
+    pump = open_pump(port, retries=20)
+    try:
+        deliveries = [pump.dose_async(ml).result(timeout=30) for ml in (1, 2, 3)]
+    finally:
+        pump.close()
+    assert pump.link.retransmits.value > 0
+    # Every dose ran exactly once, however many times its frame was sent
+    assert dosed(tank) == [1, 2, 3]
+    for ml, delivery in zip((1, 2, 3), deliveries):
+        assert delivery.delivered == pytest.approx(ml)
+
+
+def drop_first(board, msg_type):
+    """Lose the first frame of `msg_type` the simulated Pico sends"""
+    reply = board.reply
+    dropped = []
+
+    def lossy(data, delay=None):
+        if not dropped and data[3] == msg_type:
+            dropped.append(data)
+            return
+        reply(data, delay)
+    board.reply = lossy
+    return dropped
+
+
+def test_lost_ack_is_resent_and_the_dose_runs_once(tank, port):
+    dropped = drop_first(sim.serial.picos[port], pico.ACK)
+    pump = open_pump(port)
+    try:
+        delivery = pump.dose_async(2).result(timeout=5)
+    finally:
+        pump.close()
+    assert dropped and pump.link.retransmits.value > 0
+    # The Pico answered the resent DOSE from its reply cache
+    assert delivery and delivery.confirmed
+    assert dosed(tank) == [2]
+
+
+def test_nak_is_resent(tank, port):
+    board = sim.serial.picos[port]
+    handle = board.handle_frame
+    naked = []
+
+    def refuse_first_dose(version, msg_type, seq, payload):
+        if msg_type == pico.DOSE and not naked:
+            naked.append(seq)
+            board.send(pico.NAK, seq, bytes([pico.NAK_CRC]))
+            return
+        handle(version, msg_type, seq, payload)
+    board.handle_frame = refuse_first_dose
+
+    pump = open_pump(port)
+    try:
+        delivery = pump.dose_async(3).result(timeout=5)
+    finally:
+        pump.close()
+    assert naked and pump.link.retransmits.value > 0
+    assert delivery and delivery.confirmed
+    assert dosed(tank) == [3]
+
+
+def test_ascii_reply_lost_after_the_dose_went_out(tank):
+    pump = open_pump(attach(tank, 'ascii'), protocol='ascii')
+    try:
+        assert pump.dose_async(1).result(timeout=5)
+        ser = pump.link.ser
+        readline = ser.readline
+
+        def unplugged():
+            readline()  # the Pico ran the dose; its ACK never reaches us
+            raise sim.serial.SerialException("device reports readiness to read but returned no data")
+        ser.readline = unplugged
+        delivery = pump.dose_async(2).result(timeout=5)
+    finally:
+        pump.close()
+    # Counted as delivered, so the controller does not dose it again
+    assert not delivery and delivery.fault == 'unconfirmed'
+    assert delivery.delivered == 2
+    assert dosed(tank) == [1, 2]
@@ -0,0 +1,28 @@
+"""
+Replay: the controller's decisions on recorded readings
+"""
+
+import replay
+
+
+def records(tds, count=60):
+    for i in range(count):
+        yield 1.7e9 + i * 60, {'tds': tds, 'ph': 6.0, 'temperature': 22.0, 'water_level': 20.0}, []
+
+
+def test_replay_uses_the_controllers_decision_state():
+    controller = replay.ReplayController(replay.Settings())
+    assert not controller.owns_history and not controller.owns_dispatcher and not controller.owns_uplink
+    assert controller.health.trusted('tds')
+    assert controller.dosing is None or set(controller.dosing) == set(replay.PUMPS)
+
+
+def test_low_tds_is_dosed_and_in_band_is_not():
+    low = replay.replay(records(100), {'dosing_mode': 'model'})
+    assert low['doses']['nutrient'] > 0
+    assert low['out_of_band_fraction']['tds'] == 1.0
+
+    settings = replay.Settings()
+    in_band = (settings.target_tds_min + settings.target_tds_max) / 2
+    steady = replay.replay(records(in_band), {'dosing_mode': 'model'})
+    assert steady['doses']['nutrient'] == 0
@@ -0,0 +1,69 @@
+"""
+Deadline scheduler on a simulated clock
+"""
+
+import os
+import signal
+import threading
+
+from controllers.scheduler import Scheduler
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_trigger_keeps_lead_of_tasks_added_ahead():
+    clock = Clock()
+    scheduler = Scheduler(clock)
+    runs = []
+    scheduler.add('temperature_start', lambda: runs.append(('start', clock.now)), interval=60, delay=-0.75)
+    scheduler.add('temperature', lambda: runs.append(('read', clock.now)), interval=60)
+    scheduler.run_pending()
+    runs.clear()
+
+    clock.now += 10
+    scheduler.trigger()
+    wait = scheduler.run_pending()
+    assert runs == [('start', 110.0)]
+    assert wait == 0.75
+
+    clock.now += wait
+    scheduler.run_pending()
+    assert runs == [('start', 110.0), ('read', 110.75)]
+
+
+def test_trigger_runs_tasks_without_lead_at_once():
+    clock = Clock()
+    scheduler = Scheduler(clock)
+    runs = []
+    scheduler.add('adc', lambda: runs.append(clock.now), interval=60)
+    scheduler.run_pending()
+    clock.now += 5
+    scheduler.trigger('adc')
+    scheduler.run_pending()
+    assert runs == [100.0, 105.0]
+
+
+def test_signal_handler_trigger_runs_on_the_loop():
+    scheduler = Scheduler()
+    ran = threading.Event()
+    scheduler.add('adc', ran.set, interval=3600)
+    scheduler.run_pending()
+    ran.clear()
+
+    previous = signal.signal(signal.SIGUSR1, lambda sig, frame: scheduler.request_trigger())
+    loop = threading.Thread(target=scheduler.run)
+    try:
+        loop.start()
+        os.kill(os.getpid(), signal.SIGUSR1)
+        assert ran.wait(2)
+    finally:
+        signal.signal(signal.SIGUSR1, previous)
+        scheduler.stop()
+        loop.join(2)
+    assert not loop.is_alive()
@@ -0,0 +1,86 @@
+"""
+Temperature used to compensate TDS readings, and pH acted on without
+waiting for the temperature read
+"""
+
+import time
+
+import pytest
+
+import replay
+
+
+def make_controller():
+    return replay.ReplayController(replay.Settings())
+
+
+def read_temperature(controller, value, ts):
+    controller.data['temperature'] = value
+    controller.assess_readings(['temperature'], ts)
+
+
+def test_no_compensation_before_a_temperature_is_read():
+    controller = make_controller()
+    assert controller.data['temperature'] == 0
+    assert controller.compensation_temperature() == 25.0
+
+
+def test_freezing_water_is_a_reading():
+    controller = make_controller()
+    read_temperature(controller, 0.0, 1000.0)
+    assert controller.compensation_temperature() == 0.0
+
+
+def test_untrusted_temperature_is_not_used():
+    controller = make_controller()
+    read_temperature(controller, 21.0, 1000.0)
+    assert controller.compensation_temperature() == 21.0
+    read_temperature(controller, 85.0, 1001.0)
+    assert controller.compensation_temperature() == 21.0
+
+
+@pytest.fixture
+def readings(controller, monkeypatch):
+    """Feed the controller's temperature read; records the temperature each TDS conversion used"""
+    used = []
+    read = controller.tds_sensor.read
+
+    def tds_read(temperature=25.0, samples=None):
+        used.append(temperature)
+        return read(temperature, samples)
+    monkeypatch.setattr(controller.tds_sensor, 'read', tds_read)
+    monkeypatch.setattr(controller.settings, 'concurrent_acquisition', True)
+    return used
+
+
+def collect_returning(controller, monkeypatch, value, delay=0.0):
+    def collect():
+        time.sleep(delay)
+        return {controller.temp_sensor.primary: value}
+    monkeypatch.setattr(controller.temp_sensor, 'collect', collect)
+
+
+def test_glitch_never_compensates_tds_in_its_own_cycle(controller, readings, monkeypatch):
+    collect_returning(controller, monkeypatch, 21.0)
+    controller.read_sensors()
+    assert controller.health.trusted('temperature')
+    assert readings[-1] == 21.0
+
+    # A DS18B20 power-on 85°C arrives while the sensor is still trusted
+    collect_returning(controller, monkeypatch, 85.0)
+    controller.read_sensors()
+    assert readings[-1] == 21.0
+    assert not controller.health.trusted('temperature')
+
+
+def test_stuck_temperature_read_does_not_delay_ph(controller, readings, monkeypatch):
+    acted = []
+    monkeypatch.setattr(controller, 'control_ph', lambda: acted.append(time.monotonic()))
+    collect_returning(controller, monkeypatch, 21.0, delay=1.0)
+
+    start = time.monotonic()
+    controller.read_sensors()
+    controller.control()
+    assert len(acted) == 1  # not again after the reads
+    assert acted[0] - start < 0.5
+    assert time.monotonic() - start >= 1.0
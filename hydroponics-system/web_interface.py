@@ -1,63 +1,331 @@
+#!/usr/bin/env python3
 """
-Controls peristaltic pumps via Raspberry Pi Pico
-Uses UART communication to send pump commands
+Hydroponic System Web Dashboard
+Serves the dashboard, the latest sensor snapshot and sensor history
 """
 
-import serial
+import os
+import json
+import math
 import time
 import logging
+import sqlite3
+import threading
+from flask import Flask, Response, jsonify, render_template, request, abort
+
+from config.settings import Settings
+from controllers.command_channel import send_command
+from storage.history_store import HistoryStore
+from storage.downsample import lttb, minmax
+from storage.snapshot_channel import SnapshotChannel
+from storage.log_reader import LogReader
+from monitoring.metrics import METRICS_CAPACITY
 
 logger = logging.getLogger(__name__)
 
-class PumpController:
-    def __init__(self, port, pump_type, baudrate=9600, timeout=1):
-        self.port = port
-        self.pump_type = pump_type  # 'nutrient' or 'ph'
-        self.baudrate = baudrate
-        self.timeout = timeout
-        self.ser = None
+app = Flask(__name__)
+settings = Settings()
 
-        try:
-            self.ser = serial.Serial(port, baudrate, timeout=timeout)
-            time.sleep(2)  # Wait for serial connection to establish
-            logger.info(f"Connected to {pump_type} pump controller at {port}")
-        except Exception as e:
-            logger.error(f"Failed to connect to pump controller at {port}: {e}")
-
-    def dose(self, ml_amount):
-        """Dose a specific amount in milliliters"""
-        if self.ser is None:
-            logger.error(f"Pump controller not connected for {self.pump_type} pump")
-            return False
+METRICS = ('tds', 'ph', 'temperature', 'water_level')
+MAX_HISTORY_POINTS = 5000
+MIN_HISTORY_POINTS = 3      # LTTB keeps the first and last point and needs one between
+MAX_LOG_ENTRIES = 500
+
+history = None
+metrics_channel = None
+log_reader = LogReader(settings.log_file)
+
+
+class SnapshotBroadcaster:
+    """Watch the controller's snapshot and fan each new one out to all clients
+
+    One background thread checks the shared-memory sequence number (or,
+    when the controller has no shared memory, the data file's mtime) and
+    reads the snapshot only when it changes, then wakes every waiting
+    stream. Clients never touch the snapshot source themselves.
+    """
+
+    def __init__(self, shm_path, path, poll_interval=1.0):
+        self.shm_path = shm_path
+        self.path = path
+        self.poll_interval = poll_interval
+        self.condition = threading.Condition()
+        self.version = 0
+        self.payload = None
+        self.source_version = None
+        self.channel = None
+        self.thread = None
 
+    def start(self):
+        with self.condition:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='snapshot-watcher', daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while True:
+            self.check()
+            time.sleep(self.poll_interval)
+
+    def read_shared(self):
+        """(sequence, payload) from shared memory, or None if unavailable"""
+        if self.channel is None:
+            try:
+                self.channel = SnapshotChannel(self.shm_path)
+            except (OSError, ValueError):
+                return None
+        seq = self.channel.sequence()
+        if seq == 0:
+            return None
+        if ('shm', seq) == self.source_version:
+            return self.source_version, None
+        seq, payload = self.channel.read()
+        return ('shm', seq), payload
+
+    def read_file(self):
+        """(mtime/size, payload) from the JSON fallback file"""
+        st = os.stat(self.path)
+        stat = ('file', st.st_mtime_ns, st.st_size)
+        if stat == self.source_version:
+            return stat, None
+        with open(self.path) as f:
+            return stat, json.dumps(json.load(f))
+
+    def check(self):
+        """Reload the snapshot if its source changed and notify waiters"""
         try:
-            # Format: "DOSE <type> <amount>\n"
-            command = f"DOSE {self.pump_type} {ml_amount}\n".encode()
-            self.ser.write(command)
-
-            # Wait for acknowledgment
-            response = self.ser.readline().decode().strip()
-            if response == "ACK":
-                logger.info(f"Dosed {ml_amount}ml of {self.pump_type}")
-                return True
-            else:
-                logger.warning(f"Unexpected response from pump: {response}")
-                return False
-        except Exception as e:
-            logger.error(f"Error sending dose command: {e}")
-            return False
-
-    def stop(self):
-        """Emergency stop the pump"""
-        if self.ser is None:
+            source_version, payload = self.read_shared() or self.read_file()
+        except (OSError, ValueError):
+            # Missing or unreadable source; try again on the next poll
+            return
+        if payload is None:
             return
 
-        try:
-            self.ser.write(b"STOP\n")
-        except Exception as e:
-            logger.error(f"Error sending stop command: {e}")
-
-    def close(self):
-        """Close serial connection"""
-        if self.ser is not None:
-            self.ser.close()
\ No newline at end of file
+        with self.condition:
+            self.source_version = source_version
+            self.version += 1
+            self.payload = payload
+            self.condition.notify_all()
+
+    def wait(self, version, timeout):
+        """Block until a snapshot newer than `version` exists or timeout"""
+        self.start()
+        with self.condition:
+            self.condition.wait_for(lambda: self.version != version, timeout)
+            return self.version, self.payload
+
+
+snapshots = SnapshotBroadcaster(settings.snapshot_shm_path, settings.data_file)
+
+
+def get_history():
+    """Open the history database read-only on first use"""
+    global history
+    if history is None:
+        history = HistoryStore(settings.history_db, readonly=True)
+    return history
+
+
+@app.route('/')
+def index():
+    return render_template('index.html')
+
+
+@app.route('/data')
+def data():
+    """Latest sensor snapshot written by the controller"""
+    version, payload = snapshots.wait(0, 1.0)
+    if payload is None:
+        return jsonify({'error': 'no data'}), 503
+    return Response(payload, mimetype='application/json')
+
+
+@app.route('/data/<tank>')
+def tank_data(tank):
+    """Latest snapshot of one tank in multi-tank mode"""
+    version, payload = snapshots.wait(0, 1.0)
+    if payload is None:
+        return jsonify({'error': 'no data'}), 503
+    tanks = json.loads(payload).get('tanks', {})
+    if tank not in tanks:
+        abort(404)
+    return jsonify(tanks[tank])
+
+
+@app.route('/stream')
+def stream():
+    """Server-Sent Events: push each new snapshot as the controller writes it"""
+    def events():
+        version = 0
+        while True:
+            latest, payload = snapshots.wait(version, 15)
+            if latest != version and payload is not None:
+                version = latest
+                yield f"data: {payload}\n\n"
+            else:
+                yield ": keepalive\n\n"
+
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/history')
+def history_series():
+    """Downsampled history for one metric
+
+    Query parameters:
+      metric  - tds, ph, temperature or water_level
+      tank    - tank name in multi-tank mode
+      start   - epoch seconds (default: end - range)
+      end     - epoch seconds (default: newest stored reading)
+      range   - seconds before end when start is omitted (default: 1 day)
+      points  - target number of points, at least 3 (default 300)
+      mode    - 'lttb' (default) or 'minmax'
+    """
+    metric = request.args.get('metric', 'tds')
+    mode = request.args.get('mode', 'lttb')
+    if metric not in METRICS or mode not in ('lttb', 'minmax'):
+        abort(400)
+    tank = request.args.get('tank')
+    if tank:
+        metric = f"{tank}.{metric}"
+    try:
+        points = min(int(request.args.get('points', 300)), MAX_HISTORY_POINTS)
+        span = float(request.args.get('range', 86400))
+        start = request.args.get('start', type=float)
+        end = request.args.get('end', type=float)
+    except ValueError:
+        abort(400)
+    if points < MIN_HISTORY_POINTS or not all(math.isfinite(x) for x in (span, start, end) if x is not None):
+        abort(400)
+
+    try:
+        store = get_history()
+        last_modified = store.last_modified()
+    except sqlite3.Error as e:
+        logger.error(f"Error opening history: {e}")
+        return jsonify({'error': 'no history'}), 503
+
+    # Anchor open-ended ranges on the newest reading rather than the wall
+    # clock, so repeated dashboard loads between flushes hit the same ETag
+    if end is None:
+        end = (last_modified or time.time()) + 1
+    if start is None:
+        start = end - span
+    if start >= end:
+        abort(400)
+
+    etag = f"{metric}-{mode}-{start:.0f}-{end:.0f}-{points}-{last_modified or 0:.0f}"
+    response = app.response_class(mimetype='application/json')
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    if last_modified is not None:
+        response.last_modified = min(last_modified, end)
+    if request.if_none_match.contains(etag):
+        response.status_code = 304
+        return response
+
+    # Fetch up to 8x the requested points from the finest fitting
+    # resolution, then reduce to the target
+    series = store.query(metric, start, end, max_points=points * 8)
+    if mode == 'minmax':
+        reduced = minmax(series, points)
+    else:
+        reduced = lttb([(ts, mean) for ts, mean, low, high in series], points)
+
+    response.set_data(json.dumps({
+        'metric': metric,
+        'start': start,
+        'end': end,
+        'points': [[ts, round(value, 3)] for ts, value in reduced],
+    }))
+    return response
+
+
+@app.route('/metrics')
+def metrics():
+    """Controller metrics in the Prometheus text format, as last published"""
+    global metrics_channel
+    payload = None
+    try:
+        if metrics_channel is None:
+            metrics_channel = SnapshotChannel(settings.metrics_shm_path, METRICS_CAPACITY)
+        seq, payload = metrics_channel.read()
+    except (OSError, ValueError) as e:
+        logger.error(f"Error reading metrics: {e}")
+    if payload is None:
+        return Response("# controller metrics unavailable\n", status=503, mimetype='text/plain')
+    return Response(json.loads(payload), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+@app.route('/logs')
+def logs():
+    """Controller log entries, newest last
+
+    Query parameters:
+      limit   - entries per response (default 50, at most 500)
+      level   - minimum level, e.g. WARNING
+      q       - keyword (case-insensitive)
+      after   - cursor from a previous response: only entries written since
+      before  - 'before' cursor from a previous response: the next older page
+      since   - epoch seconds: nothing older than this
+
+    Responses carry 'cursor' for the next `after` request and 'before' for
+    paging back (null when there is nothing older). With `after`, 'more'
+    says another request would return further entries straight away, and
+    'reset' that the cursor's file has been rotated out of reach.
+    """
+    try:
+        limit = max(1, min(int(request.args.get('limit', 50)), MAX_LOG_ENTRIES))
+        since = request.args.get('since', type=float)
+    except ValueError:
+        abort(400)
+    level = request.args.get('level')
+    keyword = request.args.get('q')
+    after = request.args.get('after')
+
+    try:
+        if after:
+            entries, cursor, more = log_reader.follow(after, limit, level, keyword)
+            if entries is not None:
+                return jsonify({'entries': entries, 'cursor': cursor, 'more': more})
+            entries, before = log_reader.tail(limit, level, keyword, since=since)
+            return jsonify({'entries': entries, 'cursor': cursor, 'before': before, 'reset': True})
+
+        cursor = log_reader.live_cursor()
+        entries, before = log_reader.tail(limit, level, keyword, request.args.get('before'), since)
+        return jsonify({'entries': entries, 'cursor': cursor, 'before': before})
+    except OSError as e:
+        logger.error(f"Error reading log: {e}")
+        return jsonify({'error': 'log unavailable'}), 503
+
+
+@app.route('/dose/<pump_type>', methods=['POST'])
+def dose(pump_type):
+    """Manual dose from the dashboard, carried out by the controller
+
+    JSON body: {"ml": amount, "tank": name (multi-tank mode)}. The
+    controller owns the pumps; it refuses amounts over the pump's
+    `*_max_dose_ml`, and any dose while the reading it moves is untrusted.
+    """
+    body = request.get_json(silent=True) or {}
+    ml = body.get('ml')
+    if pump_type not in ('nutrient', 'ph') or isinstance(ml, bool) or not isinstance(ml, (int, float)):
+        abort(400)
+    command = {'command': 'dose', 'pump': pump_type, 'ml': ml}
+    if body.get('tank'):
+        command['tank'] = body['tank']
+    try:
+        reply = send_command(settings.command_socket_path, command)
+    except (OSError, ValueError) as e:
+        logger.error(f"Error sending dose to controller: {e}")
+        return jsonify({'success': False, 'error': 'controller not running'}), 503
+    if not reply.get('ok'):
+        return jsonify({'success': False, 'error': reply.get('error')}), 409
+    return jsonify({'success': True})
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    snapshots.start()
+    app.run(host='0.0.0.0', port=5000, threaded=True)